@@ -6,7 +6,9 @@ __author__ = "Steven Kearnes"
 __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "BSD 3-clause"
 
+import multiprocessing
 import numpy as np
+from scipy import sparse as sp
 import types
 
 from rdkit import Chem
@@ -80,13 +82,19 @@ class Featurizer(object):
     topo_view : bool (default False)
         Whether the calculated features represent a topological view of the
         data.
+    execution_args : list
+        Names of constructor arguments that affect how features are
+        calculated (for example, worker counts or cache filenames) but not
+        the features themselves. These are not part of FeatureCache keys.
     """
     conformers = False
     name = None
     topo_view = False
+    execution_args = []
 
     def featurize(self, mols, parallel=False, client_kwargs=None,
-                  view_flags=None):
+                  view_flags=None, backend='ipython', n_jobs=None,
+                  chunk_size=100, pool=None):
         """
         Calculate features for molecules.
 
@@ -95,17 +103,34 @@ class Featurizer(object):
         mols : iterable
             RDKit Mol objects.
         parallel : bool, optional
-            Whether to train subtrainers in parallel using
-            IPython.parallel (default False).
+            Whether to calculate features in parallel (default False).
         client_kwargs : dict, optional
             Keyword arguments for IPython.parallel Client.
         view_flags : dict, optional
             Flags for IPython.parallel LoadBalancedView.
+        backend : str, optional (default 'ipython')
+            Parallel backend to use if parallel is True. Choose from:
+            * 'ipython' : IPython.parallel load-balanced view.
+            * 'multiprocessing' : local process pool.
+        n_jobs : int, optional
+            Number of worker processes for the multiprocessing backend.
+            Defaults to the number of CPUs.
+        chunk_size : int, optional (default 100)
+            Number of molecules sent to a worker process at a time by the
+            multiprocessing backend.
+        pool : multiprocessing.Pool, optional
+            Process pool (see get_pool) for the multiprocessing backend.
+            If provided, worker processes are reused instead of starting a
+            new pool for each call.
         """
         if self.conformers and isinstance(mols, types.GeneratorType):
             mols = list(mols)
 
-        if parallel:
+        if parallel and backend == 'multiprocessing':
+            features = self._featurize_multiprocessing(mols, n_jobs,
+                                                       chunk_size, pool)
+
+        elif parallel and backend == 'ipython':
             from IPython.parallel import Client
 
             if client_kwargs is None:
@@ -122,15 +147,84 @@ class Featurizer(object):
             # get output from engines
             call.display_outputs()
 
+        elif parallel:
+            raise NotImplementedError(
+                "Unrecognized backend '{}'.".format(backend))
+
         else:
-            features = [self._featurize(mol) for mol in mols]
+            features = self._featurize_batch(mols)
 
         if self.conformers:
             features = self.conformer_container(mols, features)
+        elif sp.issparse(features):
+            features = features.tocsr()
+        elif len(features) and sp.issparse(features[0]):
+            features = sp.vstack(features, format='csr')
         else:
             features = np.asarray(features)
         return features
 
+    def is_deterministic(self):
+        """
+        Whether calculated features only depend on the molecule and the
+        featurizer arguments. Features from featurizers that are not
+        deterministic (for example, randomized features without a seed)
+        are not cached by FeatureCache.
+        """
+        return True
+
+    def get_pool(self, n_jobs=None):
+        """
+        Create a process pool for the multiprocessing backend.
+
+        The pool can be passed to featurize to reuse worker processes
+        across calls. The caller is responsible for terminating the pool.
+
+        Parameters
+        ----------
+        n_jobs : int, optional
+            Number of worker processes. Defaults to the number of CPUs.
+        """
+        return multiprocessing.Pool(n_jobs, initializer=_init_worker,
+                                    initargs=(self,))
+
+    def _featurize_multiprocessing(self, mols, n_jobs=None, chunk_size=100,
+                                   pool=None):
+        """
+        Calculate features for molecules using a local process pool.
+
+        Molecules are sent to workers in chunks as RDKit binary strings,
+        which are much cheaper to pickle than Mol objects. Note that
+        molecule properties (such as names) are not preserved by this
+        conversion. Results are returned in the same order as the input
+        molecules.
+
+        Parameters
+        ----------
+        mols : iterable
+            RDKit Mol objects.
+        n_jobs : int, optional
+            Number of worker processes. Defaults to the number of CPUs.
+        chunk_size : int, optional (default 100)
+            Number of molecules per chunk.
+        pool : multiprocessing.Pool, optional
+            Process pool created by get_pool. If not provided, a new pool
+            is created and terminated when all results are collected.
+        """
+        if pool is not None:
+            results = pool.imap(_featurize_chunk,
+                                _get_binary_chunks(mols, chunk_size))
+            return _concatenate_chunks(list(results))
+        pool = self.get_pool(n_jobs)
+        try:
+            results = pool.imap(_featurize_chunk,
+                                _get_binary_chunks(mols, chunk_size))
+            features = _concatenate_chunks(list(results))
+        finally:
+            pool.terminate()  # all results have been collected
+            pool.join()
+        return features
+
     def _featurize(self, mol):
         """
         Calculate features for a single molecule.
@@ -142,8 +236,23 @@ class Featurizer(object):
         """
         raise NotImplementedError('Featurizer is not defined.')
 
+    def _featurize_batch(self, mols):
+        """
+        Calculate features for a batch of molecules.
+
+        Featurizers that can share work between molecules can override this
+        method. By default, _featurize is called for each molecule.
+
+        Parameters
+        ----------
+        mols : iterable
+            RDKit Mol objects.
+        """
+        return [self._featurize(mol) for mol in mols]
+
     def __call__(self, mols, parallel=False, client_kwargs=None,
-                 view_flags=None):
+                 view_flags=None, backend='ipython', n_jobs=None,
+                 chunk_size=100, pool=None):
         """
         Calculate features for molecules.
 
@@ -152,14 +261,22 @@ class Featurizer(object):
         mols : iterable
             RDKit Mol objects.
         parallel : bool, optional
-            Whether to train subtrainers in parallel using
-            IPython.parallel (default False).
+            Whether to calculate features in parallel (default False).
         client_kwargs : dict, optional
             Keyword arguments for IPython.parallel Client.
         view_flags : dict, optional
             Flags for IPython.parallel LoadBalancedView.
+        backend : str, optional (default 'ipython')
+            Parallel backend ('ipython' or 'multiprocessing').
+        n_jobs : int, optional
+            Number of worker processes for the multiprocessing backend.
+        chunk_size : int, optional (default 100)
+            Number of molecules per chunk for the multiprocessing backend.
+        pool : multiprocessing.Pool, optional
+            Process pool (see get_pool) for the multiprocessing backend.
         """
-        return self.featurize(mols, parallel, client_kwargs, view_flags)
+        return self.featurize(mols, parallel, client_kwargs, view_flags,
+                              backend, n_jobs, chunk_size, pool)
 
     def conformer_container(self, mols, features):
         """
@@ -190,30 +307,109 @@ class Featurizer(object):
         # - first axis = # mols
         # - second axis = max # conformers
         # - remaining axes = determined by feature shape
+        # - dtype = determined by feature dtype
         features_shape = None
         for i in xrange(len(features)):
             for j in xrange(len(features[i])):
                 if features[i][j] is not None:
-                    features_shape = features[i][0].shape
+                    features_shape = np.shape(features[i][j])
+                    features_dtype = np.asarray(features[i][j]).dtype
                     break
             if features_shape is not None:
                 break
         if features_shape is None:
             raise ValueError('Cannot find any features.')
         shape = (len(mols), max_confs) + features_shape
-        x = np.ma.masked_all(shape)
+        x = np.ma.masked_all(shape, dtype=features_dtype)
 
         # fill in the container
         for i, (mol, mol_features) in enumerate(zip(mols, features)):
             n_confs = max(mol.GetNumConformers(), 1)
             try:
                 x[i, :n_confs] = mol_features
-            except ValueError:  # handle None conformer values
+            except (TypeError, ValueError):  # handle None conformer values
                 for j in xrange(n_confs):
-                    x[i, j] = mol_features[j]
+                    if mol_features[j] is not None:
+                        x[i, j] = mol_features[j]
         return x
 
 
+# featurizer used by multiprocessing workers (set by _init_worker)
+_worker_featurizer = None
+
+
+def _init_worker(featurizer):
+    """
+    Initialize a multiprocessing worker.
+
+    The featurizer is stored as a module-level global so it is only sent
+    to each worker once instead of once per chunk.
+
+    Parameters
+    ----------
+    featurizer : Featurizer
+        Featurizer.
+    """
+    global _worker_featurizer
+    _worker_featurizer = featurizer
+
+
+def _featurize_chunk(chunk):
+    """
+    Calculate features for a chunk of molecules in a multiprocessing
+    worker.
+
+    Parameters
+    ----------
+    chunk : list
+        RDKit binary strings.
+    """
+    return _worker_featurizer._featurize_batch(
+        [Chem.Mol(binary) for binary in chunk])
+
+
+def _concatenate_chunks(chunks):
+    """
+    Combine features calculated for chunks of molecules.
+
+    Chunks returned by _featurize_batch as arrays or sparse matrices are
+    stacked directly. Otherwise, features for individual molecules are
+    collected in a list.
+
+    Parameters
+    ----------
+    chunks : list
+        Features for each chunk.
+    """
+    if len(chunks) and all(sp.issparse(chunk) for chunk in chunks):
+        return sp.vstack(chunks, format='csr')
+    if len(chunks) and all(isinstance(chunk, np.ndarray) and
+                           chunk.dtype != object for chunk in chunks):
+        return np.concatenate(chunks)
+    return [f for chunk in chunks for f in chunk]
+
+
+def _get_binary_chunks(mols, chunk_size):
+    """
+    Split molecules into chunks of RDKit binary strings.
+
+    Parameters
+    ----------
+    mols : iterable
+        RDKit Mol objects.
+    chunk_size : int
+        Number of molecules per chunk.
+    """
+    chunk = []
+    for mol in mols:
+        chunk.append(mol.ToBinary())
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk):
+        yield chunk
+
+
 class MolPreparator(object):
     """
     Molecule preparation prior to featurization.
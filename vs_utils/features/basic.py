@@ -6,6 +6,10 @@ __author__ = "Steven Kearnes"
 __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "BSD 3-clause"
 
+import numpy as np
+import re
+import time
+
 from rdkit.Chem import Descriptors
 
 from vs_utils.features import Featurizer
@@ -37,15 +41,42 @@ class SimpleDescriptors(Featurizer):
 
     See http://rdkit.org/docs/GettingStartedInPython.html
     #list-of-available-descriptors.
+
+    Descriptors that fail for a molecule are returned as NaN.
+
+    Parameters
+    ----------
+    descriptors : list or str, optional
+        Names of descriptors to calculate (a comma-separated string is also
+        accepted). Combined with any descriptors selected by groups. If
+        neither descriptors nor groups is provided, all descriptors are
+        calculated.
+    groups : list or str, optional
+        Descriptor groups to calculate (a comma-separated string is also
+        accepted). See DESCRIPTOR_GROUPS for available groups.
+    dtype : str, optional (default 'float64')
+        Output dtype. Use 'float32' to reduce memory usage, but note that
+        large descriptor values (for example, Ipc) can overflow to inf.
+    timing : bool, optional (default False)
+        Whether to record the total time spent on each descriptor in
+        self.timings (see get_timings). Times are only recorded when
+        descriptors are calculated in the current process (that is, not
+        by parallel workers).
     """
     name = 'descriptors'
+    execution_args = ['timing']
 
-    def __init__(self):
+    def __init__(self, descriptors=None, groups=None, dtype='float64',
+                 timing=False):
         self.descriptors = []
         self.functions = []
-        for descriptor, function in Descriptors.descList:
+        for descriptor, function in get_descriptor_list(descriptors, groups):
             self.descriptors.append(descriptor)
             self.functions.append(function)
+        self.dtype = np.dtype(dtype)
+        self.timing = timing
+        self.timings = dict((descriptor, 0.)
+                            for descriptor in self.descriptors)
 
     def _featurize(self, mol):
         """
@@ -56,7 +87,109 @@ class SimpleDescriptors(Featurizer):
         mol : RDKit Mol
             Molecule.
         """
-        rval = []
-        for function in self.functions:
-            rval.append(function(mol))
+        rval = np.empty(len(self.functions), dtype=self.dtype)
+        self._calculate(mol, rval)
+        return rval
+
+    def _featurize_batch(self, mols):
+        """
+        Calculate RDKit descriptors for a batch of molecules.
+
+        Descriptors are written into a preallocated matrix.
+
+        Parameters
+        ----------
+        mols : iterable
+            Molecules.
+        """
+        mols = list(mols)
+        rval = np.empty((len(mols), len(self.functions)), dtype=self.dtype)
+        for i, mol in enumerate(mols):
+            self._calculate(mol, rval[i])
         return rval
+
+    def _calculate(self, mol, rval):
+        """
+        Calculate RDKit descriptors for a molecule.
+
+        Parameters
+        ----------
+        mol : RDKit Mol
+            Molecule.
+        rval : ndarray
+            Output array. Failed descriptors are set to NaN.
+        """
+        for i, (descriptor, function) in enumerate(
+                zip(self.descriptors, self.functions)):
+            if self.timing:
+                start = time.time()
+            try:
+                rval[i] = function(mol)
+            except Exception:  # RDKit raises a variety of errors
+                rval[i] = np.nan
+            if self.timing:
+                self.timings[descriptor] += time.time() - start
+
+    def get_timings(self):
+        """
+        Get descriptor timings, sorted from slowest to fastest.
+
+        Returns
+        -------
+        A list of (descriptor, seconds) tuples.
+        """
+        return sorted(self.timings.items(), key=lambda x: x[1], reverse=True)
+
+
+# regular expressions matching descriptor names in each descriptor group
+DESCRIPTOR_GROUPS = {
+    'charge': r'(Max|Min)(Abs)?PartialCharge$',
+    'connectivity': r'(Chi\d|Kappa\d|HallKierAlpha$)',
+    'counts': r'(Num|.*Count$|FractionCSP3$)',
+    'crippen': r'(MolLogP|MolMR)$',
+    'estate': r'.*EState',
+    'fragments': r'fr_',
+    'surface': r'(TPSA$|LabuteASA$|.*_VSA)',
+    'weight': r'.*MolWt$',
+}
+
+
+def get_descriptor_list(descriptors=None, groups=None):
+    """
+    Select RDKit descriptors by name or group.
+
+    Parameters
+    ----------
+    descriptors : list or str, optional
+        Descriptor names (a comma-separated string is also accepted).
+    groups : list or str, optional
+        Descriptor groups (a comma-separated string is also accepted).
+
+    Returns
+    -------
+    A list of (name, function) tuples in the order of Descriptors.descList.
+    """
+    if descriptors is None and groups is None:
+        return list(Descriptors.descList)
+    if isinstance(descriptors, basestring):
+        descriptors = descriptors.split(',')
+    if isinstance(groups, basestring):
+        groups = groups.split(',')
+    if descriptors is None:
+        descriptors = []
+    if groups is None:
+        groups = []
+    names = [name for name, _ in Descriptors.descList]
+    for descriptor in descriptors:
+        if descriptor not in names:
+            raise ValueError("Unknown descriptor '{}'.".format(descriptor))
+    for group in groups:
+        if group not in DESCRIPTOR_GROUPS:
+            raise ValueError("Unknown descriptor group '{}'.".format(group))
+    patterns = [re.compile(DESCRIPTOR_GROUPS[group]) for group in groups]
+    selected = []
+    for name, function in Descriptors.descList:
+        if (name in descriptors or
+                any(pattern.match(name) for pattern in patterns)):
+            selected.append((name, function))
+    return selected
@@ -8,12 +8,12 @@ __author__ = "Steven Kearnes"
 __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "BSD 3-clause"
 
+import hashlib
 import numpy as np
 
 from rdkit import Chem
 
 from vs_utils.features import Featurizer
-from vs_utils.utils import pad_array
 
 
 class CoulombMatrix(Featurizer):
@@ -34,12 +34,18 @@ class CoulombMatrix(Featurizer):
         Number of random Coulomb matrices to generate if randomize is True.
     seed : int, optional
         Random seed.
+    packed : bool, optional (default False)
+        Whether to return compact features. If True, the features for each
+        molecule are float32 upper triangles without padding, with shape
+        (n_confs, n_atoms * (n_atoms + 1) / 2), and featurize returns an
+        object array instead of a padded masked array. Use
+        PackedCoulombMatrices to reconstruct padded features.
     """
     conformers = True
     name = 'coulomb_matrix'
 
     def __init__(self, max_atoms, remove_hydrogens=True, randomize=True,
-                 n_samples=1, seed=None):
+                 n_samples=1, seed=None, packed=False):
         self.max_atoms = int(max_atoms)
         self.remove_hydrogens = remove_hydrogens
         self.randomize = randomize
@@ -47,6 +53,16 @@ class CoulombMatrix(Featurizer):
         if seed is not None:
             seed = int(seed)
         self.seed = seed
+        self.packed = packed
+        self.triu_indices = np.triu_indices(self.max_atoms)
+
+    def is_deterministic(self):
+        """
+        Whether calculated features only depend on the molecule and the
+        featurizer arguments. Randomized Coulomb matrices are only
+        reproducible if a seed is set.
+        """
+        return not self.randomize or self.seed is not None
 
     def _featurize(self, mol):
         """
@@ -62,48 +78,121 @@ class CoulombMatrix(Featurizer):
         mol : RDKit Mol
             Molecule.
         """
-        features = self.coulomb_matrix(mol)
-        features = [f[np.triu_indices_from(f)] for f in features]
-        features = np.asarray(features)
+        m = self.coulomb_matrix(mol, pad=False)
+        if self.packed:
+            rows, cols = np.triu_indices(m.shape[-1])
+            return np.asarray(m[:, rows, cols], dtype=np.float32)
+        features = self.get_upper_triangles(m)
         return features
 
-    def coulomb_matrix(self, mol):
+    def conformer_container(self, mols, features):
+        """
+        Put features into a container with an extra dimension for
+        conformers.
+
+        If packed is True, features are returned as an object array
+        without padding.
+
+        Parameters
+        ----------
+        mols : iterable
+            RDKit Mol objects.
+        features : list
+            Features calculated for molecule conformers.
+        """
+        if not self.packed:
+            return super(CoulombMatrix, self).conformer_container(mols,
+                                                                  features)
+        rval = np.empty(len(features), dtype=object)
+        for i, mol_features in enumerate(features):
+            rval[i] = mol_features
+        return rval
+
+    def coulomb_matrix(self, mol, pad=True):
         """
         Generate Coulomb matrices for each conformer of the given molecule.
 
+        Matrices for all conformers are calculated at once using the
+        coordinates of every conformer in a single array.
+
         Parameters
         ----------
         mol : RDKit Mol
             Molecule.
+        pad : bool, optional (default True)
+            Whether to pad matrices to max_atoms.
         """
         if self.remove_hydrogens:
             mol = Chem.RemoveHs(mol)
         n_atoms = mol.GetNumAtoms()
-        z = [atom.GetAtomicNum() for atom in mol.GetAtoms()]
-        rval = []
-        for conf in mol.GetConformers():
-            d = self.get_interatomic_distances(conf)
-            m = np.zeros((n_atoms, n_atoms))
-            for i in xrange(mol.GetNumAtoms()):
-                for j in xrange(mol.GetNumAtoms()):
-                    if i == j:
-                        m[i, j] = 0.5 * z[i] ** 2.4
-                    elif i < j:
-                        m[i, j] = (z[i] * z[j]) / d[i, j]
-                        m[j, i] = m[i, j]
-                    else:
-                        continue
-            if self.randomize:
-                for random_m in self.randomize_coulomb_matrix(m):
-                    random_m = pad_array(random_m, self.max_atoms)
-                    rval.append(random_m)
-            else:
-                m = pad_array(m, self.max_atoms)
-                rval.append(m)
-        rval = np.asarray(rval)
-        return rval
+        if n_atoms > self.max_atoms:
+            raise ValueError(
+                'Molecule has more than max_atoms ({}) atoms.'.format(
+                    self.max_atoms))
+        z = np.asarray([atom.GetAtomicNum() for atom in mol.GetAtoms()],
+                       dtype=float)
+        d = self.get_distance_matrices(self.get_coordinates(mol))
 
-    def randomize_coulomb_matrix(self, m):
+        # off-diagonal elements are Z_i * Z_j / d_ij
+        # diagonal elements are 0.5 * Z_i ** 2.4
+        diag = np.arange(n_atoms)
+        d[:, diag, diag] = 1.  # avoid division by zero
+        m = np.outer(z, z) / d
+        m[:, diag, diag] = 0.5 * z ** 2.4
+        if self.randomize:
+            rng = self.get_random_state(mol)
+            m = self.randomize_coulomb_matrix(m, rng)
+            m = m.reshape((-1, n_atoms, n_atoms))
+        if pad:
+            padded = np.zeros((m.shape[0], self.max_atoms, self.max_atoms),
+                              dtype=m.dtype)
+            padded[:, :n_atoms, :n_atoms] = m
+            m = padded
+        return m
+
+    def get_upper_triangles(self, m):
+        """
+        Get the flattened upper triangular portions of Coulomb matrices,
+        padded to max_atoms.
+
+        Values are copied directly to their positions in the flattened
+        upper triangle of a padded matrix, so the padded matrices are never
+        constructed.
+
+        Parameters
+        ----------
+        m : ndarray
+            Unpadded Coulomb matrices with shape (n_matrices, n_atoms,
+            n_atoms).
+        """
+        n_atoms = m.shape[-1]
+        rows, cols = self.triu_indices
+        keep = cols < n_atoms  # rows <= cols
+        features = np.zeros((m.shape[0], rows.size), dtype=m.dtype)
+        features[:, keep] = m[:, rows[keep], cols[keep]]
+        return features
+
+    def get_random_state(self, mol):
+        """
+        Get a random number generator for a molecule.
+
+        If a seed is set, the generator is seeded with a combination of the
+        seed and the canonical isomeric SMILES of the molecule. This makes
+        randomized Coulomb matrices reproducible regardless of the order in
+        which molecules are processed (e.g. by parallel workers).
+
+        Parameters
+        ----------
+        mol : RDKit Mol
+            Molecule.
+        """
+        if self.seed is None:
+            return np.random.RandomState()
+        smiles = Chem.MolToSmiles(mol, isomericSmiles=True, canonical=True)
+        digest = hashlib.md5('{}:{}'.format(self.seed, smiles)).hexdigest()
+        return np.random.RandomState(int(digest[:8], 16))
+
+    def randomize_coulomb_matrix(self, m, rng=None):
         """
         Randomize a Coulomb matrix as decribed in Montavon et al., _New Journal
         of Physics_ __15__ (2013) 095003:
@@ -114,25 +203,85 @@ class CoulombMatrix(Featurizer):
             3. Permute the rows and columns of M with the permutation that
                sorts row_norms + e.
 
+        Noise vectors for all samples (and all matrices, if more than one
+        is provided) are drawn at once, and the permuted matrices are
+        gathered in a single indexing operation.
+
         Parameters
         ----------
         m : ndarray
-            Coulomb matrix.
-        n_samples : int, optional (default 1)
-            Number of random matrices to generate.
-        seed : int, optional
-            Random seed.
-        """
-        rval = []
-        row_norms = np.asarray([np.linalg.norm(row) for row in m], dtype=float)
-        rng = np.random.RandomState(self.seed)
-        for i in xrange(self.n_samples):
-            e = rng.normal(size=row_norms.size)
-            p = np.argsort(row_norms + e)
-            new = m[p][:, p]  # permute rows first, then columns
-            rval.append(new)
+            Coulomb matrix, or Coulomb matrices with shape (n_matrices,
+            n_atoms, n_atoms).
+        rng : RandomState, optional
+            Random number generator. Defaults to a new generator seeded
+            with self.seed.
+
+        Returns
+        -------
+        rval : ndarray
+            Randomized matrices with shape (n_samples, n_atoms, n_atoms),
+            or (n_matrices, n_samples, n_atoms, n_atoms) if more than one
+            matrix is provided.
+        """
+        if rng is None:
+            rng = np.random.RandomState(self.seed)
+        m = np.asarray(m, dtype=float)
+        single = m.ndim == 2
+        if single:
+            m = m[np.newaxis]
+        n_matrices, n_atoms, _ = m.shape
+        row_norms = np.sqrt(np.sum(m ** 2, axis=2))
+        e = rng.normal(size=(n_matrices, self.n_samples, n_atoms))
+        p = np.argsort(row_norms[:, np.newaxis] + e, axis=2)
+
+        # rval[i, j] = m[i][p[i, j]][:, p[i, j]]
+        index = np.arange(n_matrices)[:, np.newaxis, np.newaxis, np.newaxis]
+        rval = m[index, p[..., np.newaxis], p[..., np.newaxis, :]]
+        if single:
+            rval = rval[0]
         return rval
 
+    @staticmethod
+    def get_coordinates(mol):
+        """
+        Get atomic coordinates for all conformers of a molecule.
+
+        Parameters
+        ----------
+        mol : RDKit Mol
+            Molecule.
+
+        Returns
+        -------
+        coords : ndarray
+            Coordinates with shape (n_confs, n_atoms, 3).
+        """
+        n_atoms = mol.GetNumAtoms()
+        coords = np.zeros((mol.GetNumConformers(), n_atoms, 3), dtype=float)
+        for i, conf in enumerate(mol.GetConformers()):
+            for j in xrange(n_atoms):
+                coords[i, j] = list(conf.GetAtomPosition(j))
+        return coords
+
+    @staticmethod
+    def get_distance_matrices(coords):
+        """
+        Get interatomic distances for one or more sets of coordinates.
+
+        Parameters
+        ----------
+        coords : ndarray
+            Coordinates with shape (..., n_atoms, 3).
+
+        Returns
+        -------
+        d : ndarray
+            Distances with shape (..., n_atoms, n_atoms).
+        """
+        delta = coords[..., :, np.newaxis, :] - coords[..., np.newaxis, :, :]
+        d = np.sqrt(np.sum(delta ** 2, axis=-1))
+        return d
+
     @staticmethod
     def get_interatomic_distances(conf):
         """
@@ -144,13 +293,108 @@ class CoulombMatrix(Featurizer):
             Molecule conformer.
         """
         n_atoms = conf.GetNumAtoms()
-        coords = [conf.GetAtomPosition(i) for i in xrange(n_atoms)]
-        d = np.zeros((n_atoms, n_atoms), dtype=float)
-        for i in xrange(n_atoms):
-            for j in xrange(n_atoms):
-                if i < j:
-                    d[i, j] = coords[i].Distance(coords[j])
-                    d[j, i] = d[i, j]
-                else:
-                    continue
-        return d
+        coords = np.asarray([list(conf.GetAtomPosition(i))
+                             for i in xrange(n_atoms)], dtype=float)
+        return CoulombMatrix.get_distance_matrices(coords)
+
+
+class PackedCoulombMatrices(object):
+    """
+    Reconstruct padded Coulomb matrix features from packed features.
+
+    Padded features are only constructed for the molecules that are
+    requested, so packed features for a large dataset can be kept in memory
+    (or on disk) and expanded one minibatch at a time.
+
+    Parameters
+    ----------
+    features : sequence
+        Packed features, as returned by CoulombMatrix with packed=True. Each
+        element is an array with shape (n_confs, n_atoms * (n_atoms + 1) /
+        2).
+    max_atoms : int
+        Maximum number of atoms for any molecule in the dataset.
+    """
+    def __init__(self, features, max_atoms):
+        self.features = features
+        self.max_atoms = int(max_atoms)
+        self.triu_indices = np.triu_indices(self.max_atoms)
+
+    def __len__(self):
+        return len(self.features)
+
+    def __getitem__(self, index):
+        """
+        Get padded features for one or more molecules.
+
+        For a single molecule, the padded upper triangles are returned with
+        shape (n_confs, max_atoms * (max_atoms + 1) / 2). For multiple
+        molecules, a masked array with an extra dimension for conformers is
+        returned (matching the output of CoulombMatrix with packed=False).
+
+        Parameters
+        ----------
+        index : int, slice, or array_like
+            Molecule index or indices.
+        """
+        if isinstance(index, (int, long, np.integer)):
+            return self.pad(self.features[index])
+        indices = np.arange(len(self))[index]
+        padded = [self.pad(self.features[i]) for i in indices]
+        max_confs = max([len(x) for x in padded] + [1])
+        rval = np.ma.masked_all(
+            (len(padded), max_confs, self.triu_indices[0].size),
+            dtype=np.float32)
+        for i, x in enumerate(padded):
+            rval[i, :len(x)] = x
+        return rval
+
+    @staticmethod
+    def get_num_atoms(packed):
+        """
+        Get the number of atoms corresponding to packed features.
+
+        Parameters
+        ----------
+        packed : ndarray
+            Packed features for a molecule.
+        """
+        size = np.shape(packed)[-1]
+        n_atoms = int(np.rint((np.sqrt(8 * size + 1) - 1) / 2.))
+        assert n_atoms * (n_atoms + 1) / 2 == size
+        return n_atoms
+
+    def pad(self, packed):
+        """
+        Convert packed features for a molecule to padded upper triangles.
+
+        Parameters
+        ----------
+        packed : ndarray
+            Packed features for a molecule.
+        """
+        packed = np.atleast_2d(packed)
+        n_atoms = self.get_num_atoms(packed)
+        rows, cols = self.triu_indices
+        keep = cols < n_atoms  # rows <= cols
+        rval = np.zeros((packed.shape[0], rows.size), dtype=packed.dtype)
+        rval[:, keep] = packed
+        return rval
+
+    def get_matrices(self, index):
+        """
+        Get padded (symmetric) Coulomb matrices for a molecule.
+
+        Parameters
+        ----------
+        index : int
+            Molecule index.
+        """
+        packed = np.atleast_2d(self.features[index])
+        n_atoms = self.get_num_atoms(packed)
+        rows, cols = np.triu_indices(n_atoms)
+        m = np.zeros((packed.shape[0], self.max_atoms, self.max_atoms),
+                     dtype=packed.dtype)
+        m[:, rows, cols] = packed
+        m[:, cols, rows] = packed
+        return m
@@ -28,7 +28,8 @@ class DragonDescriptors(Featurizer):
         self.engine = Dragon(assign_stereo_from_3d=assign_stereo_from_3d)
 
     def featurize(self, mols, parallel=False, client_kwargs=None,
-                  view_flags=None):
+                  view_flags=None, backend='ipython', n_jobs=None,
+                  chunk_size=100, pool=None):
         """
         Calculate features for molecules.
 
@@ -37,12 +38,24 @@ class DragonDescriptors(Featurizer):
         mols : iterable
             RDKit Mol objects.
         parallel : bool, optional (default False)
-            Train subtrainers in parallel using IPython.parallel.
+            Whether to calculate features in parallel using
+            IPython.parallel.
         client_kwargs : dict, optional
             Keyword arguments for IPython.parallel Client.
         view_flags : dict, optional
             Flags for IPython.parallel LoadBalancedView.
+        backend : str, optional (default 'ipython')
+            Parallel backend. Only 'ipython' is supported.
+        n_jobs : int, optional
+            Ignored.
+        chunk_size : int, optional (default 100)
+            Ignored.
+        pool : multiprocessing.Pool, optional
+            Ignored.
         """
+        if parallel and backend != 'ipython':
+            raise NotImplementedError(
+                "Dragon descriptors only support the 'ipython' backend.")
         if parallel:
             from IPython.parallel import Client
 
@@ -7,6 +7,7 @@ __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "BSD 3-clause"
 
 import numpy as np
+import os
 import subprocess
 import warnings
 
@@ -43,19 +44,102 @@ class ESP(Featurizer):
         Whether to canonicalize the orientation of molecules. This requires
         removal and readdition of hydrogens. This is usually not required
         when working with conformers retrieved from PubChem.
+    charge_cache : str, optional
+        Filename for a disk-backed cache of Antechamber charges and radii
+        (see amber_utils.ChargeCache). The cache can be shared between
+        parallel workers and featurization runs.
+    pbsa_workers : int, optional (default 1)
+        Number of conformers for which PBSA calculations are run
+        concurrently.
+    dtype : str, optional (default 'float64')
+        Data type for ESP grids. Choose from 'float64', 'float32',
+        'float16', or 'int16'. With 'int16', each grid is quantized with its
+        own scale and features are stored in a structured array with
+        'scale' and 'grid' fields (see dequantize). Failed conformers have
+        NaN scales.
+    crop : float, optional
+        Length of each side of a cube (in Angstroms) centered on the grid
+        center to keep after calculation. This allows ESP to be calculated
+        on a larger grid than is stored. Must not be larger than size,
+        and must differ from size by an even number of grid points so the
+        cropped grid is centered.
     """
     conformers = True
     name = 'esp'
+    execution_args = ['charge_cache', 'pbsa_workers']
 
     def __init__(self, size=30., resolution=0.5, nb_cutoff=5.,
-                 ionic_strength=150., ionize=True, pH=7.4, align=False):
+                 ionic_strength=150., ionize=True, pH=7.4, align=False,
+                 charge_cache=None, pbsa_workers=1, dtype='float64',
+                 crop=None):
+        if dtype not in ['float64', 'float32', 'float16', 'int16']:
+            raise ValueError("Invalid dtype '{}'.".format(dtype))
+        if crop is not None:
+            if crop > size:
+                raise ValueError('crop must not be larger than size.')
+            border = int(round(size / resolution)) - int(
+                round(crop / resolution))
+            if border % 2:
+                raise ValueError(
+                    'crop must differ from size by an even number of grid ' +
+                    'points.')
         self.size = float(size)
         self.resolution = float(resolution)
         self.nb_cutoff = float(nb_cutoff)
         self.ionic_strength = float(ionic_strength)
         self.preparator = MolPreparator(ionize, pH, align, add_hydrogens=True)
+        self.charge_cache = None
+        if charge_cache is not None:
+            self.charge_cache = amber_utils.ChargeCache(charge_cache)
+        self.pbsa_workers = pbsa_workers
+        self.dtype = dtype
+        self.crop = crop
+        self._pbsa = None
 
-    def _featurize(self, mol):
+    def __getstate__(self):
+        """
+        Drop the PBSA engine when pickling.
+        """
+        state = self.__dict__.copy()
+        state['_pbsa'] = None
+        return state
+
+    def get_pbsa(self):
+        """
+        Get a PBSA engine, which is reused for all molecules in a process.
+        """
+        if self._pbsa is None or self._pbsa.pid != os.getpid():
+            # int16 and float16 grids are converted after parsing
+            dtype = self.dtype
+            if dtype in ['float16', 'int16']:
+                dtype = 'float32'
+            self._pbsa = amber_utils.PBSA(self.size, self.resolution,
+                                          self.nb_cutoff, self.ionic_strength,
+                                          n_workers=self.pbsa_workers,
+                                          dtype=np.dtype(dtype))
+        return self._pbsa
+
+    def _featurize_batch(self, mols):
+        """
+        Calculate electrostatic potential grids for a batch of molecules.
+
+        Molecules are ionized with one Open Babel process per batch (see
+        Ionizer.ionize_batch). Molecules that fail batch ionization are
+        ionized individually.
+
+        Parameters
+        ----------
+        mols : iterable
+            Molecules.
+        """
+        mols = list(mols)
+        ionized_mols = [None] * len(mols)
+        if self.preparator.ionize:
+            ionized_mols = self.preparator.ionizer.ionize_batch(mols)
+        return [self._featurize(mol, ionized_mol)
+                for mol, ionized_mol in zip(mols, ionized_mols)]
+
+    def _featurize(self, mol, ionized_mol=None):
         """
         Calculate electrostatic potential grid.
 
@@ -63,20 +147,27 @@ class ESP(Featurizer):
         ----------
         mol : RDMol
             Molecule.
+        ionized_mol : RDMol, optional
+            Ionized molecule. If not provided, the molecule is ionized if
+            ionization is enabled.
         """
 
         # catch ioniziation failures (disable ionization)
         ionized = self.preparator.ionize
-        try:
-            prepared_mol = self.preparator(mol)
-        except IonizerError:
-            if mol.HasProp('_Name'):
-                name = mol.GetProp('_Name')
-            else:
-                name = Chem.MolToSmiles(mol, isomericSmiles=True)
-            warnings.warn("Ionization failed for molecule '{}'.".format(name))
-            prepared_mol = self.preparator(mol, ionize=False)
-            ionized = False
+        if ionized and ionized_mol is not None:
+            prepared_mol = self.preparator(ionized_mol, ionize=False)
+        else:
+            try:
+                prepared_mol = self.preparator(mol)
+            except IonizerError:
+                if mol.HasProp('_Name'):
+                    name = mol.GetProp('_Name')
+                else:
+                    name = Chem.MolToSmiles(mol, isomericSmiles=True)
+                warnings.warn(
+                    "Ionization failed for molecule '{}'.".format(name))
+                prepared_mol = self.preparator(mol, ionize=False)
+                ionized = False
 
         # catch subprocess failures (disable ionization and retry)
         try:
@@ -132,7 +223,7 @@ class ESP(Featurizer):
                 "Molecule '{}' has zero conformers.".format(name))
 
         # calculate charges and radii
-        antechamber = amber_utils.Antechamber()
+        antechamber = amber_utils.Antechamber(cache=self.charge_cache)
         charges, radii = antechamber.get_charges_and_radii(mol)
 
         # set charge and radius property on each atom
@@ -144,24 +235,130 @@ class ESP(Featurizer):
 
         # get ESP grid for each conformer
         grids = []
-        pbsa = amber_utils.PBSA(self.size, self.resolution, self.nb_cutoff,
-                                self.ionic_strength)
-        for i, conf in enumerate(mol.GetConformers()):
-            try:
-                grid, center = pbsa.get_esp_grid(mol, charges, radii,
-                                                 conf_id=conf.GetId())
+        pbsa = self.get_pbsa()
+        for i, result in enumerate(pbsa.get_esp_grids(mol, charges, radii)):
+            if not isinstance(result, subprocess.CalledProcessError):
+                grid, center = result
                 assert center == (0, 0, 0)  # should be centered on the origin
-                grids.append(grid)
-            except subprocess.CalledProcessError as e:
-                print e
-                if mol.HasProp('_Name'):
-                    name = mol.GetProp('_Name')
-                else:
-                    name = Chem.MolToSmiles(mol, isomericSmiles=True)
-                warnings.warn(
-                    "Conformer {} of molecule '{}' failed ".format(i, name) +
-                    "ESP calculation.".format(name))
-                grids.append(None)
+                try:
+                    grids.append(self.convert_grid(grid))
+                    continue
+                except ValueError as e:  # grid cannot be cropped
+                    result = e
+            print result
+            if mol.HasProp('_Name'):
+                name = mol.GetProp('_Name')
+            else:
+                name = Chem.MolToSmiles(mol, isomericSmiles=True)
+            warnings.warn(
+                "Conformer {} of molecule '{}' failed ".format(i, name) +
+                "ESP calculation.".format(name))
+            grids.append(None)
 
         grids = np.asarray(grids)
         return grids
+
+    def convert_grid(self, grid):
+        """
+        Crop an ESP grid and convert it to the output data type.
+
+        Parameters
+        ----------
+        grid : ndarray
+            ESP grid.
+        """
+        if self.crop is not None:
+            n_points = int(round(self.crop / self.resolution)) + 1
+            if any((dim - n_points) % 2 for dim in grid.shape):
+                raise ValueError(
+                    'Cannot center {} points in a grid with shape {}.'.format(
+                        n_points, grid.shape))
+            start = [(dim - n_points) // 2 for dim in grid.shape]
+            grid = grid[tuple(slice(i, i + n_points) for i in start)]
+        if self.dtype == 'int16':
+            return self.quantize(grid)
+        return np.asarray(grid, dtype=self.dtype)
+
+    @staticmethod
+    def quantize(grid):
+        """
+        Quantize an ESP grid to int16 with a per-grid scale.
+
+        The scale maps the largest absolute value in the grid to the
+        largest int16 value.
+
+        Parameters
+        ----------
+        grid : ndarray
+            ESP grid.
+
+        Returns
+        -------
+        A zero-dimensional structured array with 'scale' (float32) and
+        'grid' (int16) fields.
+        """
+        max_value = np.iinfo(np.int16).max
+        scale = np.float32(np.amax(np.fabs(grid)) / max_value)
+        if scale == 0:
+            scale = np.float32(1.)
+        values = np.clip(np.rint(grid / scale), -max_value, max_value)
+        dtype = np.dtype([('scale', np.float32),
+                          ('grid', np.int16, grid.shape)])
+        rval = np.zeros((), dtype=dtype)
+        rval['scale'] = scale
+        rval['grid'] = values
+        return rval
+
+    @staticmethod
+    def dequantize(features):
+        """
+        Recover ESP grids from int16 features.
+
+        Parameters
+        ----------
+        features : ndarray
+            Structured array with 'scale' and 'grid' fields.
+
+        Returns
+        -------
+        float32 ESP grids. Grids for failed conformers are filled with NaN.
+        """
+        scale = np.asarray(features['scale'], dtype=np.float32)
+        grid = np.asarray(features['grid'], dtype=np.float32)
+        return grid * scale.reshape(scale.shape + (1, 1, 1))
+
+    def conformer_container(self, mols, features):
+        """
+        Put features into a container with an extra dimension for
+        conformers.
+
+        For int16 output, features are stored in a structured array
+        instead of a masked array, with NaN scales for missing conformers.
+
+        Parameters
+        ----------
+        mols : iterable
+            RDKit Mol objects.
+        features : list
+            Features calculated for molecule conformers.
+        """
+        if self.dtype != 'int16':
+            return super(ESP, self).conformer_container(mols, features)
+        dtype = None
+        for mol_features in features:
+            for conf_features in mol_features:
+                if conf_features is not None:
+                    dtype = conf_features.dtype
+                    break
+            if dtype is not None:
+                break
+        if dtype is None:
+            raise ValueError('Cannot find any features.')
+        max_confs = max([max(mol.GetNumConformers(), 1) for mol in mols])
+        x = np.zeros((len(mols), max_confs), dtype=dtype)
+        x['scale'] = np.nan
+        for i, mol_features in enumerate(features):
+            for j, conf_features in enumerate(mol_features):
+                if conf_features is not None:
+                    x[i, j] = conf_features
+        return x
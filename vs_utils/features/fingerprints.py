@@ -6,11 +6,22 @@ __author__ = "Steven Kearnes"
 __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "BSD 3-clause"
 
-from rdkit import Chem
+import numpy as np
+import os
+from scipy import sparse as sp
+
+from rdkit import Chem, DataStructs
 from rdkit.Chem import rdMolDescriptors
 
 from vs_utils.features import Featurizer
 
+# process-wide caches mapping fragment IDs to SMILES, keyed by the settings
+# that affect fragment IDs (chirality, bond types, and features)
+_fragment_smiles = {}
+
+# SMILES cache files that have been read by this process
+_loaded_smiles_caches = set()
+
 
 class CircularFingerprint(Featurizer):
     """
@@ -34,12 +45,34 @@ class CircularFingerprint(Featurizer):
         fingerprint.
     smiles : bool, optional (default False)
         Whether to calculate SMILES strings for fragment IDs (only applicable
-        when calculating sparse fingerprints).
+        when calculating sparse fingerprints). SMILES are only generated the
+        first time each fragment ID is seen by a process.
+    packbits : bool, optional (default False)
+        Whether to pack bit vector fingerprints into uint8 bytes (eight
+        bits per byte). Use np.unpackbits(features, axis=-1)[:, :size] to
+        recover the bits.
+    sparse_format : str, optional (default 'dict')
+        Output format for sparse fingerprints. Choose from:
+        * 'dict' : a dict for each molecule mapping fragment IDs to counts.
+        * 'csr' : a scipy.sparse CSR matrix of counts with shape
+          (n_mols, size). Fragment IDs are hashed into columns by taking
+          fragment_id % size, and counts for colliding fragments are summed.
+    smiles_cache : str, optional
+        Vocabulary file (see write_vocabulary) used to seed the fragment
+        SMILES cache, so SMILES generated by previous runs are reused.
     """
     name = 'circular'
+    execution_args = ['smiles_cache']
 
     def __init__(self, radius=2, size=2048, chiral=False, bonds=True,
-                 features=False, sparse=False, smiles=False):
+                 features=False, sparse=False, smiles=False, packbits=False,
+                 sparse_format='dict', smiles_cache=None):
+        if sparse_format not in ['dict', 'csr']:
+            raise NotImplementedError(
+                "Unrecognized sparse format '{}'.".format(sparse_format))
+        if sparse and smiles and sparse_format == 'csr':
+            raise ValueError(
+                'Fragment SMILES are not available with CSR output.')
         self.radius = radius
         self.size = size
         self.chiral = chiral
@@ -47,6 +80,9 @@ class CircularFingerprint(Featurizer):
         self.features = features
         self.sparse = sparse
         self.smiles = smiles
+        self.packbits = packbits
+        self.sparse_format = sparse_format
+        self.smiles_cache = smiles_cache
 
     def _featurize(self, mol):
         """
@@ -57,26 +93,205 @@ class CircularFingerprint(Featurizer):
         mol : RDKit Mol
             Molecule.
         """
-        if self.sparse:
-            info = {}
-            fp = rdMolDescriptors.GetMorganFingerprint(
-                mol, self.radius, useChirality=self.chiral,
-                useBondTypes=self.bonds, useFeatures=self.features,
-                bitInfo=info)
-            fp = fp.GetNonzeroElements()  # convert to a dict
-
-            # generate SMILES for fragments
-            if self.smiles:
-                fp_smiles = {}
-                for fragment_id, count in fp.items():
+        if self.sparse and self.sparse_format == 'csr':
+            return self._featurize_batch([mol])
+        elif self.sparse:
+            return self.get_sparse_fingerprint(mol)
+        else:
+            return self.get_bits(mol)
+
+    def _featurize_batch(self, mols):
+        """
+        Calculate circular fingerprints for a batch of molecules.
+
+        Bit vector fingerprints are written directly into a preallocated
+        uint8 matrix, and CSR output is assembled from the sparse counts of
+        each molecule.
+
+        Parameters
+        ----------
+        mols : iterable
+            Molecules.
+        """
+        if self.sparse and self.sparse_format == 'csr':
+            return self.get_csr_fingerprints(mols)
+        elif self.sparse:
+            return super(CircularFingerprint, self)._featurize_batch(mols)
+        mols = list(mols)
+        if self.packbits:
+            n_cols = int(np.ceil(self.size / 8.))
+        else:
+            n_cols = self.size
+        features = np.zeros((len(mols), n_cols), dtype=np.uint8)
+        bits = np.zeros(self.size, dtype=np.uint8)
+        for i, mol in enumerate(mols):
+            features[i] = self.get_bits(mol, bits)
+        return features
+
+    def get_bits(self, mol, bits=None):
+        """
+        Calculate a bit vector fingerprint as a uint8 array.
+
+        Parameters
+        ----------
+        mol : RDKit Mol
+            Molecule.
+        bits : ndarray, optional
+            Preallocated uint8 array with length equal to the fingerprint
+            size. This array is overwritten.
+        """
+        if bits is None:
+            bits = np.zeros(self.size, dtype=np.uint8)
+        fp = rdMolDescriptors.GetMorganFingerprintAsBitVect(
+            mol, self.radius, nBits=self.size, useChirality=self.chiral,
+            useBondTypes=self.bonds, useFeatures=self.features)
+        DataStructs.ConvertToNumpyArray(fp, bits)
+        if self.packbits:
+            return np.packbits(bits)
+        return bits
+
+    def get_sparse_fingerprint(self, mol):
+        """
+        Calculate a sparse fingerprint as a dict mapping fragment IDs to
+        counts (or to dicts containing counts and SMILES if self.smiles is
+        True).
+
+        Parameters
+        ----------
+        mol : RDKit Mol
+            Molecule.
+        """
+        info = {}
+        fp = rdMolDescriptors.GetMorganFingerprint(
+            mol, self.radius, useChirality=self.chiral,
+            useBondTypes=self.bonds, useFeatures=self.features,
+            bitInfo=info)
+        fp = fp.GetNonzeroElements()  # convert to a dict
+
+        # generate SMILES for fragments
+        if self.smiles:
+            cache = self.get_smiles_cache()
+            fp_smiles = {}
+            for fragment_id, count in fp.items():
+                try:
+                    smiles = cache[fragment_id]
+                except KeyError:
                     root, radius = info[fragment_id][0]
                     env = Chem.FindAtomEnvironmentOfRadiusN(mol, radius, root)
                     frag = Chem.PathToSubmol(mol, env)
                     smiles = Chem.MolToSmiles(frag)
-                    fp_smiles[fragment_id] = {'smiles': smiles, 'count': count}
-                fp = fp_smiles
-        else:
-            fp = rdMolDescriptors.GetMorganFingerprintAsBitVect(
-                mol, self.radius, nBits=self.size, useChirality=self.chiral,
-                useBondTypes=self.bonds, useFeatures=self.features)
+                    cache[fragment_id] = smiles
+                fp_smiles[fragment_id] = {'smiles': smiles, 'count': count}
+            fp = fp_smiles
         return fp
+
+    def get_smiles_cache(self):
+        """
+        Get the process-wide fragment SMILES cache for the current
+        fingerprint settings.
+
+        The cache is seeded from self.smiles_cache (if provided) the first
+        time it is requested in each process.
+        """
+        key = (self.chiral, self.bonds, self.features)
+        cache = _fragment_smiles.setdefault(key, {})
+        if (self.smiles_cache is not None and
+                (key, self.smiles_cache) not in _loaded_smiles_caches):
+            if os.path.exists(self.smiles_cache):
+                cache.update(read_vocabulary(self.smiles_cache))
+            _loaded_smiles_caches.add((key, self.smiles_cache))
+        return cache
+
+    @staticmethod
+    def get_vocabulary(features):
+        """
+        Collect fragment SMILES from sparse fingerprints calculated with
+        smiles=True.
+
+        Parameters
+        ----------
+        features : iterable
+            Sparse fingerprints (dicts mapping fragment IDs to dicts
+            containing counts and SMILES).
+
+        Returns
+        -------
+        A dict mapping fragment IDs to SMILES.
+        """
+        vocabulary = {}
+        for fp in features:
+            for fragment_id, value in fp.iteritems():
+                vocabulary[fragment_id] = value['smiles']
+        return vocabulary
+
+    def get_csr_fingerprints(self, mols):
+        """
+        Calculate sparse fingerprints as a CSR matrix of counts.
+
+        Parameters
+        ----------
+        mols : iterable
+            Molecules.
+        """
+        indptr = [0]
+        indices = []
+        data = []
+        for mol in mols:
+            fp = self.get_sparse_fingerprint(mol)
+            for fragment_id, count in fp.iteritems():
+                indices.append(fragment_id % self.size)
+                data.append(count)
+            indptr.append(len(indices))
+        index_dtype = np.int32
+        if len(indices) > np.iinfo(np.int32).max:
+            index_dtype = np.int64
+        features = sp.csr_matrix(
+            (np.asarray(data, dtype=np.int32),
+             np.asarray(indices, dtype=index_dtype),
+             np.asarray(indptr, dtype=index_dtype)),
+            shape=(len(indptr) - 1, self.size))
+        features.sum_duplicates()  # combine hash collisions
+        return features
+
+
+def read_vocabulary(filename):
+    """
+    Read a fragment vocabulary file.
+
+    Parameters
+    ----------
+    filename : str
+        Vocabulary filename.
+
+    Returns
+    -------
+    A dict mapping fragment IDs to SMILES.
+    """
+    vocabulary = {}
+    with open(filename) as f:
+        for line in f:
+            smiles, fragment_id = line.rstrip('\n').split('\t')
+            vocabulary[int(fragment_id)] = smiles
+    return vocabulary
+
+
+def write_vocabulary(vocabulary, filename):
+    """
+    Write a fragment vocabulary file.
+
+    Each line contains a fragment SMILES and the corresponding fragment ID,
+    separated by a tab. The file is written to a temporary file and then
+    renamed, so an interrupted write does not corrupt an existing file.
+
+    Parameters
+    ----------
+    vocabulary : dict
+        Mapping of fragment IDs to SMILES.
+    filename : str
+        Vocabulary filename.
+    """
+    temp_filename = '{}.tmp'.format(filename)
+    with open(temp_filename, 'wb') as f:
+        for fragment_id in sorted(vocabulary):
+            f.write('{}\t{}\n'.format(vocabulary[fragment_id], fragment_id))
+    os.rename(temp_filename, filename)
@@ -6,8 +6,13 @@ __author__ = "Steven Kearnes"
 __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "3-clause BSD"
 
+from collections import OrderedDict
 import numpy as np
 
+# shared LRU cache for Grid.get_all_coords, keyed by grid geometry
+_coords_cache = OrderedDict()
+_coords_cache_size = 8
+
 
 class Grid(object):
     """
@@ -114,6 +119,25 @@ class Grid(object):
     def get_all_coords(self):
         """
         Get real-space coordinates for all grid points.
+
+        Coordinates are cached for each combination of shape, spacing, and
+        center, so grids with the same geometry share a single read-only
+        array. Copy the array before modifying it.
+        """
+        key = (self.shape, self.spacing, tuple(self.center))
+        if key in _coords_cache:
+            coords = _coords_cache.pop(key)
+        else:
+            coords = self._get_all_coords()
+            coords.setflags(write=False)
+            while len(_coords_cache) >= _coords_cache_size:
+                _coords_cache.popitem(last=False)
+        _coords_cache[key] = coords  # most recently used entries are last
+        return coords
+
+    def _get_all_coords(self):
+        """
+        Calculate real-space coordinates for all grid points.
         """
 
         # construct an array whose entries correspond to each index of the grid
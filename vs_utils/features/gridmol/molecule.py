@@ -12,7 +12,7 @@ __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "3-clause BSD"
 
 import numpy as np
-from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
 
 from . import Grid
 
@@ -69,11 +69,78 @@ class GridMol(Grid):
         Get a boolean grid with set bits corresponding to points inside the
         molecule.
         """
-        grid = np.sum([atom.get_grid_mask() for atom in self.atoms], axis=0)
-        grid = np.asarray(grid, dtype=bool)
-        return grid
+        centers = [[atom.center for atom in self.atoms]]
+        radii = [atom.radius for atom in self.atoms]
+        return self.get_batch_occupancy(centers, radii)[0]
 
-    def get_distance(self):
+    def get_batch_occupancy(self, centers, radii):
+        """
+        Get occupancy grids for several sets of atom coordinates, such as
+        the conformers of a molecule. Atoms are not added to this molecule.
+
+        Each atom only sets the grid points near its center, using a cached
+        set of offsets for each distinct atomic radius. Grid points outside
+        the grid are ignored, so atoms that do not fit in the grid are
+        clipped (see atoms_in_grid).
+
+        Parameters
+        ----------
+        centers : array_like
+            Atom centers with shape (n_sets, n_atoms, ndim).
+        radii : array_like
+            Atomic radii with shape (n_atoms,).
+        """
+        centers = np.asarray(centers, dtype=float)
+        centers = centers.reshape(centers.shape[:2] + (self.ndim,))
+        radii = np.asarray(radii, dtype=float) + self.probe_radius
+        grids = np.zeros((centers.shape[0],) + self.shape, dtype=bool)
+        grid_center = (np.asarray(self.shape) - 1) / 2. * self.spacing
+        nearest = np.rint((centers - self.center + grid_center) / self.spacing)
+        nearest = np.asarray(nearest, dtype=int)
+        for radius in np.unique(radii):
+            offsets = get_sphere_offsets(radius, self.spacing, self.ndim)
+            selected = radii == radius
+            points = nearest[:, selected, np.newaxis] + offsets
+
+            # use the same calculation as Grid.get_coords
+            coords = np.array(points, dtype=float) * self.spacing
+            coords -= grid_center
+            coords += self.center
+            coords -= centers[:, selected, np.newaxis]
+            distance = np.sqrt(np.sum(coords ** 2, axis=-1))
+            keep = distance <= radius
+            keep &= np.all((points >= 0) & (points < self.shape), axis=-1)
+            grid_idx = np.nonzero(keep)[0]
+            grids[(grid_idx,) + tuple(points[keep].T)] = True
+        return grids
+
+    def atoms_in_grid(self, centers, radii):
+        """
+        Check whether atoms (plus the probe radius) fit in the grid.
+
+        This is an array version of GridAtom.atom_is_in_grid.
+
+        Parameters
+        ----------
+        centers : array_like
+            Atom centers with shape (..., n_atoms, ndim).
+        radii : array_like
+            Atomic radii with shape (n_atoms,).
+
+        Returns
+        -------
+        A boolean array with shape (..., n_atoms).
+        """
+        centers = np.asarray(centers, dtype=float)
+        radii = np.asarray(radii, dtype=float) + self.probe_radius
+        grid_center = (np.asarray(self.shape) - 1) / 2. * self.spacing
+        points = (centers - self.center + grid_center) / self.spacing
+        extent = radii[:, np.newaxis] / self.spacing
+        low = np.rint(points - extent)
+        high = np.rint(points + extent)
+        return np.all((low >= 0) & (high < self.shape), axis=-1)
+
+    def get_distance(self, max_distance=None):
         """
         Get distance to the molecular surface.
 
@@ -83,41 +150,133 @@ class GridMol(Grid):
         distance calculated with respect to any atom in the molecule.
 
         This definition assigns negative values to points within the molecule.
+
+        Atom centers are stored in a KD-tree and each grid point is compared
+        only to its nearest atoms. The number of neighbors is increased for
+        any grid points where atoms that were not considered could change
+        the result, so the calculated distances are exact.
+
+        Parameters
+        ----------
+        max_distance : float, optional
+            Maximum distance to the molecular surface. Larger distances are
+            clipped to this value, and atoms farther than this from a grid
+            point are ignored.
         """
         assert self.get_num_atoms()
-        coords = self.get_all_coords().reshape((self.size, self.ndim))
-        centers = np.asarray([atom.center for atom in self.atoms], dtype=float)
-        radii = np.asarray([atom.radius for atom in self.atoms], dtype=float)
+        centers = [[atom.center for atom in self.atoms]]
+        radii = [atom.radius for atom in self.atoms]
+        return self.get_batch_distance(centers, radii, max_distance)[0]
+
+    def get_batch_distance(self, centers, radii, max_distance=None):
+        """
+        Get distance to the molecular surface for several sets of atom
+        coordinates, such as the conformers of a molecule. Atoms are not
+        added to this molecule.
 
-        # get pairwise distances between all grid points and atomic centers
-        # distances has shape (coords.shape[0], centers.shape[0])
-        distances = cdist(coords, centers)
+        See get_distance for details.
+
+        Parameters
+        ----------
+        centers : array_like
+            Atom centers with shape (n_sets, n_atoms, ndim).
+        radii : array_like
+            Atomic radii with shape (n_atoms,).
+        max_distance : float, optional
+            Maximum distance to the molecular surface.
+        """
+        centers = np.asarray(centers, dtype=float)
+        assert centers.shape[1]
 
-        # correct for atomic radii
         # the atomic radii have the probe radius added to get the radius
         # to the ``accessible'' surface
-        distances -= (radii + self.probe_radius)
-
-        # get minimum distance to molecular surface
-        # prefer negative distances to preserve correspondence with occupancy
-        # note that we can't just multiply occupied points by -1, because
-        # distances are calculated relative to atomic surfaces, which may lie
-        # within the molecular surface
-        best_distances = np.zeros(distances.shape[0], dtype=float)
-        for i in xrange(distances.shape[0]):
-            if np.any(distances[i] < 0):
-                best_distances[i] = -1 * np.amin(
-                    np.fabs(distances[i][distances[i] < 0]))
-            else:
-                best_distances[i] = np.amin(distances[i])
-        return best_distances.reshape(self.shape)
-
-        # take the minimum absolute distance while preserving sign
-        min_abs = np.argmin(np.fabs(distances), axis=1)
-        distances = distances[np.arange(distances.shape[0]), min_abs]
-        distances = distances.reshape(self.shape)
+        radii = np.asarray(radii, dtype=float) + self.probe_radius
+        coords = self.get_all_coords().reshape((self.size, self.ndim))
+        distances = np.zeros((centers.shape[0], self.size), dtype=float)
+        for i, this_centers in enumerate(centers):
+            distances[i] = self._get_distance(coords, this_centers, radii,
+                                              max_distance)
+        return distances.reshape((centers.shape[0],) + self.shape)
+
+    def _get_distance(self, coords, centers, radii, max_distance=None):
+        """
+        Get distances from grid points to the surface of a single set of
+        atoms.
+
+        Parameters
+        ----------
+        coords : ndarray
+            Grid point coordinates with shape (size, ndim).
+        centers : ndarray
+            Atom centers with shape (n_atoms, ndim).
+        radii : ndarray
+            Atomic radii (including the probe radius).
+        max_distance : float, optional
+            Maximum distance to the molecular surface.
+        """
+        n_atoms = centers.shape[0]
+
+        # atoms beyond this distance cannot be within max_distance of the
+        # surface
+        if max_distance is None:
+            bound = np.inf
+        else:
+            bound = max_distance + np.amax(radii)
+
+        tree = cKDTree(centers)
+        distances = np.zeros(self.size, dtype=float)
+        remaining = np.arange(self.size)
+        k = min(n_atoms, 8)
+        while remaining.size:
+            d, idx = tree.query(coords[remaining], k=k,
+                                distance_upper_bound=bound)
+            d = d.reshape((remaining.size, k))
+            idx = idx.reshape((remaining.size, k))
+
+            # correct for atomic radii (missing neighbors have idx=n_atoms)
+            surface = d - radii[np.minimum(idx, n_atoms - 1)]
+            surface[np.isinf(d)] = np.inf
+            distances[remaining] = self.get_signed_minimum(surface)
+            if k == n_atoms:
+                break
+
+            # results are exact if all atoms that could change them were
+            # included: for points inside the molecule, any atom within the
+            # largest radius; for points outside the molecule, any atom
+            # within the nearest distance plus the spread in radii
+            # missing neighbors (d=inf) mean that every atom within the
+            # upper bound was already found, so those results are final
+            threshold = np.maximum(
+                np.amax(radii), d[:, 0] + np.amax(radii) - np.amin(radii))
+            remaining = remaining[np.isfinite(d[:, -1]) &
+                                  (d[:, -1] <= threshold)]
+            k = min(2 * k, n_atoms)
+
+        if max_distance is not None:
+            distances = np.minimum(distances, max_distance)
         return distances
 
+    @staticmethod
+    def get_signed_minimum(distances):
+        """
+        Get the minimum distance to the molecular surface for each grid
+        point.
+
+        Prefer negative distances to preserve correspondence with occupancy.
+        Note that we can't just multiply occupied points by -1, because
+        distances are calculated relative to atomic surfaces, which may lie
+        within the molecular surface.
+
+        Parameters
+        ----------
+        distances : ndarray
+            Distances from grid points (rows) to atomic surfaces (columns).
+        """
+        inside = distances < 0
+        negative = np.amax(np.where(inside, distances, -np.inf), axis=1)
+        positive = np.amin(distances, axis=1)
+        return np.where(np.any(inside, axis=1), negative, positive)
+
 
 class GridAtom(object):
     """
@@ -189,9 +348,39 @@ class GridAtom(object):
         """
         Get a boolean mask for grid points inside this atom.
         """
-        coords = self.parent.get_all_coords().reshape(
-            (self.parent.size, self.parent.ndim))
-        distance = cdist(coords, np.atleast_2d(self.center))
-        distance = distance.reshape(self.parent.shape)
-        mask = distance <= (self.radius + self.parent.probe_radius)
-        return mask
+        return self.parent.get_batch_occupancy([[self.center]],
+                                               [self.radius])[0]
+
+
+# cached offsets for get_sphere_offsets
+_sphere_offsets = {}
+
+
+def get_sphere_offsets(radius, spacing, ndim=3):
+    """
+    Get grid index offsets for points that may lie within a sphere centered
+    near a grid point.
+
+    Since the sphere center is at most half of the grid spacing away from
+    the nearest grid point in each dimension, offsets are included if they
+    are within radius plus half of the grid diagonal. Offsets are cached
+    for each combination of arguments.
+
+    Parameters
+    ----------
+    radius : float
+        Sphere radius (including any probe radius).
+    spacing : float
+        Space between grid points.
+    ndim : int, optional (default 3)
+        Number of grid dimensions.
+    """
+    key = (radius, spacing, ndim)
+    if key not in _sphere_offsets:
+        half_width = int(np.ceil(radius / spacing)) + 1
+        offsets = np.indices(tuple(2 * half_width + 1 for _ in xrange(ndim)))
+        offsets = offsets.reshape((ndim, -1)).T - half_width
+        cutoff = radius / spacing + np.sqrt(ndim) / 2.
+        keep = np.sum(offsets ** 2, axis=1) <= cutoff ** 2
+        _sphere_offsets[key] = offsets[keep]
+    return _sphere_offsets[key]
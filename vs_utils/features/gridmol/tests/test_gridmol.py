@@ -46,6 +46,23 @@ class TestGrid(unittest.TestCase):
         assert np.array_equal(coords.shape,
                               (self.grid.shape + (self.grid.ndim,)))
 
+    def test_get_all_coords_cache(self):
+        """
+        Test Grid.get_all_coords caching.
+        """
+        coords = self.grid.get_all_coords()
+        other = Grid(self.grid.shape, center=self.grid.center,
+                     spacing=self.grid.spacing)
+        assert other.get_all_coords() is coords
+        assert not coords.flags.writeable
+
+        # grids with a different center get different coordinates
+        other = Grid(self.grid.shape, center=(1, 2, 3),
+                     spacing=self.grid.spacing)
+        other_coords = other.get_all_coords()
+        assert other_coords is not coords
+        assert np.allclose(other_coords - coords, [1, 2, 3])
+
     def test_get_grid_point(self):
         """
         Test Grid.get_grid_point.
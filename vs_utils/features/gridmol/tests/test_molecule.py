@@ -2,6 +2,7 @@
 Tests for molecule.py.
 """
 import numpy as np
+from scipy.spatial.distance import cdist
 import unittest
 
 from ..molecule import GridAtom, GridMol
@@ -39,6 +40,46 @@ class TestGridMol(unittest.TestCase):
         # check that most of the grid is empty
         assert np.count_nonzero(occupancy) < 0.2 * self.mol.size
 
+    def test_get_occupancy_exact(self):
+        """
+        Test GridMol.get_occupancy against distances to all grid points.
+        """
+        mol = GridMol((31, 31, 31), spacing=0.3, center=(0.1, -0.2, 0.3))
+        mol.add_atom((0.17, 0.43, -0.61), 1.7)
+        mol.add_atom((-0.92, 0.05, 0.38), 1.2)
+        occupancy = mol.get_occupancy()
+        coords = mol.get_all_coords().reshape((mol.size, mol.ndim))
+        ref = np.zeros(mol.size, dtype=bool)
+        for atom in mol.atoms:
+            distance = cdist(coords, np.atleast_2d(atom.center)).ravel()
+            ref |= distance <= atom.radius + mol.probe_radius
+        assert np.array_equal(occupancy.ravel(), ref)
+
+    def test_get_batch_occupancy(self):
+        """
+        Test GridMol.get_batch_occupancy.
+        """
+        centers = [[(1, 2, 1), (1, 1, 1)], [(0, 0, 0), (-1, 1, 0)]]
+        radii = [1.6, 1.5]
+        occupancy = self.mol.get_batch_occupancy(centers, radii)
+        distances = self.mol.get_batch_distance(centers, radii)
+        assert occupancy.shape == (2,) + self.mol.shape
+        assert distances.shape == (2,) + self.mol.shape
+        for i in xrange(len(centers)):
+            mol = GridMol(self.mol.shape)
+            for center, radius in zip(centers[i], radii):
+                mol.add_atom(center, radius)
+            assert np.array_equal(occupancy[i], mol.get_occupancy())
+            assert np.allclose(distances[i], mol.get_distance())
+
+    def test_atoms_in_grid(self):
+        """
+        Test GridMol.atoms_in_grid.
+        """
+        centers = [[(1, 2, 1), (1, 2, 3)], [(0, 0, 0), (-3, 0, 0)]]
+        in_grid = self.mol.atoms_in_grid(centers, [1.6, 1.6])
+        assert np.array_equal(in_grid, [[True, False], [True, False]])
+
     def test_get_distance(self):
         """
         Test GridMol.get_distance.
@@ -67,6 +108,31 @@ class TestGridMol(unittest.TestCase):
         assert np.count_nonzero(np.fabs(distances) < threshold) > (
             0.9 * distances.size)
 
+    def test_get_distance_exact(self):
+        """
+        Compare GridMol.get_distance to a brute-force calculation.
+        """
+        rng = np.random.RandomState(20)
+        for _ in xrange(20):
+            self.mol.add_atom(rng.uniform(-1, 1, size=3),
+                              rng.choice([1.2, 1.5, 1.7]))
+        distances = self.mol.get_distance()
+
+        coords = self.mol.get_all_coords().reshape((self.mol.size, 3))
+        centers = [atom.center for atom in self.mol.atoms]
+        radii = np.asarray([atom.radius for atom in self.mol.atoms])
+        ref = cdist(coords, centers) - (radii + self.mol.probe_radius)
+        for i, row in enumerate(ref):
+            if np.any(row < 0):
+                expected = np.amax(row[row < 0])
+            else:
+                expected = np.amin(row)
+            assert np.allclose(distances.ravel()[i], expected)
+
+        # check clipping
+        clipped = self.mol.get_distance(max_distance=1.)
+        assert np.allclose(clipped, np.minimum(distances, 1.))
+
 
 class TestGridAtom(unittest.TestCase):
     """
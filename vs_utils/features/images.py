@@ -6,6 +6,8 @@ __author__ = "Steven Kearnes"
 __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "BSD 3-clause"
 
+import numpy as np
+
 from rdkit.Chem import Draw
 
 from vs_utils.features import Featurizer
@@ -26,20 +28,68 @@ class MolImage(Featurizer):
     engine : str, optional (default 'obabel')
         Which engine to use to generate images. Choose from 'obabel' or
         'rdkit'.
+    batch_size : int, optional (default 1000)
+        Number of molecules depicted by each Open Babel process when
+        featurizing several molecules with the 'obabel' engine.
     """
     name = 'image'
+    execution_args = ['batch_size']
 
-    def __init__(self, size=32, flatten=False, engine='obabel'):
+    def __init__(self, size=32, flatten=False, engine='obabel',
+                 batch_size=1000):
         self.size = size
         if not flatten:
             self.topo_view = True
         self.flatten = flatten
         self.engine = engine
+        self.batch_size = batch_size
 
     def _featurize(self, mol):
         """
         Generate a 2D depiction of a molecule.
 
+        Parameters
+        ----------
+        mol : RDKit Mol
+            Molecule.
+        """
+        pixels = image_utils.get_pixels(self.get_image(mol))
+        if self.flatten:
+            pixels = pixels.ravel()
+        return pixels
+
+    def _featurize_batch(self, mols):
+        """
+        Generate 2D depictions for a batch of molecules.
+
+        Pixels are written into a preallocated uint8 array. With the
+        'obabel' engine, each group of batch_size molecules is depicted by
+        a single Open Babel process.
+
+        Parameters
+        ----------
+        mols : iterable
+            Molecules.
+        """
+        mols = list(mols)
+        pixels = np.zeros((len(mols), self.size, self.size, 3),
+                          dtype=np.uint8)
+        for start in xrange(0, len(mols), self.batch_size):
+            batch = mols[start:start + self.batch_size]
+            if self.engine == 'obabel':
+                images = ob_utils.MolImage(self.size).depict_batch(batch)
+            else:
+                images = [self.get_image(mol) for mol in batch]
+            for i, image in enumerate(images):
+                pixels[start + i] = image_utils.get_pixels(image, 'RGB')
+        if self.flatten:
+            pixels = pixels.reshape((len(mols), -1))
+        return pixels
+
+    def get_image(self, mol):
+        """
+        Generate a 2D depiction of a molecule.
+
         Parameters
         ----------
         mol : RDKit Mol
@@ -53,7 +103,4 @@ class MolImage(Featurizer):
             image = image.convert('RGB')  # drop alpha channel
         else:
             raise NotImplementedError(self.engine)
-        pixels = image_utils.get_pixels(image)
-        if self.flatten:
-            pixels = pixels.ravel()
-        return pixels
+        return image
@@ -7,6 +7,7 @@ __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "BSD 3-clause"
 
 import numpy as np
+import warnings
 
 from vs_utils.features import Featurizer, MolPreparator
 from vs_utils.features.gridmol.molecule import GridAtom, GridMol
@@ -38,43 +39,121 @@ class ShapeGrid(Featurizer):
         Whether to calculate the distance from each grid point to the molecular
         surface. If False, a boolean grid is returned with set bits
         corresponding to points inside the molecule.
+    packbits : bool, optional (default False)
+        Whether to pack occupancy grids into bits along the last axis with
+        np.packbits. Each grid then has shape (size, size, ceil(size / 8)).
+        Use unpack_grid to recover the boolean grid. Only valid for
+        'occupancy' featurization.
+    max_distance : float, optional
+        Maximum distance to the molecular surface for 'distance'
+        featurization. Larger distances are clipped to this value, which
+        also limits the atoms considered for each grid point.
     """
     conformers = True
     name = 'shape'
 
     def __init__(self, size=81, resolution=0.5, hydrogens=False, align=False,
-                 probe_radius=1.4, featurization='occupancy'):
+                 probe_radius=1.4, featurization='occupancy', packbits=False,
+                 max_distance=None):
+        if packbits and featurization != 'occupancy':
+            raise ValueError(
+                "packbits is only valid for 'occupancy' featurization.")
         self.size = size
         self.resolution = resolution
         self.hydrogens = hydrogens
         self.preparator = MolPreparator(align=align, add_hydrogens=hydrogens)
         self.probe_radius = probe_radius
         self.featurization = featurization
+        self.packbits = packbits
+        self.max_distance = max_distance
 
     def _featurize(self, mol):
         """
         Generate shape features for all conformers of a molecule.
 
+        Grids for all conformers are calculated together from a single
+        array of atom coordinates. Atoms that do not fit in the grid are
+        reported with a warning and clipped to the grid boundaries.
+
         Parameters
         ----------
         mol : RDKit Mol
             Molecule.
         """
         mol = self.preparator(mol)
-        features = []
-        for conf in mol.GetConformers():
-            grid_mol = self.embed_mol_in_grid(mol, conf.GetId())
-            if self.featurization == 'distance':
-                this_features = grid_mol.get_distance()
-            elif self.featurization == 'occupancy':
-                this_features = grid_mol.get_occupancy()
-            else:
-                raise NotImplementedError(
-                    "Unrecognized featurization '{}'.".format(
-                        self.featurization))
-            features.append(this_features)
+        centers, radii = self.get_atom_coords(mol)
+        grid_mol = self.get_grid_mol()
+        in_grid = grid_mol.atoms_in_grid(centers, radii)
+        if not np.all(in_grid):
+            name = mol.GetProp('_Name') if mol.HasProp('_Name') else ''
+            outside = zip(*np.nonzero(~in_grid))
+            warnings.warn(
+                "Atoms do not fit in the grid for molecule " +
+                "'{}' (conformer, atom): {}".format(name, outside))
+        if self.featurization == 'distance':
+            features = grid_mol.get_batch_distance(centers, radii,
+                                                   self.max_distance)
+        elif self.featurization == 'occupancy':
+            features = grid_mol.get_batch_occupancy(centers, radii)
+            if self.packbits:
+                features = np.packbits(features, axis=-1)
+        else:
+            raise NotImplementedError(
+                "Unrecognized featurization '{}'.".format(
+                    self.featurization))
         return features
 
+    def get_grid_mol(self):
+        """
+        Get an empty GridMol with the configured grid geometry.
+        """
+        shape = tuple(self.size * np.ones(3, dtype=int))
+        grid_mol = GridMol(shape, spacing=self.resolution,
+                           probe_radius=self.probe_radius)
+        return grid_mol
+
+    def get_atom_coords(self, mol):
+        """
+        Get atom coordinates for all conformers of a molecule, along with
+        atomic radii.
+
+        Parameters
+        ----------
+        mol : RDKit Mol
+            Molecule.
+
+        Returns
+        -------
+        centers : ndarray
+            Atom centers with shape (n_confs, n_atoms, 3).
+        radii : ndarray
+            Atomic radii with shape (n_atoms,).
+        """
+        atoms = [atom for atom in mol.GetAtoms()
+                 if self.hydrogens or atom.GetAtomicNum() != 1]
+        radii = np.asarray(
+            [GridAtom.get_radius_from_atomic_num(atom.GetAtomicNum())
+             for atom in atoms], dtype=float)
+        centers = np.zeros((mol.GetNumConformers(), len(atoms), 3),
+                           dtype=float)
+        for i, conf in enumerate(mol.GetConformers()):
+            for j, atom in enumerate(atoms):
+                centers[i, j] = list(conf.GetAtomPosition(atom.GetIdx()))
+        return centers, radii
+
+    def unpack_grid(self, features):
+        """
+        Recover boolean occupancy grids from packed features.
+
+        Parameters
+        ----------
+        features : array_like
+            Packed occupancy grid(s), with bits packed along the last axis.
+        """
+        grid = np.unpackbits(np.asarray(features, dtype=np.uint8), axis=-1)
+        grid = np.asarray(grid[..., :self.size], dtype=bool)
+        return grid
+
     def embed_mol_in_grid(self, mol, conf_id):
         """
         Add atoms from a molecule to a GridMol.
@@ -86,9 +165,7 @@ class ShapeGrid(Featurizer):
         conf_id : int
             RDKit molecule conformer ID.
         """
-        shape = tuple(self.size * np.ones(3, dtype=int))
-        grid_mol = GridMol(shape, spacing=self.resolution,
-                           probe_radius=self.probe_radius)
+        grid_mol = self.get_grid_mol()
         conf = mol.GetConformer(conf_id)
         for atom in mol.GetAtoms():
             if not self.hydrogens and atom.GetAtomicNum() == 1:
@@ -48,3 +48,44 @@ class TestSimpleDescriptors(unittest.TestCase):
     assert np.allclose(
       descriptors[0, self.engine.descriptors.index('ExactMolWt')], 180,
       atol=0.1)
+    assert descriptors.dtype == np.float64
+
+  def testDescriptorSubset(self):
+    """
+    Test descriptor selection by name and group.
+    """
+    engine = SimpleDescriptors(descriptors='ExactMolWt,TPSA',
+                               groups=['crippen'])
+    assert engine.descriptors == ['ExactMolWt', 'MolLogP', 'MolMR', 'TPSA']
+    descriptors = engine([self.mol])
+    assert descriptors.shape == (1, 4)
+    ref = self.engine([self.mol])
+    for i, name in enumerate(engine.descriptors):
+      assert np.allclose(descriptors[0, i],
+                         ref[0, self.engine.descriptors.index(name)])
+
+  def testUnknownDescriptor(self):
+    """
+    Test that unknown descriptors and groups raise errors.
+    """
+    with self.assertRaises(ValueError):
+      SimpleDescriptors(descriptors=['Foo'])
+    with self.assertRaises(ValueError):
+      SimpleDescriptors(groups=['foo'])
+
+  def testFailedDescriptor(self):
+    """
+    Test that failed descriptors are returned as NaN.
+    """
+    def fail(mol):
+      raise ValueError('Failed.')
+    engine = SimpleDescriptors(descriptors=['ExactMolWt'], timing=True)
+    engine.descriptors.append('Fail')
+    engine.functions.append(fail)
+    engine.timings['Fail'] = 0.
+    descriptors = engine([self.mol, self.mol])
+    assert descriptors.shape == (2, 2)
+    assert np.allclose(descriptors[:, 0], 180, atol=0.1)
+    assert np.all(np.isnan(descriptors[:, 1]))
+    assert [name for name, _ in engine.get_timings()] in (
+      ['ExactMolWt', 'Fail'], ['Fail', 'ExactMolWt'])
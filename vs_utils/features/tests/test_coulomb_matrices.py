@@ -63,3 +63,84 @@ class TestCoulombMatrix(unittest.TestCase):
         rval = f([self.mol])
         size = np.triu_indices(self.mol.GetNumAtoms())[0].size
         assert rval.shape == (1, self.mol.GetNumConformers(), size)
+
+    def test_coulomb_matrix_values(self):
+        """
+        Test Coulomb matrix values against a direct calculation.
+        """
+        f = cm.CoulombMatrix(max_atoms=self.mol.GetNumAtoms() + 5,
+                             remove_hydrogens=False, randomize=False)
+        m = f.coulomb_matrix(self.mol)
+        n_atoms = self.mol.GetNumAtoms()
+        assert m.shape == (self.mol.GetNumConformers(), n_atoms + 5,
+                           n_atoms + 5)
+        conf = self.mol.GetConformer()
+        for i in xrange(n_atoms):
+            z_i = self.mol.GetAtomWithIdx(i).GetAtomicNum()
+            for j in xrange(n_atoms):
+                z_j = self.mol.GetAtomWithIdx(j).GetAtomicNum()
+                if i == j:
+                    ref = 0.5 * z_i ** 2.4
+                else:
+                    ref = z_i * z_j / conf.GetAtomPosition(i).Distance(
+                        conf.GetAtomPosition(j))
+                assert np.allclose(m[0, i, j], ref)
+        assert np.all(m[:, n_atoms:] == 0)
+        assert np.all(m[:, :, n_atoms:] == 0)
+
+        # check upper triangles
+        features = f([self.mol])
+        assert np.allclose(features[0, 0], m[0][np.triu_indices(n_atoms + 5)])
+
+    def test_randomize_n_samples(self):
+        """
+        Test generation of multiple randomized matrices.
+        """
+        f = cm.CoulombMatrix(self.mol.GetNumAtoms(), remove_hydrogens=False,
+                             n_samples=3)
+        rval = f([self.mol])
+        size = np.triu_indices(self.mol.GetNumAtoms())[0].size
+        assert rval.shape == (1, self.mol.GetNumConformers() * 3, size)
+
+        # randomized matrices are permutations of the original matrix
+        ref = cm.CoulombMatrix(self.mol.GetNumAtoms(),
+                               remove_hydrogens=False, randomize=False)
+        ref_m = ref.coulomb_matrix(self.mol)[0]
+        for m in f.coulomb_matrix(self.mol):
+            assert np.allclose(np.sort(m.ravel()), np.sort(ref_m.ravel()))
+
+    def test_seed(self):
+        """
+        Test that seeded randomization does not depend on molecule order.
+        """
+        mol = Chem.MolFromSmiles('CC(C)CC1=CC=C(C=C1)C(C)C(=O)O')
+        engine = conformers.ConformerGenerator(max_conformers=1)
+        other = engine.generate_conformers(mol)
+        f = cm.CoulombMatrix(max_atoms=50, n_samples=5, seed=123)
+        a = f([self.mol, other])
+        b = f([other, self.mol])
+        assert np.array_equal(a[0], b[1])
+        assert np.array_equal(a[1], b[0])
+
+    def test_packed(self):
+        """
+        Test packed Coulomb matrices.
+        """
+        max_atoms = self.mol.GetNumAtoms() * 2
+        f = cm.CoulombMatrix(max_atoms, randomize=False)
+        packed_f = cm.CoulombMatrix(max_atoms, randomize=False, packed=True)
+        ref = f([self.mol, self.mol])
+        rval = packed_f([self.mol, self.mol])
+        assert rval.shape == (2,)
+        assert rval[0].dtype == np.float32
+        n_atoms = Chem.RemoveHs(self.mol).GetNumAtoms()
+        size = np.triu_indices(n_atoms)[0].size
+        assert rval[0].shape == (self.mol.GetNumConformers(), size)
+
+        # reconstruct padded features
+        loader = cm.PackedCoulombMatrices(rval, max_atoms)
+        assert len(loader) == 2
+        assert np.allclose(loader[0], ref[0])
+        assert np.allclose(loader[:], ref)
+        m = loader.get_matrices(1)
+        assert np.allclose(m, f.coulomb_matrix(self.mol))
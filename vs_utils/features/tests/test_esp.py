@@ -1,6 +1,7 @@
 """
 Tests for electrostatic potential features.
 """
+import numpy as np
 import unittest
 
 from rdkit import Chem
@@ -38,3 +39,70 @@ class TestESP(unittest.TestCase):
         assert rval.shape[:2] == (2, 1)
         size = rval.shape[2]
         assert rval.shape[2:] == (size, size, size)
+        assert rval.dtype == np.float64
+
+    def test_esp_ionize_batch(self):
+        """
+        Test that batch ionization matches individual ionization.
+        """
+        f = ESP()
+        rval = f(self.mols)
+        for i, mol in enumerate(self.mols):
+            assert np.allclose(rval[i, 0], f._featurize(mol)[0])
+
+        # molecules that fail batch ionization are ionized individually
+        f.preparator.ionizer.ionize_batch = lambda mols: [None] * len(mols)
+        assert np.allclose(f(self.mols), rval)
+
+    def test_esp_crop_float16(self):
+        """
+        Test ESP with cropping and float16 output.
+        """
+        f = ESP(size=30., resolution=0.5, crop=20., dtype='float16')
+        rval = f(self.mols)
+        assert rval.shape == (2, 1, 41, 41, 41)
+        assert rval.dtype == np.float16
+
+        # compare to the center of the full grid
+        ref = ESP(size=30., resolution=0.5)(self.mols)
+        assert np.allclose(rval, ref[:, :, 10:51, 10:51, 10:51], rtol=1e-2,
+                           atol=1e-2)
+
+    def test_esp_crop_odd(self):
+        """
+        Test that crops that cannot be centered raise an error.
+        """
+        with self.assertRaises(ValueError):
+            ESP(size=30., resolution=0.5, crop=19.5)
+        f = ESP(size=30., resolution=0.5, crop=20.)
+        with self.assertRaises(ValueError):
+            f.convert_grid(np.zeros((60, 60, 60)))
+
+    def test_esp_pbsa_dtype(self):
+        """
+        Test that grids are parsed with the output precision.
+        """
+        for dtype, parse_dtype in [('float64', np.float64),
+                                   ('float32', np.float32),
+                                   ('float16', np.float32),
+                                   ('int16', np.float32)]:
+            assert ESP(dtype=dtype).get_pbsa().dtype == parse_dtype
+
+    def test_esp_int16(self):
+        """
+        Test ESP with int16 quantization.
+        """
+        f = ESP(dtype='int16')
+        rval = f(self.mols)
+        assert rval.shape == (2, 1)
+        assert rval['grid'].dtype == np.int16
+        assert np.all(rval['scale'] > 0)
+
+        # compare dequantized grids to full-precision grids
+        grids = ESP.dequantize(rval)
+        ref = ESP()(self.mols)
+        assert grids.shape == ref.shape
+        for grid, ref_grid, scale in zip(grids.reshape((2, -1)),
+                                         ref.reshape((2, -1)),
+                                         rval['scale'].ravel()):
+            assert np.amax(np.fabs(grid - ref_grid)) <= scale
@@ -53,6 +53,35 @@ class TestFeaturizer(unittest.TestCase):
                           client_kwargs={'cluster_id': cluster.cluster_id})
         assert np.array_equal(rval, parallel_rval)
 
+    def test_multiprocessing(self):
+        """
+        Test parallel featurization with the multiprocessing backend.
+        """
+        mols = [self.mol, Chem.MolFromSmiles('CCO'), self.mol]
+        f = MolecularWeight()
+        rval = f(mols)
+        parallel_rval = f(mols, parallel=True, backend='multiprocessing',
+                          n_jobs=2, chunk_size=2)
+        assert np.array_equal(rval, parallel_rval)
+
+    def test_multiprocessing_pool(self):
+        """
+        Test reusing a process pool across calls.
+        """
+        mols = [self.mol, Chem.MolFromSmiles('CCO'), self.mol]
+        f = MolecularWeight()
+        rval = f(mols)
+        pool = f.get_pool(2)
+        try:
+            for _ in xrange(2):
+                parallel_rval = f(mols, parallel=True,
+                                  backend='multiprocessing', chunk_size=2,
+                                  pool=pool)
+                assert np.array_equal(rval, parallel_rval)
+        finally:
+            pool.terminate()
+            pool.join()
+
 
 class TestMolPreparator(unittest.TestCase):
     """
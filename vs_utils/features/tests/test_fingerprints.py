@@ -1,9 +1,15 @@
 """
 Test topological fingerprints.
 """
+import numpy as np
+import os
+from scipy import sparse as sp
+import shutil
+import tempfile
 import unittest
 
 from rdkit import Chem
+from rdkit.Chem import rdMolDescriptors
 
 from vs_utils.features import fingerprints as fp
 
@@ -26,6 +32,24 @@ class TestCircularFingerprint(unittest.TestCase):
         """
         rval = self.engine([self.mol])
         assert rval.shape == (1, self.engine.size)
+        assert rval.dtype == np.uint8
+
+        # compare to RDKit bit vector
+        ref = rdMolDescriptors.GetMorganFingerprintAsBitVect(
+            self.mol, 2, nBits=self.engine.size)
+        assert np.array_equal(np.where(rval[0])[0], list(ref.GetOnBits()))
+
+    def test_packed_circular_fingerprints(self):
+        """
+        Test CircularFingerprint with packed bits.
+        """
+        mols = [self.mol, Chem.MolFromSmiles('CCO')]
+        ref = self.engine(mols)
+        engine = fp.CircularFingerprint(packbits=True)
+        rval = engine(mols)
+        assert rval.shape == (2, self.engine.size / 8)
+        assert rval.dtype == np.uint8
+        assert np.array_equal(np.unpackbits(rval, axis=-1), ref)
 
     def test_sparse_circular_fingerprints(self):
         """
@@ -52,3 +76,63 @@ class TestCircularFingerprint(unittest.TestCase):
         for fragment_id, value in rval[0].items():
             assert 'count' in value
             assert 'smiles' in value
+
+    def test_fragment_smiles_cache(self):
+        """
+        Test fragment SMILES cache and vocabulary files.
+        """
+        temp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(temp_dir, 'vocabulary.smi')
+            engine = fp.CircularFingerprint(sparse=True, smiles=True)
+            ref = engine([self.mol])
+            vocabulary = engine.get_vocabulary(ref)
+            assert len(vocabulary) == len(ref[0])
+            fp.write_vocabulary(vocabulary, filename)
+            assert fp.read_vocabulary(filename) == vocabulary
+
+            # SMILES are read from the cache instead of being regenerated
+            cache = engine.get_smiles_cache()
+            cache.clear()
+            fake = {fragment_id: 'C' for fragment_id in vocabulary}
+            fp.write_vocabulary(fake, filename)
+            engine = fp.CircularFingerprint(sparse=True, smiles=True,
+                                            smiles_cache=filename)
+            rval = engine([self.mol])
+            for fragment_id, value in rval[0].items():
+                assert value['smiles'] == 'C'
+                assert value['count'] == ref[0][fragment_id]['count']
+            cache.clear()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_csr_circular_fingerprints(self):
+        """
+        Test CircularFingerprint with CSR output.
+        """
+        mols = [self.mol, Chem.MolFromSmiles('CCO')]
+        engine = fp.CircularFingerprint(sparse=True, sparse_format='csr',
+                                        size=64)
+        rval = engine(mols)
+        assert sp.isspmatrix_csr(rval)
+        assert rval.shape == (2, 64)
+
+        # compare hashed columns to dict output
+        ref = fp.CircularFingerprint(sparse=True)(mols)
+        for i in xrange(len(mols)):
+            counts = np.zeros(64, dtype=int)
+            for fragment_id, count in ref[i].items():
+                counts[fragment_id % 64] += count
+            assert np.array_equal(rval[i].toarray().ravel(), counts)
+
+    def test_csr_circular_fingerprints_parallel(self):
+        """
+        Test CircularFingerprint with CSR output using multiprocessing.
+        """
+        mols = [self.mol, Chem.MolFromSmiles('CCO')] * 3
+        engine = fp.CircularFingerprint(sparse=True, sparse_format='csr')
+        ref = engine(mols)
+        rval = engine(mols, parallel=True, backend='multiprocessing',
+                      n_jobs=2, chunk_size=2)
+        assert sp.isspmatrix_csr(rval)
+        assert (rval != ref).nnz == 0
@@ -1,6 +1,7 @@
 """
 Test image featurizer.
 """
+import numpy as np
 import unittest
 
 from rdkit import Chem
@@ -36,6 +37,18 @@ class TestOBabelMolImage(unittest.TestCase):
         rval = f([self.mol])
         assert rval.shape == (1, 250, 250, 3), rval.shape
 
+    def test_images_batch(self):
+        """
+        Test that batch depiction matches single-molecule depiction.
+        """
+        mols = [self.mol, Chem.MolFromSmiles('CCO'), self.mol]
+        f = images.MolImage(64, engine=self.engine, batch_size=2)
+        rval = f(mols)
+        assert rval.shape == (3, 64, 64, 3), rval.shape
+        assert rval.dtype == np.uint8
+        for mol, pixels in zip(mols, rval):
+            assert np.array_equal(pixels, f._featurize(mol))
+
 
 class TestRDKitMolImage(TestOBabelMolImage):
     """
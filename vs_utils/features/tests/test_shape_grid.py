@@ -1,7 +1,9 @@
 """
 Tests for grid-based shape features.
 """
+import numpy as np
 import unittest
+import warnings
 
 from rdkit import Chem
 
@@ -34,6 +36,16 @@ class TestShapeGrid(unittest.TestCase):
         features = self.engine(self.mols)
         assert features.shape == (len(self.mols), self.max_confs, 81, 81, 81)
 
+    def test_distance_max_distance(self):
+        """
+        Test ShapeGrid with distances clipped to a maximum distance.
+        """
+        ref = ShapeGrid(featurization='distance', size=41)(self.mols[:1])
+        self.engine = ShapeGrid(featurization='distance', size=41,
+                                max_distance=2.)
+        features = self.engine(self.mols[:1])
+        assert np.ma.allclose(features, np.ma.minimum(ref, 2.))
+
     def test_occupancy(self):
         """
         Test ShapeGrid with occupancy featurization.
@@ -42,6 +54,45 @@ class TestShapeGrid(unittest.TestCase):
         features = self.engine(self.mols)
         assert features.shape == (len(self.mols), self.max_confs, 81, 81, 81)
 
+    def test_occupancy_packbits(self):
+        """
+        Test ShapeGrid with packed occupancy grids.
+        """
+        self.engine = ShapeGrid(featurization='occupancy', packbits=True)
+        features = self.engine(self.mols)
+        assert features.shape == (len(self.mols), self.max_confs, 81, 81, 11)
+        grid = self.engine.unpack_grid(features)
+        ref = ShapeGrid(featurization='occupancy')(self.mols)
+        assert np.array_equal(grid, ref)
+
+    def test_batch_matches_embed(self):
+        """
+        Test that batch features match GridMol features for each conformer.
+        """
+        for featurization in ['distance', 'occupancy']:
+            self.engine = ShapeGrid(featurization=featurization)
+            features = self.engine._featurize(self.mols[0])
+            assert len(features) == self.mols[0].GetNumConformers()
+            for i, conf in enumerate(self.mols[0].GetConformers()):
+                grid_mol = self.engine.embed_mol_in_grid(self.mols[0],
+                                                         conf.GetId())
+                if featurization == 'distance':
+                    ref = grid_mol.get_distance()
+                else:
+                    ref = grid_mol.get_occupancy()
+                assert np.allclose(features[i], ref)
+
+    def test_atoms_outside_grid(self):
+        """
+        Test ShapeGrid with atoms that do not fit in the grid.
+        """
+        self.engine = ShapeGrid(size=11)
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            features = self.engine(self.mols)
+        assert len(w)
+        assert features.shape == (len(self.mols), self.max_confs, 11, 11, 11)
+
     def test_embed_mol_in_grid(self):
         """
         Test ShapeGrid.embed_mol_in_grid.
@@ -9,24 +9,40 @@ __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "BSD 3-clause"
 
 import argparse
+from collections import OrderedDict
 import inspect
 import joblib
+import json
 import numpy as np
+import os
 import pandas as pd
-
-from vs_utils.features import get_featurizers
-from vs_utils.utils import (read_pickle, ScaffoldGenerator, SmilesGenerator,
-                            write_dataframe)
+from scipy import sparse as sp
+import warnings
+
+from vs_utils.features import get_featurizers, resolve_featurizer
+from vs_utils.features.fingerprints import (CircularFingerprint,
+                                            read_vocabulary, write_vocabulary)
+from vs_utils.utils import (h5_utils, read_pickle, ScaffoldGenerator,
+                            SmilesGenerator, write_dataframe)
+from vs_utils.utils.cache_utils import FeatureCache
 from vs_utils.utils.parallel_utils import LocalCluster
 from vs_utils.utils.rdkit_utils import serial
 
 
+# data container keys that are not feature sets
+ANNOTATION_KEYS = ['mol_id', 'y', 'smiles', 'scaffolds']
+
+
 def parse_args(input_args=None):
     """
     Parse command-line arguments. Each featurizer class is a subcommand
     whose arguments are stored in args.featurizer_kwargs. The featurizer
     class is stored in args.klass.
 
+    The 'multi' subcommand runs several featurizers described in a config
+    file (see read_featurizer_config). In this case args.klass is None and
+    the config filename is stored in args.config.
+
     Parameters
     ----------
     input_args : list, optional
@@ -51,9 +67,25 @@ def parse_args(input_args=None):
     parser.add_argument('-np', '--n-engines', type=int,
                         help='Start a local IPython.parallel cluster with ' +
                              'this many engines.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Featurize with a local multiprocessing pool ' +
+                             'with this many worker processes.')
+    parser.add_argument('--chunk-size', type=int, default=100,
+                        help='Number of molecules sent to each worker ' +
+                             'process at a time (used with --jobs).')
     parser.add_argument('output',
                         help=('Output filename (.joblib, .pkl, .pkl.gz, .csv, '
-                              'or .csv.gz).'))
+                              '.csv.gz, or .h5).'))
+    parser.add_argument('-b', '--batch-size', type=int,
+                        help='Read, featurize, and write molecules in ' +
+                             'batches of this size (requires .csv, ' +
+                             '.csv.gz, or .h5 output).')
+    parser.add_argument('--cache',
+                        help='Feature cache filename. Only molecules that ' +
+                             'are not in the cache are featurized.')
+    parser.add_argument('--cache-size', type=float,
+                        help='Maximum size of the feature cache (in MB). ' +
+                             'Least recently used entries are evicted.')
     parser.add_argument('-c', '--compression-level', type=int, default=3,
                         help='Compression level (0-9) to use with ' +
                              'joblib.dump.')
@@ -91,10 +123,22 @@ def parse_args(input_args=None):
                                          action='store_true')
             else:
                 command.add_argument('--{}'.format(arg), **kwargs)
+    command = subparsers.add_parser(
+        'multi', help='Run several featurizers in a single pass.',
+        formatter_class=HelpFormatter,
+        epilog=read_featurizer_config.__doc__)
+    command.set_defaults(klass=None)
+    command.add_argument('config',
+                         help='JSON or YAML featurizer config file.')
     args = argparse.Namespace()
     args.featurizer_kwargs = parser.parse_args(input_args)
+    args.config = None
+    if args.featurizer_kwargs.klass is None:
+        args.config = args.featurizer_kwargs.config
+        delattr(args.featurizer_kwargs, 'config')
     for arg in ['input', 'output', 'klass', 'targets', 'parallel',
-                'cluster_id', 'n_engines', 'compression_level',
+                'cluster_id', 'n_engines', 'jobs', 'chunk_size',
+                'batch_size', 'cache', 'cache_size', 'compression_level',
                 'smiles_hydrogens', 'include_smiles', 'scaffolds',
                 'chiral_scaffolds', 'mol_prefix']:
         setattr(args, arg, getattr(args.featurizer_kwargs, arg))
@@ -120,14 +164,32 @@ def main(featurizer_class, input_filename, output_filename,
          target_filename=None, featurizer_kwargs=None, parallel=False,
          client_kwargs=None, view_flags=None, compression_level=3,
          smiles_hydrogens=False, include_smiles=False, scaffolds=False,
-         chiral_scaffolds=False, mol_id_prefix=None):
+         chiral_scaffolds=False, mol_id_prefix=None, backend='ipython',
+         n_jobs=None, chunk_size=100, batch_size=None, featurizers=None,
+         cache_filename=None, cache_size=None):
     """
     Featurize molecules in input_filename using the given featurizer.
 
+    If featurizers is provided, molecules are read and prepared once and
+    each featurizer is run on them, with each feature set written to its
+    own dataset (or column) in the output file.
+
+    If cache_filename is provided, features are stored in a FeatureCache
+    and only molecules that are not already in the cache are featurized.
+
+    If batch_size is provided, molecules are read, featurized, and appended
+    to the output file in batches, so memory usage is bounded by the batch
+    size rather than the size of the input file. In this mode, dict targets
+    are matched to molecules by ID and molecules without targets are
+    skipped, but the output follows the order of the input file.
+
+    Sparse circular fingerprints with fragment SMILES also write a fragment
+    vocabulary file next to the output file (see get_vocabulary_filename).
+
     Parameters
     ----------
     featurizer_class : Featurizer
-        Featurizer class.
+        Featurizer class. Ignored if featurizers is provided.
     input_filename : str
         Filename containing molecules to be featurized.
     output_filename : str
@@ -139,8 +201,7 @@ def main(featurizer_class, input_filename, output_filename,
     featurizer_kwargs : dict, optional
         Keyword arguments passed to featurizer.
     parallel : bool, optional
-        Whether to train subtrainers in parallel using IPython.parallel
-        (default False).
+        Whether to featurize molecules in parallel (default False).
     client_kwargs : dict, optional
         Keyword arguments for IPython.parallel Client.
     view_flags : dict, optional
@@ -157,38 +218,204 @@ def main(featurizer_class, input_filename, output_filename,
         Whether to include chirality in scaffolds.
     mol_id_prefix : str, optional
         Prefix for molecule IDs.
+    backend : str, optional (default 'ipython')
+        Parallel backend ('ipython' or 'multiprocessing').
+    n_jobs : int, optional
+        Number of worker processes for the multiprocessing backend.
+    chunk_size : int, optional (default 100)
+        Number of molecules per chunk for the multiprocessing backend.
+    batch_size : int, optional
+        Number of molecules per batch in streaming mode. Only CSV (.csv or
+        .csv.gz) and HDF5 (.h5) output support streaming.
+    featurizers : dict, optional
+        Mapping of dataset names to (featurizer class, featurizer kwargs)
+        tuples (see read_featurizer_config).
+    cache_filename : str, optional
+        Feature cache filename.
+    cache_size : int, optional
+        Maximum size of the feature cache (in bytes).
     """
-    mols, mol_ids = read_mols(input_filename, mol_id_prefix=mol_id_prefix)
-
-    # get targets
-    data = {}
+    if featurizers is None:
+        if featurizer_kwargs is None:
+            featurizer_kwargs = {}
+        featurizers = {'features': (featurizer_class, featurizer_kwargs)}
+    featurizer_kwargs = OrderedDict()
+    for key, (klass, kwargs) in featurizers.items():
+        featurizer_kwargs[key] = get_featurizer_kwargs(klass, kwargs)
+    featurizers = OrderedDict((key, klass(**kwargs))
+                              for key, (klass, kwargs) in featurizers.items())
+    cache = None
+    if cache_filename is not None:
+        cache = FeatureCache(cache_filename, max_size=cache_size)
+    featurize_kwargs = {'parallel': parallel, 'client_kwargs': client_kwargs,
+                        'view_flags': view_flags, 'backend': backend,
+                        'n_jobs': n_jobs, 'chunk_size': chunk_size}
+    targets = None
     if target_filename is not None:
         targets = read_pickle(target_filename)
-        if isinstance(targets, dict):
-            mol_indices, target_indices = collate_mols(
-                mols, mol_ids, targets['y'], targets['mol_id'])
-            mols = mols[mol_indices]
-            mol_ids = mol_ids[mol_indices]
-            targets = np.asarray(targets['y'])[target_indices]
+    vocabularies = {}
+    for key, featurizer in featurizers.items():
+        if (isinstance(featurizer, CircularFingerprint) and featurizer.sparse
+                and featurizer.smiles):
+            vocabularies[key] = {}
+
+    # reuse worker processes across batches
+    pools = {}
+    if parallel and backend == 'multiprocessing':
+        for key, featurizer in featurizers.items():
+            pools[key] = featurizer.get_pool(n_jobs)
+    try:
+        # featurize molecules in batches and append to the output file
+        if batch_size is not None:
+            if isinstance(targets, dict):
+                targets = dict(zip(targets['mol_id'], targets['y']))
+            start = 0
+            with BatchWriter(output_filename) as writer:
+                for mols, mol_ids in read_mol_batches(
+                        input_filename, batch_size,
+                        mol_id_prefix=mol_id_prefix):
+                    n_mols = len(mols)
+                    batch_targets = None
+                    if targets is not None:
+                        mol_indices, batch_targets = select_batch_targets(
+                            mol_ids, targets, start)
+                        mols = mols[mol_indices]
+                        mol_ids = mol_ids[mol_indices]
+                    start += n_mols
+                    if not len(mols):
+                        continue
+                    print "Processing molecules {}-{}...".format(
+                        start - n_mols, start - 1)
+                    data = get_data(featurizers, mols, mol_ids,
+                                    batch_targets, featurize_kwargs,
+                                    smiles_hydrogens, include_smiles,
+                                    scaffolds, chiral_scaffolds, cache,
+                                    featurizer_kwargs, pools)
+                    for key, vocabulary in vocabularies.items():
+                        vocabulary.update(
+                            featurizers[key].get_vocabulary(data[key]))
+                    writer.write(data)
+            for key, vocabulary in vocabularies.items():
+                save_vocabulary(vocabulary, output_filename,
+                                featurizers[key].smiles_cache, key)
+            print_timings(featurizers, parallel)
+            return
+
+        # read molecules and collate with targets
+        mols, mol_ids = read_mols(input_filename, mol_id_prefix=mol_id_prefix)
+        if targets is not None:
+            if isinstance(targets, dict):
+                mol_indices, target_indices = collate_mols(
+                    mols, mol_ids, targets['y'], targets['mol_id'])
+                mols = mols[mol_indices]
+                mol_ids = mol_ids[mol_indices]
+                targets = np.asarray(targets['y'])[target_indices]
+            else:
+                assert len(targets) == len(mols)
+
+        # featurize molecules
+        data = get_data(featurizers, mols, mol_ids, targets, featurize_kwargs,
+                        smiles_hydrogens, include_smiles, scaffolds,
+                        chiral_scaffolds, cache, featurizer_kwargs, pools)
+        for key, vocabulary in vocabularies.items():
+            vocabulary.update(featurizers[key].get_vocabulary(data[key]))
+            save_vocabulary(vocabulary, output_filename,
+                            featurizers[key].smiles_cache, key)
+
+        # write output file
+        print "Saving results..."
+        if output_filename.endswith('.h5'):
+            with h5_utils.ChunkedH5Writer(output_filename) as writer:
+                writer.append(data)
         else:
-            assert len(targets) == len(mols)
-        data['y'] = targets
+            df = get_dataframe(data, output_filename)
+            write_output_file(df, output_filename, compression_level)
+        print_timings(featurizers, parallel)
 
-    # featurize molecules
-    print "Featurizing molecules..."
+    finally:
+        for pool in pools.values():
+            pool.terminate()
+            pool.join()
+
+
+def get_data(featurizer, mols, mol_ids, targets=None, featurize_kwargs=None,
+             smiles_hydrogens=False, include_smiles=False, scaffolds=False,
+             chiral_scaffolds=False, cache=None, featurizer_kwargs=None,
+             pools=None):
+    """
+    Featurize molecules and collect features, molecule IDs, and any
+    requested annotations.
+
+    Parameters
+    ----------
+    featurizer : Featurizer or dict
+        Featurizer, or a mapping of dataset names to featurizers.
+    mols : array_like
+        Molecules.
+    mol_ids : array_like
+        Molecule IDs.
+    targets : array_like, optional
+        Target values for molecules.
+    featurize_kwargs : dict, optional
+        Keyword arguments for featurizer.featurize.
+    smiles_hydrogens : bool, optional (default False)
+        Whether to keep hydrogens when generating SMILES.
+    include_smiles : bool, optional (default False)
+        Include SMILES in output.
+    scaffolds : bool, optional (default False)
+        Whether to include scaffolds in output.
+    chiral_scaffods : bool, optional (default False)
+        Whether to include chirality in scaffolds.
+    cache : FeatureCache, optional
+        Feature cache. If provided, only molecules that are not in the
+        cache are featurized.
+    featurizer_kwargs : dict, optional
+        Arguments used to construct the featurizer (or a mapping of
+        dataset names to arguments if featurizer is a dict). Used to
+        construct cache keys.
+    pools : dict or multiprocessing.Pool, optional
+        Process pools (see Featurizer.get_pool) for the multiprocessing
+        backend, keyed like featurizer (or a single pool if featurizer is
+        not a dict).
+
+    Returns
+    -------
+    data : dict
+        Data container with 'features' (or one key for each dataset name
+        if featurizer is a dict) and 'mol_id' keys, plus 'y', 'smiles', and
+        'scaffolds' keys if requested.
+    """
+    data = {}
+    if targets is not None:
+        data['y'] = targets
+    if not isinstance(featurizer, dict):
+        featurizer = {'features': featurizer}
+        featurizer_kwargs = {'features': featurizer_kwargs}
+        if pools is not None:
+            pools = {'features': pools}
     if featurizer_kwargs is None:
         featurizer_kwargs = {}
-    featurizer = featurizer_class(**featurizer_kwargs)
-    features = featurizer.featurize(mols, parallel, client_kwargs, view_flags)
+    if pools is None:
+        pools = {}
+
+    # featurize molecules
+    if featurize_kwargs is None:
+        featurize_kwargs = {}
+    for key, engine in featurizer.items():
+        print "Featurizing molecules ({})...".format(key)
+        kwargs = dict(featurize_kwargs)
+        if key in pools:
+            kwargs['pool'] = pools[key]
+        if cache is not None:
+            data[key] = cache.featurize(engine, mols,
+                                        featurizer_kwargs.get(key), **kwargs)
+        else:
+            data[key] = engine.featurize(mols, **kwargs)
+        assert data[key].shape[0] == len(mols), (
+            "Features do not match molecules.")
 
     # fill in data container
-    print "Saving results..."
     data['mol_id'] = mol_ids
-    data['features'] = features
-
-    # sanity checks
-    assert data['features'].shape[0] == len(mols), (
-        "Features do not match molecules.")
     assert data['mol_id'].shape[0] == len(mols), (
         "Molecule IDs do not match molecules.")
 
@@ -198,25 +425,217 @@ def main(featurizer_class, input_filename, output_filename,
         data['smiles'] = np.asarray([smiles.get_smiles(mol) for mol in mols])
     if scaffolds:
         data['scaffolds'] = get_scaffolds(mols, chiral_scaffolds)
+    return data
 
-    # construct a DataFrame
-    try:
-        if data['features'].ndim > 1:
-            # numpy arrays will be "summarized" when written as strings
-            # use str(row.tolist())[1:-1] to remove the surrounding brackets
-            # remove commas (keeping spaces) to avoid conflicts with csv
-            if (output_filename.endswith('.csv')
-                    or output_filename.endswith('.csv.gz')):
-                data['features'] = [str(row.tolist())[1:-1].replace(', ', ' ')
-                                    for row in data['features']]
+
+def print_timings(featurizers, parallel=False):
+    """
+    Print timings for featurizers that record them (see
+    SimpleDescriptors.get_timings).
+
+    Parameters
+    ----------
+    featurizers : dict
+        Featurizers.
+    parallel : bool, optional (default False)
+        Whether features were calculated in parallel. Timings are recorded
+        by the processes that calculate the features, so they are not
+        available for parallel runs.
+    """
+    for key, featurizer in featurizers.items():
+        if not getattr(featurizer, 'timing', False):
+            continue
+        if parallel:
+            warnings.warn(
+                "Timings for '{}' are not available when ".format(key) +
+                "featurizing in parallel.")
+            continue
+        print "Timings ({}):".format(key)
+        for name, seconds in featurizer.get_timings():
+            print "{}\t{:.3f}".format(name, seconds)
+
+
+def get_dataframe(data, output_filename):
+    """
+    Construct a DataFrame from a data container.
+
+    Parameters
+    ----------
+    data : dict
+        Data container returned by get_data.
+    output_filename : str
+        Output filename. Features are converted to strings for CSV output.
+    """
+    csv = (output_filename.endswith('.csv') or
+           output_filename.endswith('.csv.gz'))
+    for key in data.keys():
+        if key in ANNOTATION_KEYS:
+            continue
+        value = data[key]
+        if (csv and isinstance(value, np.ndarray) and value.dtype == object
+                and any(isinstance(v, np.ndarray) for v in value)):
+            raise ValueError(
+                "Features '{}' contain variable-size arrays ".format(key) +
+                "(for example, packed Coulomb matrices), which cannot be " +
+                "written to CSV. Use .h5 or pickle output instead.")
+        if sp.issparse(value):
+            # CSV output gets one dense row per molecule
+            rows = sp.csr_matrix(value)
+            if csv:
+                data[key] = [
+                    str(row.toarray().ravel().tolist())[1:-1].replace(
+                        ', ', ' ') for row in rows]
             else:
-                data['features'] = [row for row in data['features']]
-    except AttributeError:
-        pass
+                data[key] = [row for row in rows]
+            continue
+        try:
+            if data[key].ndim > 1:
+                # numpy arrays will be "summarized" when written as strings
+                # use str(row.tolist())[1:-1] to remove surrounding brackets
+                # remove commas (keeping spaces) to avoid conflicts with csv
+                if csv:
+                    data[key] = [str(row.tolist())[1:-1].replace(', ', ' ')
+                                 for row in data[key]]
+                else:
+                    data[key] = [row for row in data[key]]
+        except AttributeError:
+            pass
     df = pd.DataFrame(data)
+    return df
+
+
+class BatchWriter(object):
+    """
+    Append batches of featurized data to an output file.
+
+    Parameters
+    ----------
+    filename : str
+        Output filename. Should end with .csv, .csv.gz, or .h5.
+    """
+    def __init__(self, filename):
+        if not filename.endswith(('.csv', '.csv.gz', '.h5')):
+            raise NotImplementedError(
+                'Streaming is only supported for .csv, .csv.gz, and .h5 ' +
+                'output.')
+        self.filename = filename
+        self.append = False
+        self.h5_writer = None
+        if filename.endswith('.h5'):
+            self.h5_writer = h5_utils.ChunkedH5Writer(filename)
+
+    def __enter__(self):
+        """
+        Context manager entrance.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        Context manager exit. Closes any open file handles.
+
+        Parameters
+        ----------
+        exc_type : class
+            Exception class that caused the context to exit.
+        exc_val : object
+            Exception that caused the context to exit.
+        exc_tb : traceback
+            Exception traceback.
+        """
+        self.close()
+
+    def close(self):
+        """
+        Close the output file.
+        """
+        if self.h5_writer is not None:
+            self.h5_writer.close()
+
+    def write(self, data):
+        """
+        Append a batch of data to the output file.
+
+        Parameters
+        ----------
+        data : dict
+            Data container returned by get_data.
+        """
+        if self.h5_writer is not None:
+            self.h5_writer.append(data)
+        else:
+            df = get_dataframe(data, self.filename)
+            write_dataframe(df, self.filename, append=self.append)
+        self.append = True
 
-    # write output file
-    write_output_file(df, output_filename, compression_level)
+
+def read_featurizer_config(filename):
+    """
+    Read a featurizer config file for the 'multi' subcommand.
+
+    The config file (JSON, or YAML if the filename ends with .yaml or .yml)
+    contains a list of featurizer specs. Each spec is a dict with a
+    'featurizer' key giving the featurizer name (as used for subcommands),
+    plus optional 'name' (dataset name; defaults to the featurizer name)
+    and 'kwargs' (featurizer arguments) keys. For example:
+
+    [{"featurizer": "circular", "kwargs": {"size": 1024}},
+     {"featurizer": "circular", "name": "sparse_circular",
+      "kwargs": {"sparse": true}},
+     {"featurizer": "descriptors"}]
+
+    Parameters
+    ----------
+    filename : str
+        Config filename.
+
+    Returns
+    -------
+    An OrderedDict mapping dataset names to (featurizer class, featurizer
+    kwargs) tuples.
+    """
+    with open(filename) as f:
+        if filename.endswith(('.yaml', '.yml')):
+            import yaml
+            specs = yaml.safe_load(f)
+        else:
+            specs = json.load(f)
+    featurizers = OrderedDict()
+    for spec in specs:
+        klass = resolve_featurizer(spec['featurizer'])
+        name = str(spec.get('name', spec['featurizer']))
+        if name in featurizers or name in ANNOTATION_KEYS:
+            raise ValueError(
+                "Duplicate or reserved dataset name '{}'.".format(name))
+        kwargs = dict((str(key), value)
+                      for key, value in spec.get('kwargs', {}).items())
+        featurizers[name] = (klass, kwargs)
+    return featurizers
+
+
+def get_featurizer_kwargs(klass, kwargs):
+    """
+    Get the arguments used to construct a featurizer, with defaults for any
+    arguments that are not provided. Featurizers that are configured the
+    same way get the same arguments (and therefore the same cache keys),
+    whether or not default values are given explicitly.
+
+    Parameters
+    ----------
+    klass : class
+        Featurizer class.
+    kwargs : dict
+        Featurizer arguments.
+    """
+    rval = {}
+    try:
+        args, _, _, defaults = inspect.getargspec(klass.__init__)
+    except TypeError:
+        args, defaults = [], None
+    if defaults is not None:
+        rval.update(zip(args[-len(defaults):], defaults))
+    rval.update(kwargs)
+    return rval
 
 
 def collate_mols(mols, mol_names, targets, target_ids):
@@ -288,18 +707,99 @@ def read_mols(input_filename, mol_id_prefix=None, log_every_N=1000):
         if num % 1000 == 0:
           print "Reading molecule %d" % num
         mols.append(mol)
-        if mol.HasProp('_Name'):
-          name = mol.GetProp('_Name')
-          if mol_id_prefix is not None:
-            name = mol_id_prefix + name
-          names.append(name)
-        else:
-          names.append(None)
+        names.append(get_mol_id(mol, mol_id_prefix))
     mols = np.asarray(mols)
     names = np.asarray(names)
     return mols, names
 
 
+def read_mol_batches(input_filename, batch_size, mol_id_prefix=None):
+    """
+    Read batches of molecules from an input file and extract names.
+
+    Parameters
+    ----------
+    input_filename : str
+        Filename containing molecules.
+    batch_size : int
+        Number of molecules per batch.
+    mol_id_prefix : str, optional
+        Prefix for molecule IDs.
+
+    Returns
+    -------
+    A generator yielding (mols, names) tuples of ndarrays.
+    """
+    mols = []
+    names = []
+    with serial.MolReader().open(input_filename) as reader:
+        for mol in reader.get_mols():
+            mols.append(mol)
+            names.append(get_mol_id(mol, mol_id_prefix))
+            if len(mols) >= batch_size:
+                yield np.asarray(mols), np.asarray(names)
+                mols = []
+                names = []
+    if len(mols):
+        yield np.asarray(mols), np.asarray(names)
+
+
+def get_mol_id(mol, mol_id_prefix=None):
+    """
+    Get the ID for a molecule.
+
+    Parameters
+    ----------
+    mol : RDKit Mol
+        Molecule.
+    mol_id_prefix : str, optional
+        Prefix for molecule IDs.
+
+    Returns
+    -------
+    The molecule name (with prefix), or None if the molecule is unnamed.
+    """
+    if not mol.HasProp('_Name'):
+        return None
+    name = mol.GetProp('_Name')
+    if mol_id_prefix is not None:
+        name = mol_id_prefix + name
+    return name
+
+
+def select_batch_targets(mol_ids, targets, start):
+    """
+    Select targets for a batch of molecules.
+
+    Parameters
+    ----------
+    mol_ids : array_like
+        Molecule IDs for the batch.
+    targets : dict or array_like
+        Either a dict mapping molecule IDs to target values or target
+        values for every molecule in the input file (in file order).
+    start : int
+        Index of the first molecule in the batch relative to the input
+        file.
+
+    Returns
+    -------
+    mol_indices : array_like
+        Indices of batch molecules that have targets.
+    y : array_like
+        Targets corresponding to selected molecules.
+    """
+    if isinstance(targets, dict):
+        mol_indices = np.asarray([i for i, mol_id in enumerate(mol_ids)
+                                  if mol_id in targets], dtype=int)
+        y = np.asarray([targets[mol_ids[i]] for i in mol_indices])
+    else:
+        mol_indices = np.arange(len(mol_ids))
+        y = np.asarray(targets[start:start + len(mol_ids)])
+        assert len(y) == len(mol_ids), "Targets do not match molecules."
+    return mol_indices, y
+
+
 def get_scaffolds(mols, include_chirality=False):
     """
     Get Murcko scaffolds for molecules.
@@ -324,6 +824,54 @@ def get_scaffolds(mols, include_chirality=False):
     return scaffolds
 
 
+def get_vocabulary_filename(output_filename, key='features'):
+    """
+    Get the filename for the fragment vocabulary written next to an output
+    file. For example, the vocabulary for 'out/foo.pkl.gz' is
+    'out/foo-vocabulary.smi', or 'out/foo-{key}-vocabulary.smi' for feature
+    sets other than 'features'.
+
+    Parameters
+    ----------
+    output_filename : str
+        Output filename.
+    key : str, optional (default 'features')
+        Feature set name.
+    """
+    dirname, basename = os.path.split(output_filename)
+    prefix = basename.split('.')[0]
+    if key != 'features':
+        prefix = '{}-{}'.format(prefix, key)
+    return os.path.join(dirname, '{}-vocabulary.smi'.format(prefix))
+
+
+def save_vocabulary(vocabulary, output_filename, smiles_cache=None,
+                    key='features'):
+    """
+    Write a fragment vocabulary next to an output file, and merge it into
+    an on-disk SMILES cache if one is used.
+
+    Parameters
+    ----------
+    vocabulary : dict
+        Mapping of fragment IDs to SMILES.
+    output_filename : str
+        Output filename.
+    smiles_cache : str, optional
+        SMILES cache filename.
+    key : str, optional (default 'features')
+        Feature set name.
+    """
+    write_vocabulary(vocabulary,
+                     get_vocabulary_filename(output_filename, key))
+    if smiles_cache is not None:
+        cache = {}
+        if os.path.exists(smiles_cache):
+            cache = read_vocabulary(smiles_cache)
+        cache.update(vocabulary)
+        write_vocabulary(cache, smiles_cache)
+
+
 def write_output_file(data, filename, compression_level=3):
     """
     Pickle output data, possibly to a compressed file.
@@ -345,6 +893,14 @@ def write_output_file(data, filename, compression_level=3):
 if __name__ == '__main__':
     args = parse_args()
 
+    # use a local process pool
+    backend = 'ipython'
+    if args.jobs is not None:
+        assert args.n_engines is None and args.cluster_id is None, (
+            'IPython.parallel options cannot be combined with --jobs.')
+        args.parallel = True
+        backend = 'multiprocessing'
+
     # start a cluster
     if args.n_engines is not None:
         assert args.cluster_id is None, ('Cluster ID should not be should ' +
@@ -361,6 +917,15 @@ if __name__ == '__main__':
         client_kwargs = None
     view_flags = {'retries': 1}
 
+    # featurizers for the 'multi' subcommand
+    featurizers = None
+    if args.config is not None:
+        featurizers = read_featurizer_config(args.config)
+
+    cache_size = None
+    if args.cache_size is not None:
+        cache_size = int(args.cache_size * 1024 * 1024)
+
     # run main function
     main(featurizer_class=args.klass,
          input_filename=args.input,
@@ -375,4 +940,11 @@ if __name__ == '__main__':
          include_smiles=args.include_smiles,
          scaffolds=args.scaffolds,
          chiral_scaffolds=args.chiral_scaffolds,
-         mol_id_prefix=args.mol_prefix)
+         mol_id_prefix=args.mol_prefix,
+         backend=backend,
+         n_jobs=args.jobs,
+         chunk_size=args.chunk_size,
+         batch_size=args.batch_size,
+         featurizers=featurizers,
+         cache_filename=args.cache,
+         cache_size=cache_size)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+"""
+Generate conformers for molecules and save them to disk in shards.
+
+Shards are named with DatasetSharder conventions ({prefix}-{index}.{flavor}).
+A manifest ({prefix}-manifest.json) records finished shards, so a restarted
+job skips them. Molecules for which conformer generation fails are written
+to a reject file for each shard ({prefix}-{index}-rejects.smi) instead of
+aborting the run.
+"""
+
+__author__ = "Steven Kearnes"
+__copyright__ = "Copyright 2014, Stanford University"
+__license__ = "BSD 3-clause"
+
+import argparse
+import json
+import multiprocessing
+import os
+
+from rdkit import Chem
+
+from vs_utils.utils import DatasetSharder
+from vs_utils.utils.rdkit_utils import conformers, PicklableMol
+
+
+def parse_args(input_args=None):
+    """
+    Parse command-line arguments.
+
+    Parameters
+    ----------
+    input_args : list, optional
+        Input arguments. If not provided, defaults to sys.argv[1:].
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input',
+                        help='Input filename.')
+    parser.add_argument('-n', type=int, default=1000,
+                        help='Number of molecules per shard.')
+    parser.add_argument('-p', '--prefix',
+                        help='Prefix for output files. Defaults to prefix ' +
+                             'of input filename.')
+    parser.add_argument('-f', '--flavor', default='pkl.gz',
+                        help='Output flavor.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Number of worker processes. Defaults to the ' +
+                             'number of CPUs.')
+    parser.add_argument('--max-conformers', type=int, default=1,
+                        help='Maximum number of conformers per molecule.')
+    parser.add_argument('--rmsd-threshold', type=float, default=0.5,
+                        help='RMSD threshold for pruning conformers.')
+    parser.add_argument('--force-field', default='uff',
+                        choices=['uff', 'mmff94', 'mmff94s'],
+                        help='Force field for minimization.')
+    parser.add_argument('--pool-multiplier', type=int, default=10,
+                        help='Factor to multiply by max_conformers to ' +
+                             'generate the initial conformer pool.')
+    parser.add_argument('--num-threads', type=int, default=1,
+                        help='Number of threads used by each worker for ' +
+                             'embedding and minimization (0 uses all ' +
+                             'available threads).')
+    parser.add_argument('--no-symmetric-rmsd', dest='symmetric_rmsd',
+                        action='store_false',
+                        help='Use heavy-atom Kabsch RMSD instead of ' +
+                             'symmetry-aware RMSD for pruning (faster).')
+    return parser.parse_args(input_args)
+
+
+def main(filename, shard_size=1000, prefix=None, flavor='pkl.gz',
+         n_jobs=None, max_conformers=1, rmsd_threshold=0.5, force_field='uff',
+         pool_multiplier=10, num_threads=1, symmetric_rmsd=True):
+    """
+    Generate conformers and write them to disk in shards.
+
+    A restarted job only resumes if the input filename and shard size match
+    those recorded in the manifest.
+
+    Parameters
+    ----------
+    filename : str
+        Input filename.
+    shard_size : int, optional (default 1000)
+        Number of input molecules per shard.
+    prefix : str, optional
+        Prefix for output files. Defaults to the prefix of the input
+        filename, as extracted by DatasetSharder.
+    flavor : str, optional (default 'pkl.gz')
+        Output molecule format used as the extension for shard filenames.
+    n_jobs : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    max_conformers : int, optional (default 1)
+        Maximum number of conformers per molecule.
+    rmsd_threshold : float, optional (default 0.5)
+        RMSD threshold for pruning conformers.
+    force_field : str, optional (default 'uff')
+        Force field for minimization.
+    pool_multiplier : int, optional (default 10)
+        Factor to multiply by max_conformers to generate the initial
+        conformer pool.
+    num_threads : int, optional (default 1)
+        Number of threads used by each worker process for embedding and
+        minimization. If 0, all available threads are used.
+    symmetric_rmsd : bool, optional (default True)
+        Whether to use symmetry-aware RMSD for pruning. If False, faster
+        heavy-atom Kabsch RMSD is used.
+    """
+    sharder = DatasetSharder(filename=filename, shard_size=shard_size,
+                             prefix=prefix, flavor=flavor)
+    manifest_filename = '{}-manifest.json'.format(sharder.prefix)
+    manifest = read_manifest(manifest_filename, filename, shard_size)
+    engine = conformers.ConformerGenerator(
+        max_conformers=max_conformers, rmsd_threshold=rmsd_threshold,
+        force_field=force_field, pool_multiplier=pool_multiplier,
+        num_threads=num_threads, symmetric_rmsd=symmetric_rmsd)
+    pool = multiprocessing.Pool(n_jobs, initializer=_init_worker,
+                                initargs=(engine,))
+    try:
+        for index, shard in enumerate(sharder):
+            shard_filename = sharder.get_shard_filename(index)
+            if shard_filename in manifest['shards']:
+                print "Skipping finished shard '{}'.".format(shard_filename)
+                continue
+            mols = [PicklableMol(mol) for mol in shard]
+            results = pool.map(_generate_conformers, mols, chunksize=1)
+            keep = []
+            rejects = []
+            for mol, (new, error) in zip(mols, results):
+                if new is None:
+                    rejects.append((mol, error))
+                else:
+                    keep.append(new)
+            sharder.write_shard(keep, shard_filename)
+            rejects_filename = '{}-{}-rejects.smi'.format(sharder.prefix,
+                                                          index)
+            write_rejects(rejects, rejects_filename)
+
+            # only mark the shard as finished once all output is written
+            manifest['shards'][shard_filename] = {
+                'n_mols': len(keep), 'n_rejects': len(rejects)}
+            write_manifest(manifest, manifest_filename)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def read_manifest(filename, input_filename, shard_size):
+    """
+    Read a checkpoint manifest, or create a new one if it does not exist.
+
+    Parameters
+    ----------
+    filename : str
+        Manifest filename.
+    input_filename : str
+        Input filename.
+    shard_size : int
+        Number of input molecules per shard.
+
+    Raises
+    ------
+    ValueError
+        If the manifest was written for a different input file or shard
+        size, since finished shards would not match the new shards.
+    """
+    input_filename = os.path.abspath(input_filename)
+    if not os.path.exists(filename):
+        return {'input': input_filename, 'shard_size': shard_size,
+                'shards': {}}
+    with open(filename) as f:
+        manifest = json.load(f)
+    if (manifest.get('input') != input_filename or
+            manifest.get('shard_size') != shard_size):
+        raise ValueError(
+            "Manifest '{}' was written for input '{}' with ".format(
+                filename, manifest.get('input')) +
+            "shard size {}; refusing to resume.".format(
+                manifest.get('shard_size')))
+    return manifest
+
+
+def write_manifest(manifest, filename):
+    """
+    Write a checkpoint manifest.
+
+    The manifest is written to a temporary file and then renamed, so an
+    interrupted write does not corrupt an existing manifest.
+
+    Parameters
+    ----------
+    manifest : dict
+        Manifest.
+    filename : str
+        Manifest filename.
+    """
+    temp_filename = '{}.tmp'.format(filename)
+    with open(temp_filename, 'wb') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(temp_filename, filename)
+
+
+def write_rejects(rejects, filename):
+    """
+    Write molecules that failed conformer generation to a SMILES file.
+
+    Each line contains the SMILES, name, and error message, separated by
+    tabs. Any existing file is overwritten, so a shard that is rerun after
+    an interruption does not duplicate rejects.
+
+    Parameters
+    ----------
+    rejects : list
+        Tuples containing a molecule and an error message.
+    filename : str
+        Reject filename.
+    """
+    if not len(rejects):
+        if os.path.exists(filename):
+            os.remove(filename)
+        return
+    with open(filename, 'wb') as f:
+        for mol, error in rejects:
+            name = mol.GetProp('_Name') if mol.HasProp('_Name') else ''
+            f.write('{}\t{}\t{}\n'.format(
+                Chem.MolToSmiles(mol, isomericSmiles=True), name, error))
+
+
+# conformer generator used by worker processes
+_worker_engine = None
+
+
+def _init_worker(engine):
+    """
+    Store the conformer generator in a worker process.
+
+    Parameters
+    ----------
+    engine : ConformerGenerator
+        Conformer generator.
+    """
+    global _worker_engine
+    _worker_engine = engine
+
+
+def _generate_conformers(mol):
+    """
+    Generate conformers for a molecule in a worker process.
+
+    Parameters
+    ----------
+    mol : PicklableMol
+        Molecule.
+
+    Returns
+    -------
+    A tuple containing the molecule with conformers (or None if conformer
+    generation failed) and an error message (or None).
+    """
+    try:
+        return PicklableMol(_worker_engine.generate_conformers(mol)), None
+    except (RuntimeError, ValueError) as e:
+        return None, str(e)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args.input, args.n, args.prefix, args.flavor, args.jobs,
+         args.max_conformers, args.rmsd_threshold, args.force_field,
+         args.pool_multiplier, args.num_threads, args.symmetric_rmsd)
@@ -1,17 +1,26 @@
 """
 Test featurize.py.
 """
+from cStringIO import StringIO
+import h5py
 import joblib
+import json
 import numpy as np
+import os
+from scipy import sparse as sp
 import shutil
+import sys
 import tempfile
 import unittest
 
 from rdkit import Chem
 from rdkit.Chem import AllChem
 
-from vs_utils.scripts.featurize import main, parse_args
+from vs_utils.features.fingerprints import CircularFingerprint, read_vocabulary
+from vs_utils.scripts.featurize import (get_featurizer_kwargs, main,
+                                        parse_args, read_featurizer_config)
 from vs_utils.utils import read_csv_features, read_pickle, write_pickle
+from vs_utils.utils.cache_utils import FeatureCache
 from vs_utils.utils.rdkit_utils import conformers, serial
 
 
@@ -148,6 +157,42 @@ class TestFeaturize(unittest.TestCase):
         assert isinstance(value, dict)
         assert len(value)
 
+  def test_csr_circular_h5(self):
+    """
+    Test CSR circular fingerprints with HDF5 output.
+    """
+    engine = CircularFingerprint(sparse=True, sparse_format='csr')
+    ref = engine(self.mols)
+    output_filename = os.path.join(self.temp_dir, 'features.h5')
+    args = parse_args([self.input_filename, '-b', '1', output_filename,
+                       'circular', '--sparse', '--sparse_format', 'csr'])
+    main(args.klass, args.input, args.output,
+         featurizer_kwargs=vars(args.featurizer_kwargs),
+         batch_size=args.batch_size)
+    with h5py.File(output_filename) as f:
+      group = f['features']
+      assert tuple(group.attrs['shape']) == ref.shape
+      features = sp.csr_matrix(
+          (group['data'][:], group['indices'][:], group['indptr'][:]),
+          shape=tuple(group.attrs['shape']))
+    assert np.array_equal(features.toarray(), ref.toarray())
+
+  def test_csr_circular_csv(self):
+    """
+    Test CSR circular fingerprints with CSV output.
+    """
+    engine = CircularFingerprint(sparse=True, sparse_format='csr')
+    ref = engine(self.mols)
+    output_filename = os.path.join(self.temp_dir, 'features.csv')
+    args = parse_args([self.input_filename, output_filename, 'circular',
+                       '--sparse', '--sparse_format', 'csr'])
+    main(args.klass, args.input, args.output,
+         featurizer_kwargs=vars(args.featurizer_kwargs))
+    data = read_csv_features(output_filename)
+    assert len(data) == 2
+    for i in xrange(len(data)):
+      assert np.array_equal(data.ix[i, 'features'], ref[i].toarray()[0])
+
   def test_coulomb_matrix(self):
     """
     Test Coulomb matrices.
@@ -185,6 +230,24 @@ class TestFeaturize(unittest.TestCase):
     """
     self.check_output(['descriptors'], (2, 196))
 
+  def test_descriptor_timings(self):
+    """
+    Test that descriptor timings are reported.
+    """
+    output_filename = os.path.join(self.temp_dir, 'features.pkl')
+    args = parse_args([self.input_filename, output_filename, 'descriptors',
+                       '--descriptors', 'ExactMolWt,TPSA', '--timing'])
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+      main(args.klass, args.input, args.output,
+           featurizer_kwargs=vars(args.featurizer_kwargs))
+      output = sys.stdout.getvalue()
+    finally:
+      sys.stdout = stdout
+    assert 'Timings (features):' in output
+    assert 'ExactMolWt' in output and 'TPSA' in output
+
   def test_scaffold(self):
     """
     Test scaffold featurizer.
@@ -232,6 +295,126 @@ class TestFeaturize(unittest.TestCase):
 
     assert achiral_scaffold != chiral_scaffold
 
+  def test_streaming(self):
+    """
+    Featurize molecules in batches and append them to a CSV file.
+    """
+    _, output_filename = tempfile.mkstemp(suffix='.csv.gz',
+                                          dir=self.temp_dir)
+    args = parse_args([self.input_filename, '-t', self.targets_filename,
+                       '--smiles', '-b', '1', output_filename, 'circular'])
+    main(args.klass, args.input, args.output, target_filename=args.targets,
+         featurizer_kwargs=vars(args.featurizer_kwargs),
+         include_smiles=args.include_smiles, batch_size=args.batch_size)
+    data = read_csv_features(output_filename)
+    assert len(data) == 2
+    assert data.ix[0, 'features'].shape == (2048,)
+    assert np.array_equal(data['y'], self.targets)
+    assert np.array_equal(data['mol_id'], self.names)
+    assert np.array_equal(data['smiles'], self.smiles)
+
+  def test_vocabulary(self):
+    """
+    Test that a fragment vocabulary is written next to the output file.
+    """
+    output_filename = os.path.join(self.temp_dir, 'features.csv')
+    args = parse_args([self.input_filename, '-b', '1', output_filename,
+                       'circular', '--sparse', '--smiles'])
+    main(args.klass, args.input, args.output,
+         featurizer_kwargs=vars(args.featurizer_kwargs),
+         batch_size=args.batch_size)
+    vocabulary = read_vocabulary(
+        os.path.join(self.temp_dir, 'features-vocabulary.smi'))
+    engine = CircularFingerprint(sparse=True, smiles=True)
+    ref = engine.get_vocabulary(engine(self.mols))
+    assert vocabulary == ref
+
+  def test_multi(self):
+    """
+    Run several featurizers in a single pass.
+    """
+    config_filename = os.path.join(self.temp_dir, 'config.json')
+    with open(config_filename, 'wb') as f:
+      json.dump([{'featurizer': 'circular', 'kwargs': {'size': 512}},
+                 {'featurizer': 'mw', 'name': 'weight'}], f)
+    output_filename = os.path.join(self.temp_dir, 'features.h5')
+    args = parse_args([self.input_filename, '-t', self.targets_filename,
+                       '-b', '1', output_filename, 'multi', config_filename])
+    assert args.klass is None
+    main(args.klass, args.input, args.output, target_filename=args.targets,
+         batch_size=args.batch_size,
+         featurizers=read_featurizer_config(args.config))
+    with h5py.File(output_filename) as f:
+      assert f['circular'].shape == (2, 512)
+      assert f['weight'].shape == (2, 1)
+      assert 'features' not in f
+      assert np.array_equal(f['y'], self.targets)
+      assert np.array_equal(f['mol_id'], self.names)
+
+  def test_cache(self):
+    """
+    Test that cached features are used instead of featurizing molecules.
+    """
+    cache_filename = os.path.join(self.temp_dir, 'cache.db')
+    output_filename = os.path.join(self.temp_dir, 'features.h5')
+    args = parse_args([self.input_filename, '-b', '1', '--cache',
+                       cache_filename, output_filename, 'circular'])
+    main(args.klass, args.input, args.output,
+         featurizer_kwargs=vars(args.featurizer_kwargs),
+         batch_size=args.batch_size, cache_filename=args.cache)
+    with h5py.File(output_filename) as f:
+      ref = f['features'][:]
+
+    # keys for default arguments match keys for command-line arguments
+    engine = CircularFingerprint()
+    kwargs = get_featurizer_kwargs(CircularFingerprint, {})
+    keys = [FeatureCache.get_key(mol, engine, kwargs) for mol in self.mols]
+    cache = FeatureCache(cache_filename)
+    assert len(cache.get(keys)) == len(self.mols)
+
+    # modify cached features so cache hits show up in the output
+    cache.put(keys, [row + 1 for row in ref])
+    config_filename = os.path.join(self.temp_dir, 'config.json')
+    with open(config_filename, 'wb') as f:
+      json.dump([{'featurizer': 'circular', 'name': 'features'}], f)
+    args = parse_args([self.input_filename, '-b', '1', '--cache',
+                       cache_filename, output_filename, 'multi',
+                       config_filename])
+    main(args.klass, args.input, args.output, batch_size=args.batch_size,
+         featurizers=read_featurizer_config(args.config),
+         cache_filename=args.cache)
+    with h5py.File(output_filename) as f:
+      assert np.array_equal(f['features'][:], ref + 1)
+
+  def test_packed_csv(self):
+    """
+    Test that packed Coulomb matrices cannot be written to CSV.
+    """
+    output_filename = os.path.join(self.temp_dir, 'features.csv')
+    args = parse_args([self.input_filename, output_filename,
+                       'coulomb_matrix', '--max_atoms', '50', '--packed'])
+    with self.assertRaises(ValueError):
+      main(args.klass, args.input, args.output,
+           featurizer_kwargs=vars(args.featurizer_kwargs))
+
+  def test_streaming_h5(self):
+    """
+    Featurize molecules in batches and append them to an HDF5 file.
+    """
+    _, output_filename = tempfile.mkstemp(suffix='.h5', dir=self.temp_dir)
+    args = parse_args([self.input_filename, '-t', self.targets_filename,
+                       '--smiles', '-b', '1', output_filename,
+                       'coulomb_matrix', '--max_atoms', '50'])
+    main(args.klass, args.input, args.output, target_filename=args.targets,
+         featurizer_kwargs=vars(args.featurizer_kwargs),
+         include_smiles=args.include_smiles, batch_size=args.batch_size)
+    with h5py.File(output_filename) as f:
+      assert f['features'].shape == (2, 1, 1275)
+      assert f['features_mask'].shape == (2, 1, 1275)
+      assert np.array_equal(f['y'], self.targets)
+      assert np.array_equal(f['mol_id'], self.names)
+      assert np.array_equal(f['smiles'], self.smiles)
+
   def test_collate_mols1(self):
     """
     Test collate_mols where molecules are pruned.
@@ -0,0 +1,112 @@
+"""
+Test generate_conformers.py.
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from rdkit import Chem
+from rdkit.Chem import AllChem
+
+from vs_utils.scripts.generate_conformers import main
+from vs_utils.utils.rdkit_utils import serial
+
+
+class TestGenerateConformers(unittest.TestCase):
+    """
+    Test generate_conformers.py.
+    """
+    def setUp(self):
+        """
+        Set up tests.
+        """
+        self.reader = serial.MolReader()
+
+        # generate molecules
+        smiles = ['CC(=O)OC1=CC=CC=C1C(=O)O', 'CC(C)CC1=CC=C(C=C1)C(C)C(=O)O',
+                  'CC1=CC=C(C=C1)C2=CC(=NN2C3=CC=C(C=C3)S(=O)(=O)N)C(F)(F)F']
+        names = ['aspirin', 'ibuprofen', 'celecoxib']
+        self.mols = []
+        for s, n in zip(smiles, names):
+            mol = Chem.MolFromSmiles(s)
+            mol.SetProp('_Name', n)
+            AllChem.Compute2DCoords(mol)
+            self.mols.append(mol)
+
+        # write molecules to file
+        self.temp_dir = tempfile.mkdtemp()
+        writer = serial.MolWriter()
+        _, self.filename = tempfile.mkstemp(dir=self.temp_dir,
+                                            suffix='.sdf.gz')
+        with writer.open(self.filename) as w:
+            w.write(self.mols)
+        self.prefix = os.path.join(self.temp_dir, 'foo')
+
+    def tearDown(self):
+        """
+        Clean up tests.
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def test_main(self):
+        """
+        Test main.
+        """
+        main(self.filename, 2, self.prefix, n_jobs=2, max_conformers=2)
+        mols = []
+        for index in xrange(2):
+            filename = '{}-{}.pkl.gz'.format(self.prefix, index)
+            mols.extend(self.reader.open(filename).get_mols())
+        assert len(mols) == len(self.mols)
+        for mol, ref in zip(mols, self.mols):
+            assert mol.GetProp('_Name') == ref.GetProp('_Name')
+            assert 0 < mol.GetNumConformers() <= 2
+        with open('{}-manifest.json'.format(self.prefix)) as f:
+            manifest = json.load(f)
+        assert len(manifest['shards']) == 2
+        for index in xrange(2):
+            assert not os.path.exists(
+                '{}-{}-rejects.smi'.format(self.prefix, index))
+
+    def test_resume(self):
+        """
+        Test that finished shards are skipped.
+        """
+        main(self.filename, 2, self.prefix, n_jobs=1)
+        filename = '{}-0.pkl.gz'.format(self.prefix)
+        os.remove(filename)
+        main(self.filename, 2, self.prefix, n_jobs=1)
+        assert not os.path.exists(filename)
+
+    def test_resume_mismatch(self):
+        """
+        Test that a job does not resume with a different shard size.
+        """
+        main(self.filename, 2, self.prefix, n_jobs=1)
+        with self.assertRaises(ValueError):
+            main(self.filename, 1, self.prefix, n_jobs=1)
+
+    def test_rejects(self):
+        """
+        Test that failed molecules are written to the reject file.
+        """
+        main(self.filename, 2, self.prefix, n_jobs=1, max_conformers=0)
+
+        # rerun an interrupted shard
+        manifest_filename = '{}-manifest.json'.format(self.prefix)
+        with open(manifest_filename) as f:
+            manifest = json.load(f)
+        del manifest['shards']['{}-1.pkl.gz'.format(self.prefix)]
+        with open(manifest_filename, 'wb') as f:
+            json.dump(manifest, f)
+        main(self.filename, 2, self.prefix, n_jobs=1, max_conformers=0)
+
+        lines = []
+        for index in xrange(2):
+            with open('{}-{}-rejects.smi'.format(self.prefix, index)) as f:
+                lines.extend(f.readlines())
+        assert len(lines) == len(self.mols)
+        names = [line.split('\t')[1] for line in lines]
+        assert names == [mol.GetProp('_Name') for mol in self.mols]
@@ -18,7 +18,7 @@ from rdkit.Chem.Scaffolds import MurckoScaffold
 from vs_utils.utils.rdkit_utils import PicklableMol, serial
 
 
-def write_dataframe(df, filename):
+def write_dataframe(df, filename, append=False):
     """
     Serialize DataFrame.
 
@@ -28,12 +28,21 @@ def write_dataframe(df, filename):
       DataFrame to serialize.
     filename : str
       Output filename (file format is determined by suffix).
+    append : bool, optional (default False)
+      Append rows to an existing file instead of overwriting it. The
+      header is only written when append is False. Only supported for CSV
+      output.
     """
+    mode = 'ab' if append else 'wb'
     if filename.endswith('csv'):
-        df.to_csv(filename, index=False)
+        with open(filename, mode) as f:
+          df.to_csv(f, index=False, header=(not append))
     elif filename.endswith('csv.gz'):
-        with gzip.open(filename, 'wb') as f:
-          df.to_csv(f, index=False)
+        with gzip.open(filename, mode) as f:
+          df.to_csv(f, index=False, header=(not append))
+    elif append:
+        raise NotImplementedError(
+            'Cannot append to "{}"'.format(filename))
     elif filename.endswith('.pkl') or filename.endswith('.pkl.gz'):
         write_pickle(df, filename)
     else:
@@ -172,12 +181,23 @@ class DatasetSharder(object):
         """
         Generate the next shard filename.
         """
-        if self.prefix is None:
-            raise ValueError('Prefix must be provided when writing shards.')
-        filename = '{}-{}.{}'.format(self.prefix, self.index, self.flavor)
+        filename = self.get_shard_filename(self.index)
         self.index += 1
         return filename
 
+    def get_shard_filename(self, index):
+        """
+        Get the filename for a shard.
+
+        Parameters
+        ----------
+        index : int
+            Shard index.
+        """
+        if self.prefix is None:
+            raise ValueError('Prefix must be provided when writing shards.')
+        return '{}-{}.{}'.format(self.prefix, index, self.flavor)
+
     def read_mols_from_file(self):
         """
         Read molecules from a file.
@@ -222,7 +242,7 @@ class DatasetSharder(object):
         """
         return self._shard()
 
-    def write_shard(self, mols):
+    def write_shard(self, mols, filename=None):
         """
         Write molecules to the next shard file.
 
@@ -233,11 +253,20 @@ class DatasetSharder(object):
         ----------
         mols : array_like
             Molecules.
+        filename : str, optional
+            Output filename. Defaults to the next shard filename.
+
+        Returns
+        -------
+        filename : str
+            Output filename.
         """
         mols = [PicklableMol(mol) for mol in mols]  # preserve properties
-        filename = self._next_filename()
+        if filename is None:
+            filename = self._next_filename()
         with self.writer.open(filename) as f:
             f.write(mols)
+        return filename
 
 
 def pad_array(x, shape, fill=0, both=False):
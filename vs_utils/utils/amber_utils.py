@@ -8,9 +8,12 @@ __license__ = "BSD 3-clause"
 
 from collections import OrderedDict
 from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import os
+import Queue
 import shutil
+import sqlite3
 import subprocess
 import tempfile
 
@@ -30,9 +33,15 @@ class Antechamber(object):
     ----------
     charge_type : str, optional (default 'bcc')
         Antechamber charge type string. Defaults to AM1-BCC charges.
+    cache : ChargeCache or str, optional
+        Cache (or cache filename) for charges and radii. If provided,
+        Antechamber is only run for molecules that are not in the cache.
     """
-    def __init__(self, charge_type='bcc'):
+    def __init__(self, charge_type='bcc', cache=None):
         self.charge_type = charge_type
+        if isinstance(cache, basestring):
+            cache = ChargeCache(cache)
+        self.cache = cache
 
         # temporary directory
         self.temp_dir = tempfile.mkdtemp()
@@ -60,6 +69,10 @@ class Antechamber(object):
             Molecule.
         """
         net_charge = self.get_net_charge(mol)
+        if self.cache is not None:
+            rval = self.cache.get(mol, self.charge_type, net_charge)
+            if rval is not None:
+                return rval
 
         # write molecule to temporary file
         _, input_filename = tempfile.mkstemp(suffix='.sdf', dir=self.temp_dir)
@@ -90,6 +103,8 @@ class Antechamber(object):
         with open(output_filename) as f:
             charges, radii = reader.get_charges_and_radii(f)
 
+        if self.cache is not None:
+            self.cache.put(mol, self.charge_type, net_charge, charges, radii)
         return charges, radii
 
     @staticmethod
@@ -108,12 +123,141 @@ class Antechamber(object):
         return net_charge
 
 
+class ChargeCache(object):
+    """
+    Disk-backed cache for Antechamber charges and radii.
+
+    Entries are stored in an SQLite database and keyed by canonical
+    isomeric SMILES, the order of atoms in the molecule relative to the
+    canonical SMILES, charge type, and net charge. Each process opens its
+    own database connection, so a cache can be shared between parallel
+    workers.
+
+    Parameters
+    ----------
+    filename : str
+        SQLite database filename.
+    timeout : float, optional (default 60.)
+        Time (in seconds) to wait for database locks held by other
+        processes.
+    """
+    def __init__(self, filename, timeout=60.):
+        self.filename = filename
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS charges (smiles TEXT, ' +
+                'atom_order TEXT, charge_type TEXT, net_charge INTEGER, ' +
+                'charges BLOB, radii BLOB, PRIMARY KEY (smiles, atom_order, ' +
+                'charge_type, net_charge))')
+
+    def __getstate__(self):
+        """
+        Drop the database connection when pickling.
+        """
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_pid'] = None
+        return state
+
+    def _connect(self):
+        """
+        Get a database connection for the current process.
+        """
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.filename,
+                                               timeout=self.timeout)
+            self._pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def get_key(mol, charge_type, net_charge):
+        """
+        Get the cache key for a molecule.
+
+        Parameters
+        ----------
+        mol : RDMol
+            Molecule.
+        charge_type : str
+            Antechamber charge type string.
+        net_charge : int
+            Net charge on the molecule.
+        """
+        mol = Chem.Mol(mol)
+        smiles = Chem.MolToSmiles(mol, isomericSmiles=True)
+        atom_order = mol.GetProp('_smilesAtomOutputOrder')
+        return smiles, atom_order, charge_type, int(net_charge)
+
+    def get(self, mol, charge_type, net_charge):
+        """
+        Get cached charges and radii for a molecule.
+
+        Parameters
+        ----------
+        mol : RDMol
+            Molecule.
+        charge_type : str
+            Antechamber charge type string.
+        net_charge : int
+            Net charge on the molecule.
+
+        Returns
+        -------
+        A tuple containing charges and radii, or None if the molecule is
+        not in the cache.
+        """
+        key = self.get_key(mol, charge_type, net_charge)
+        row = self._connect().execute(
+            'SELECT charges, radii FROM charges WHERE smiles=? AND ' +
+            'atom_order=? AND charge_type=? AND net_charge=?', key).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        charges, radii = [np.fromstring(str(value), dtype=float)
+                          for value in row]
+        return charges, radii
+
+    def put(self, mol, charge_type, net_charge, charges, radii):
+        """
+        Add charges and radii for a molecule to the cache.
+
+        Parameters
+        ----------
+        mol : RDMol
+            Molecule.
+        charge_type : str
+            Antechamber charge type string.
+        net_charge : int
+            Net charge on the molecule.
+        charges : array_like
+            Atomic partial charges.
+        radii : array_like
+            Atomic radii.
+        """
+        key = self.get_key(mol, charge_type, net_charge)
+        values = [sqlite3.Binary(np.asarray(value, dtype=float).tostring())
+                  for value in [charges, radii]]
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO charges VALUES (?, ?, ?, ?, ?, ?)',
+                key + tuple(values))
+
+
 class PBSA(object):
     """
     Wrapper methods for PBSA functionality.
 
     Calculations are carried out in a temporary directory because PBSA
-    writes out several files to disk.
+    writes out several files to disk. The parameter file is written once,
+    and each calculation runs in one of n_workers isolated working
+    directories, so concurrent calculations do not overwrite each other's
+    output.
 
     Parameters
     ----------
@@ -129,21 +273,47 @@ class PBSA(object):
     ionic_strength : float, optional (default 150.)
         Ionic strength of the solvent, in mM. Corresponds to PBSA istrng
         parameter.
+    n_workers : int, optional (default 1)
+        Maximum number of concurrent PBSA calculations.
+    dtype : numpy dtype, optional (default np.float32)
+        Data type for ESP grids.
     """
     def __init__(self, size=30., resolution=0.5, nb_cutoff=5.,
-                 ionic_strength=150.):
+                 ionic_strength=150., n_workers=1, dtype=np.float32):
         self.size = float(size)
         self.resolution = float(resolution)
         self.nb_cutoff = float(nb_cutoff)
         self.ionic_strength = float(ionic_strength)
+        self.n_workers = n_workers
+        self.dtype = dtype
+        self.pool = None
 
         # temporary directory
+        # only removed by the creating process (not by forked children)
         self.temp_dir = tempfile.mkdtemp()
+        self.pid = os.getpid()
+
+        # PBSA parameter file (shared by all calculations)
+        self.param_filename = os.path.join(self.temp_dir, 'pbsa.in')
+        with open(self.param_filename, 'wb') as f:
+            f.write(self.get_pbsa_parameter_file())
+
+        # working directories (each is used by one calculation at a time)
+        self.work_dirs = Queue.Queue()
+        for i in xrange(n_workers):
+            work_dir = os.path.join(self.temp_dir, 'worker-{}'.format(i))
+            os.mkdir(work_dir)
+            self.work_dirs.put(work_dir)
 
     def __del__(self):
         """
         Cleanup.
         """
+        # __init__ may have failed before the temporary directory was made
+        if getattr(self, 'pid', None) != os.getpid():
+            return
+        if self.pool is not None:
+            self.pool.terminate()
         shutil.rmtree(self.temp_dir)
 
     def get_esp_grid(self, mol, charges, radii, conf_id=None):
@@ -169,6 +339,55 @@ class PBSA(object):
         grid = self.get_esp_grid_from_pqr(pqr)
         return grid
 
+    def get_esp_grids(self, mol, charges, radii, conf_ids=None):
+        """
+        Use PBSA to calculate electrostatic potential grids for several
+        molecule conformers.
+
+        Up to n_workers conformers are processed concurrently. Failed
+        calculations do not affect other conformers; the CalledProcessError
+        for a failed conformer is returned in place of its grid.
+
+        Parameters
+        ----------
+        mol : RDKit Mol
+            Molecule.
+        charges : array_like
+            Atomic partial charges.
+        radii : array_like
+            Atomic radii.
+        conf_ids : list, optional
+            Conformer IDs. Defaults to all conformers.
+
+        Returns
+        -------
+        A list containing a (grid, center) tuple or a CalledProcessError for
+        each conformer.
+        """
+        if conf_ids is None:
+            conf_ids = [conf.GetId() for conf in mol.GetConformers()]
+        pqrs = [self.mol_to_pqr(mol, charges, radii, conf_id=conf_id)
+                for conf_id in conf_ids]
+        if self.n_workers == 1:
+            return map(self._get_esp_grid_from_pqr, pqrs)
+        if self.pool is None:
+            self.pool = ThreadPool(self.n_workers)
+        return self.pool.map(self._get_esp_grid_from_pqr, pqrs, chunksize=1)
+
+    def _get_esp_grid_from_pqr(self, pqr):
+        """
+        Run get_esp_grid_from_pqr, returning the error if PBSA fails.
+
+        Parameters
+        ----------
+        pqr : file_like
+            Input PQR file.
+        """
+        try:
+            return self.get_esp_grid_from_pqr(pqr)
+        except subprocess.CalledProcessError as e:
+            return e
+
     @staticmethod
     def mol_to_pqr(mol, charges, radii, conf_id=None):
         """
@@ -197,44 +416,45 @@ class PBSA(object):
         Use PBSA to calculate an electrostatic potential grid for a
         molecule (one conformer only) in PQR format.
 
-        The grid is written is ASCII format to pbsa_phi.phi.
+        The grid is written is ASCII format to pbsa_phi.phi in the working
+        directory. This method blocks until a working directory is
+        available, so it is safe to call from multiple threads.
 
         Parameters
         ----------
         pqr : file_like
             Input PQR file.
         """
-        # write PQR to disk
-        pqr_fd, pqr_filename = tempfile.mkstemp(suffix='.pqr',
-                                                dir=self.temp_dir)
-        os.close(pqr_fd)  # close temp file
-        with open(pqr_filename, 'wb') as f:
-            f.write(pqr)
-
-        # write PBSA parameter file
-        param_fd, param_filename = tempfile.mkstemp(suffix='.in',
-                                                    dir=self.temp_dir)
-        os.close(param_fd)  # close temp file
-        with open(param_filename, 'wb') as f:
-            f.write(self.get_pbsa_parameter_file())
-
-        # run PBSA
-        output_fd, output_filename = tempfile.mkstemp(suffix='.out',
-                                                      dir=self.temp_dir)
-        os.close(output_fd)  # close temp file
-        os.remove(output_filename)  # PBSA won't overwrite existing file
-        args = ['pbsa', '-i', param_filename, '-o', output_filename, '-pqr',
-                pqr_filename]
+        work_dir = self.work_dirs.get()
         try:
-            subprocess.check_output(args, cwd=self.temp_dir)
-        except subprocess.CalledProcessError as e:
-            with open(output_filename) as f:
-                print f.read()
-            raise e
-
-        # extract ESP grid
-        with open(os.path.join(self.temp_dir, 'pbsa_phi.phi')) as f:
-            grid, center = self.parse_esp_grid(f)
+            # write PQR to disk
+            pqr_filename = os.path.join(work_dir, 'input.pqr')
+            with open(pqr_filename, 'wb') as f:
+                f.write(pqr)
+
+            # remove output from previous calculations
+            # PBSA won't overwrite existing files
+            output_filename = os.path.join(work_dir, 'pbsa.out')
+            phi_filename = os.path.join(work_dir, 'pbsa_phi.phi')
+            for filename in [output_filename, phi_filename]:
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+            # run PBSA
+            args = ['pbsa', '-i', self.param_filename, '-o', output_filename,
+                    '-pqr', pqr_filename]
+            try:
+                subprocess.check_output(args, cwd=work_dir)
+            except subprocess.CalledProcessError as e:
+                with open(output_filename) as f:
+                    print f.read()
+                raise e
+
+            # extract ESP grid
+            with open(phi_filename) as f:
+                grid, center = self.parse_esp_grid(f)
+        finally:
+            self.work_dirs.put(work_dir)
 
         return grid, center
 
@@ -284,6 +504,10 @@ class PBSA(object):
         flattened version of the grid (with Fortran ordering), we can use
         np.reshape to get the 3D grid.
 
+        The header is read line by line and the potential values are parsed
+        in a single call to np.fromstring, which is much faster than
+        tokenizing each line.
+
         Spatial coordinates (x, y, z) in the grid are given by
         (gox + h * i, goy + h * j, goz + h * k).
 
@@ -299,19 +523,24 @@ class PBSA(object):
         """
         h = gox = goy = goz = None
         xm = ym = zm = None
-        phi_list = []
-        for line in grid:
+
+        # use readline instead of iteration so the file position is correct
+        while xm is None:
+            line = grid.readline()
+            if not line:
+                raise ValueError('Incomplete ESP grid header.')
             line = line.strip()
-            if line.startswith('#'):
+            if not line or line.startswith('#'):
                 continue
             if h is None:
                 h, gox, goy, goz = np.asarray(line.split(), dtype=float)
-            elif xm is None:
-                xm, ym, zm = np.asarray(line.split(), dtype=int)
             else:
-                phi_list.extend(line.split())
+                xm, ym, zm = np.asarray(line.split(), dtype=int)
         dim = (xm, ym, zm)
-        phi = np.asarray(phi_list, dtype=float)
+        phi = np.fromstring(grid.read(), dtype=self.dtype, sep=' ')
+        if phi.size != xm * ym * zm:
+            raise ValueError('ESP grid has {} values; expected {}.'.format(
+                phi.size, xm * ym * zm))
         grid = np.reshape(phi, dim, order='F')
         origin = (gox, goy, goz)
         center = tuple(o + h * (m + 1) / 2. for o, m in zip(origin, dim))
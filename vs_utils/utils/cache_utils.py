@@ -0,0 +1,257 @@
+"""
+Feature caching.
+"""
+
+__author__ = "Steven Kearnes"
+__copyright__ = "Copyright 2014, Stanford University"
+__license__ = "BSD 3-clause"
+
+import cPickle
+import hashlib
+import json
+import numpy as np
+import os
+from scipy import sparse as sp
+import sqlite3
+import time
+
+from rdkit import Chem
+
+
+class FeatureCache(object):
+    """
+    Disk-backed, content-addressed cache for calculated features.
+
+    Entries are stored in an SQLite database and keyed by a hash of the
+    canonical isomeric SMILES of the molecule, the featurizer class, and
+    the featurizer arguments. For featurizers that calculate features for
+    conformers, the key also includes a hash of the conformer coordinates
+    (in canonical atom order). Each process opens its own database
+    connection, so a cache can be shared between parallel workers.
+
+    If max_size is provided, the least recently used entries are evicted
+    when the total size of the cached values exceeds max_size bytes.
+
+    Parameters
+    ----------
+    filename : str
+        SQLite database filename.
+    max_size : int, optional
+        Maximum total size (in bytes) of cached values.
+    timeout : float, optional (default 60.)
+        Time (in seconds) to wait for database locks held by other
+        processes.
+    """
+    def __init__(self, filename, max_size=None, timeout=60.):
+        self.filename = filename
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS features (key TEXT PRIMARY KEY, ' +
+                'value BLOB, size INTEGER, accessed REAL)')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS features_accessed ON ' +
+                'features (accessed)')
+
+    def __getstate__(self):
+        """
+        Drop the database connection when pickling.
+        """
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_pid'] = None
+        return state
+
+    def _connect(self):
+        """
+        Get a database connection for the current process.
+        """
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.filename,
+                                               timeout=self.timeout)
+            self._pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def get_key(mol, featurizer, featurizer_kwargs=None):
+        """
+        Get the cache key for a molecule.
+
+        Parameters
+        ----------
+        mol : RDKit Mol
+            Molecule.
+        featurizer : Featurizer
+            Featurizer.
+        featurizer_kwargs : dict, optional
+            Arguments used to construct the featurizer. Arguments listed in
+            featurizer.execution_args are ignored.
+        """
+        if featurizer_kwargs is None:
+            featurizer_kwargs = {}
+        featurizer_kwargs = dict(
+            (key, value) for key, value in featurizer_kwargs.items()
+            if key not in featurizer.execution_args)
+        mol = Chem.Mol(mol)
+        smiles = Chem.MolToSmiles(mol, isomericSmiles=True)
+        conformers = None
+        if featurizer.conformers:
+            conformers = get_conformer_hash(mol)
+        klass = '{}.{}'.format(featurizer.__class__.__module__,
+                               featurizer.__class__.__name__)
+        key = json.dumps([smiles, conformers, klass, featurizer_kwargs],
+                         sort_keys=True)
+        return hashlib.sha1(key).hexdigest()
+
+    def get(self, keys):
+        """
+        Get cached values.
+
+        Parameters
+        ----------
+        keys : list
+            Cache keys.
+
+        Returns
+        -------
+        A dict mapping keys found in the cache to values.
+        """
+        values = {}
+        with self._connect() as connection:
+            for key in keys:
+                row = connection.execute(
+                    'SELECT value FROM features WHERE key=?',
+                    (key,)).fetchone()
+                if row is not None:
+                    values[key] = cPickle.loads(str(row[0]))
+            now = time.time()
+            connection.executemany(
+                'UPDATE features SET accessed=? WHERE key=?',
+                [(now, key) for key in values])
+        self.hits += len(values)
+        self.misses += len(keys) - len(values)
+        return values
+
+    def put(self, keys, values):
+        """
+        Add values to the cache, evicting the least recently used entries
+        if the cache is too large.
+
+        Parameters
+        ----------
+        keys : list
+            Cache keys.
+        values : list
+            Values corresponding to keys.
+        """
+        now = time.time()
+        rows = []
+        for key, value in zip(keys, values):
+            value = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+            rows.append((key, sqlite3.Binary(value), len(value), now))
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?)', rows)
+            if self.max_size is not None:
+                self._evict(connection)
+
+    def _evict(self, connection):
+        """
+        Remove least recently used entries until the total size of cached
+        values is at most self.max_size.
+
+        Parameters
+        ----------
+        connection : sqlite3.Connection
+            Database connection.
+        """
+        total, = connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM features').fetchone()
+        if total <= self.max_size:
+            return
+        remove = []
+        for key, size in connection.execute(
+                'SELECT key, size FROM features ORDER BY accessed'):
+            if total <= self.max_size:
+                break
+            remove.append((key,))
+            total -= size
+        connection.executemany('DELETE FROM features WHERE key=?', remove)
+
+    def featurize(self, featurizer, mols, featurizer_kwargs=None,
+                  **kwargs):
+        """
+        Calculate features for molecules, only featurizing molecules that
+        are not in the cache.
+
+        Featurizers that are not deterministic (see
+        Featurizer.is_deterministic) bypass the cache.
+
+        Parameters
+        ----------
+        featurizer : Featurizer
+            Featurizer.
+        mols : array_like
+            Molecules.
+        featurizer_kwargs : dict, optional
+            Arguments used to construct the featurizer (part of the cache
+            key).
+        kwargs : dict, optional
+            Keyword arguments for featurizer.featurize.
+
+        Returns
+        -------
+        Features, as returned by featurizer.featurize.
+        """
+        if not featurizer.is_deterministic():
+            return featurizer.featurize(mols, **kwargs)
+        mols = np.asarray(mols)
+        keys = [self.get_key(mol, featurizer, featurizer_kwargs)
+                for mol in mols]
+        cached = self.get(keys)
+        miss = [i for i, key in enumerate(keys) if key not in cached]
+        if len(miss):
+            features = featurizer.featurize(mols[miss], **kwargs)
+            rows = []
+            for i, index in enumerate(miss):
+                row = features[i]
+                if featurizer.conformers and np.ma.isMaskedArray(row):
+                    # remove padding for conformers of other molecules
+                    row = row[:max(mols[index].GetNumConformers(), 1)]
+                rows.append(row)
+                cached[keys[index]] = row
+            self.put([keys[index] for index in miss], rows)
+        rows = [cached[key] for key in keys]
+        if featurizer.conformers:
+            return featurizer.conformer_container(mols, rows)
+        if len(rows) and sp.issparse(rows[0]):
+            return sp.vstack(rows, format='csr')
+        return np.asarray(rows)
+
+
+def get_conformer_hash(mol, decimals=3):
+    """
+    Hash conformer coordinates in canonical atom order.
+
+    Parameters
+    ----------
+    mol : RDKit Mol
+        Molecule. Chem.MolToSmiles must have been called on this molecule
+        so the canonical atom order is available.
+    decimals : int, optional (default 3)
+        Number of decimal places to keep when rounding coordinates.
+    """
+    order = mol.GetProp('_smilesAtomOutputOrder')
+    order = [int(i) for i in order.strip('[]').split(',') if i]
+    h = hashlib.sha1()
+    for conf in mol.GetConformers():
+        coords = np.asarray([list(conf.GetAtomPosition(i)) for i in order],
+                            dtype=float)
+        coords = np.round(coords, decimals) + 0.  # avoid negative zeros
+        h.update(coords.tostring())
+    return h.hexdigest()
@@ -7,6 +7,8 @@ __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "BSD 3-clause"
 
 import h5py
+import numpy as np
+from scipy import sparse as sp
 
 save_options = {'chunks': True,
                 'fletcher32': True,
@@ -40,3 +42,209 @@ def dump(data, filename, attrs=None, options=None):
                 if value is None:
                     value = 'None'
                 f.attrs[key] = value
+
+
+class ChunkedH5Writer(object):
+    """
+    Append data to resizable, chunked HDF5 datasets.
+
+    Each call to append extends the datasets along the first axis, so
+    large datasets can be written batch by batch without holding all of
+    the data in memory. Datasets are created on the first append.
+
+    Masked arrays (such as conformer features) are stored as a dataset
+    containing the filled data and a boolean '<key>_mask' dataset. For
+    masked arrays, all axes are resizable; if a later batch has a larger
+    shape along any trailing axis (e.g. more conformers), the existing
+    data is padded and the padding is masked.
+
+    Object arrays whose elements are numeric arrays (such as packed Coulomb
+    matrices) are stored as variable-length arrays of the flattened values,
+    with the original shapes in a '<key>_shape' dataset. Other string (or
+    object) arrays are stored as variable-length strings. None values are
+    stored as empty strings.
+
+    Sparse matrices are stored in CSR format as a '<key>' group containing
+    'data', 'indices', and 'indptr' datasets, with the matrix shape in the
+    'shape' attribute of the group.
+
+    Parameters
+    ----------
+    filename : str
+        Output filename.
+    attrs : dict, optional
+        HDF5 attributes to set for the file.
+    options : dict, optional
+        Keyword arguments to create_dataset. Defaults to save_options.
+    mode : str, optional (default 'w')
+        Mode used to open the file.
+    """
+    def __init__(self, filename, attrs=None, options=None, mode='w'):
+        if options is None:
+            options = save_options
+        self.options = options
+        self.f = h5py.File(filename, mode)
+        if attrs is not None:
+            for key, value in attrs.items():
+                if value is None:
+                    value = 'None'
+                self.f.attrs[key] = value
+
+    def __enter__(self):
+        """
+        Context manager entrance.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        Context manager exit. Closes the file.
+
+        Parameters
+        ----------
+        exc_type : class
+            Exception class that caused the context to exit.
+        exc_val : object
+            Exception that caused the context to exit.
+        exc_tb : traceback
+            Exception traceback.
+        """
+        self.close()
+
+    def close(self):
+        """
+        Close the file.
+        """
+        if self.f is not None:
+            self.f.close()
+        self.f = None
+
+    def append(self, data):
+        """
+        Append data to datasets.
+
+        Parameters
+        ----------
+        data : dict
+            Datasets to extend. Values must have the same length along the
+            first axis.
+        """
+        for key, value in data.items():
+            if sp.issparse(value):
+                self._append_sparse(key, value)
+            elif np.ma.isMaskedArray(value):
+                mask = np.ma.getmaskarray(value)
+                value = value.filled(0)
+                self._append(key, value, resize_all=True)
+                self._append(key + '_mask', mask, resize_all=True,
+                             fillvalue=True)
+            else:
+                value = np.asarray(value)
+                if value.dtype == object and len(value) and all(
+                        isinstance(v, np.ndarray) for v in value):
+                    shapes = np.asarray([v.shape for v in value], dtype=int)
+                    flat = np.empty(len(value), dtype=object)
+                    for i, v in enumerate(value):
+                        flat[i] = v.ravel()
+                    dtype = h5py.special_dtype(vlen=value[0].dtype)
+                    self._append(key, flat, dtype=dtype, ragged=True)
+                    self._append(key + '_shape', shapes)
+                    continue
+                if value.dtype.kind in ['O', 'S', 'U']:
+                    value = np.asarray(
+                        ['' if v is None else str(v) for v in value],
+                        dtype=object)
+                    dtype = h5py.special_dtype(vlen=str)
+                    self._append(key, value, dtype=dtype)
+                    continue
+                self._append(key, value)
+
+    def _append_sparse(self, key, value):
+        """
+        Append rows of a sparse matrix to a CSR group, creating it if
+        necessary.
+
+        Parameters
+        ----------
+        key : str
+            Group name.
+        value : sparse matrix
+            Rows to append.
+        """
+        value = sp.csr_matrix(value)
+        indptr = value.indptr.astype(np.int64)
+        n_rows = 0
+        if key in self.f:
+            n_rows, n_cols = self.f[key].attrs['shape']
+            if n_cols != value.shape[1]:
+                raise ValueError(
+                    "Shape mismatch for '{}': {} vs. {}.".format(
+                        key, n_cols, value.shape[1]))
+
+            # offset row pointers by the number of stored elements
+            indptr = indptr[1:] + self.f[key]['indptr'][-1]
+        self._append(key + '/data', value.data)
+        self._append(key + '/indices', value.indices.astype(np.int64))
+        self._append(key + '/indptr', indptr)
+        self.f[key].attrs['shape'] = (n_rows + value.shape[0], value.shape[1])
+
+    def _append(self, key, value, dtype=None, resize_all=False,
+                fillvalue=None, ragged=False):
+        """
+        Append an array to a dataset, creating it if necessary.
+
+        Parameters
+        ----------
+        key : str
+            Dataset name.
+        value : ndarray
+            Data to append.
+        dtype : numpy dtype, optional
+            Dataset dtype. If provided, the dataset is treated as
+            variable-length data. Defaults to the dtype of value.
+        resize_all : bool, optional (default False)
+            Whether trailing axes are resizable.
+        fillvalue : object, optional
+            Fill value for unwritten (padded) dataset elements.
+        ragged : bool, optional (default False)
+            Whether value is an object array of 1D arrays. These are
+            written one element at a time, since h5py would otherwise
+            convert arrays with equal lengths to a single 2D array.
+        """
+        if key not in self.f:
+            if dtype is not None:
+                # filters only compress pointers for variable-length data
+                options = {'chunks': True}
+            else:
+                dtype = value.dtype
+                options = self.options
+            if resize_all:
+                maxshape = tuple(None for _ in value.shape)
+            else:
+                maxshape = (None,) + value.shape[1:]
+            if ragged:
+                self.f.create_dataset(key, shape=(0,), dtype=dtype,
+                                      maxshape=maxshape, **options)
+            else:
+                self.f.create_dataset(key, data=value, dtype=dtype,
+                                      maxshape=maxshape, fillvalue=fillvalue,
+                                      **options)
+                return
+        dataset = self.f[key]
+        if dataset.shape[1:] != value.shape[1:]:
+            if not resize_all:
+                raise ValueError(
+                    "Shape mismatch for '{}': {} vs. {}.".format(
+                        key, dataset.shape[1:], value.shape[1:]))
+            shape = tuple(max(a, b) for a, b in zip(dataset.shape[1:],
+                                                    value.shape[1:]))
+            dataset.resize((dataset.shape[0],) + shape)
+        start = dataset.shape[0]
+        dataset.resize((start + value.shape[0],) + dataset.shape[1:])
+        if ragged:
+            for i, v in enumerate(value):
+                dataset[start + i] = v
+            return
+        index = ((slice(start, start + value.shape[0]),) +
+                 tuple(slice(0, n) for n in value.shape[1:]))
+        dataset[index] = value
@@ -6,8 +6,11 @@ __author__ = "Steven Kearnes"
 __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "BSD 3-clause"
 
+import os
+import shutil
 from StringIO import StringIO
 import subprocess
+import tempfile
 
 from rdkit import Chem
 
@@ -51,6 +54,138 @@ class Ionizer(object):
         else:
             return self._ionize_2d(mol)
 
+    def ionize_batch(self, mols):
+        """
+        Ionize several molecules while preserving 3D coordinates.
+
+        Molecules are piped through one Open Babel process for molecules
+        with conformers and one for molecules without conformers, instead
+        of one process per molecule. Results are mapped back to input
+        molecules using their positions, so a failed molecule does not
+        affect the others.
+
+        Parameters
+        ----------
+        mols : iterable
+            Molecules.
+
+        Returns
+        -------
+        A list containing the ionized molecule for each input molecule, or
+        None if ionization failed.
+        """
+        mols = list(mols)
+        rval = [None] * len(mols)
+        flat = [i for i, mol in enumerate(mols) if not mol.GetNumConformers()]
+        embedded = [i for i, mol in enumerate(mols) if mol.GetNumConformers()]
+        for indices, method in [(flat, self._ionize_2d_batch),
+                                (embedded, self._ionize_3d_batch)]:
+            if not len(indices):
+                continue
+            ionized_mols = method([mols[i] for i in indices])
+            for i, ionized_mol in zip(indices, ionized_mols):
+                rval[i] = ionized_mol
+        return rval
+
+    def _ionize_2d_batch(self, mols):
+        """
+        Ionize several molecules without preserving conformers.
+
+        Each SMILES is given its index in mols as a title, which Open Babel
+        writes alongside the ionized SMILES.
+
+        Note: this method removes explicit hydrogens from the molecules.
+
+        Parameters
+        ----------
+        mols : list
+            Molecules.
+        """
+        smiles = ''
+        for i, mol in enumerate(mols):
+            smiles += '{}\t{}\n'.format(
+                Chem.MolToSmiles(mol, isomericSmiles=True, canonical=True), i)
+        args = ['obabel', '-i', 'can', '-o', 'can', '-p', str(self.pH)]
+        p = subprocess.Popen(args, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        ionized_smiles, _ = p.communicate(smiles)
+        rval = [None] * len(mols)
+        for line in ionized_smiles.splitlines():
+            fields = line.split()
+            if len(fields) != 2 or not fields[1].isdigit():
+                continue
+            index = int(fields[1])
+            if index < len(mols):
+                rval[index] = Chem.MolFromSmiles(fields[0])
+        return rval
+
+    def _ionize_3d_batch(self, mols):
+        """
+        Ionize several molecules while preserving conformers.
+
+        The title of each conformer is replaced with the index of its
+        molecule in mols so ionized conformers can be grouped by molecule.
+        Original molecule names are restored afterward.
+
+        Parameters
+        ----------
+        mols : list
+            Molecules.
+        """
+        sdf = ''
+        for i, mol in enumerate(mols):
+            assert mol.GetNumConformers() > 0
+            for conf in mol.GetConformers():
+                block = Chem.MolToMolBlock(mol, confId=conf.GetId(),
+                                           includeStereo=True)
+                sdf += '{}\n'.format(i) + block.split('\n', 1)[1]
+                sdf += '$$$$\n'
+        args = ['obabel', '-i', 'sdf', '-o', 'sdf', '-p', str(self.pH)]
+        p = subprocess.Popen(args, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        ionized_sdf, _ = p.communicate(sdf)
+
+        # read each conformer separately so errors only affect one molecule
+        ionized = {}
+        failed = set()
+        for block in ionized_sdf.split('$$$$\n'):
+            if not block.strip():
+                continue
+            reader = serial.MolReader(StringIO(block + '$$$$\n'),
+                                      mol_format='sdf', remove_salts=False)
+            try:
+                conf_mols = list(reader.get_mols())
+            except RuntimeError:  # catch pre-condition violations
+                title = block.split('\n', 1)[0].strip()
+                if title.isdigit():
+                    failed.add(int(title))
+                continue
+            for conf_mol in conf_mols:
+                title = conf_mol.GetProp('_Name')
+                if not title.isdigit():
+                    continue
+                index = int(title)
+                if index not in ionized:
+                    ionized[index] = conf_mol
+                else:
+                    for conf in conf_mol.GetConformers():
+                        ionized[index].AddConformer(conf, assignId=True)
+
+        rval = []
+        for i, mol in enumerate(mols):
+            ionized_mol = ionized.get(i)
+            if i in failed or ionized_mol is None:
+                rval.append(None)
+                continue
+            if mol.HasProp('_Name'):
+                ionized_mol.SetProp('_Name', mol.GetProp('_Name'))
+            else:
+                ionized_mol.ClearProp('_Name')
+            rval.append(ionized_mol)
+        return rval
+
     def _ionize_2d(self, mol):
         """
         Ionize a molecule without preserving conformers.
@@ -165,6 +300,54 @@ class MolImage(object):
         im = image_utils.load(png)
         return im
 
+    def depict_batch(self, mols):
+        """
+        Generate PNG images for several molecules with one Open Babel
+        process.
+
+        Open Babel writes each image to a separate file (using the -m flag).
+        If the number of images does not match the number of molecules (for
+        example, if a molecule could not be parsed), molecules are depicted
+        individually instead.
+
+        Parameters
+        ----------
+        mols : iterable
+            Molecules.
+        """
+        mols = list(mols)
+        if not len(mols):
+            return []
+        smiles = ''
+        for mol in mols:
+            smiles += Chem.MolToSmiles(mol, isomericSmiles=True,
+                                       canonical=True) + '\n'
+        temp_dir = tempfile.mkdtemp()
+        try:
+            args = ['obabel', '-i', 'can', '-o', 'png', '-O',
+                    os.path.join(temp_dir, 'mol.png'), '-m', '-xd', '-xC',
+                    '-xp {}'.format(self.size)]
+            p = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+            p.communicate(smiles)
+
+            # output files are numbered starting from one
+            filenames = [os.path.join(temp_dir, 'mol{}.png'.format(i + 1))
+                         for i in xrange(len(mols))]
+            extra = os.path.join(temp_dir, 'mol{}.png'.format(len(mols) + 1))
+            if (not all(os.path.exists(f) for f in filenames) or
+                    os.path.exists(extra)):
+                return [self.depict(mol) for mol in mols]
+            images = []
+            for filename in filenames:
+                im = image_utils.load(filename)
+                im.load()  # read pixels before the file is removed
+                images.append(im)
+        finally:
+            shutil.rmtree(temp_dir)
+        return images
+
 
 class IonizerError(Exception):
     """
@@ -46,15 +46,35 @@ class ConformerGenerator(object):
         conformer pool. Since conformers are pruned after energy
         minimization, increasing the size of the pool increases the chance
         of identifying max_conformers unique conformers.
+    symmetric_rmsd : bool, optional (default True)
+        Whether to use symmetry-aware RMSD (AllChem.GetBestRMS) for pruning.
+        If False, heavy-atom RMSD is calculated for all conformer pairs at
+        once using the Kabsch algorithm. This is much faster, but only
+        considers the atom ordering in the molecule, so conformers that are
+        equivalent under symmetry (such as phenyl ring flips) are not
+        treated as duplicates. Conformers that differ only in the positions
+        of hydrogens (such as methyl rotations) are treated as duplicates.
+    lazy_pruning : bool, optional (default True)
+        Whether to calculate RMSD during pruning only for conformers that
+        are compared to already-selected conformers, stopping once
+        max_conformers are selected. If False, the full conformer RMSD
+        matrix is calculated first. Both give the same conformers.
+    num_threads : int, optional (default 1)
+        Number of threads to use for embedding and minimization. If 0, all
+        available threads are used.
     """
     def __init__(self, max_conformers=1, rmsd_threshold=0.5, force_field='uff',
-                 pool_multiplier=10):
+                 pool_multiplier=10, symmetric_rmsd=True, lazy_pruning=True,
+                 num_threads=1):
         self.max_conformers = max_conformers
         if rmsd_threshold is None or rmsd_threshold < 0:
             rmsd_threshold = -1.
         self.rmsd_threshold = rmsd_threshold
         self.force_field = force_field
         self.pool_multiplier = pool_multiplier
+        self.symmetric_rmsd = symmetric_rmsd
+        self.lazy_pruning = lazy_pruning
+        self.num_threads = num_threads
 
     def __call__(self, mol):
         """
@@ -92,8 +112,8 @@ class ConformerGenerator(object):
             raise RuntimeError(msg)
 
         # minimization and pruning
-        self.minimize_conformers(mol)
-        mol = self.prune_conformers(mol)
+        energies = self.minimize_conformers(mol)
+        mol = self.prune_conformers(mol, energies)
 
         return mol
 
@@ -108,7 +128,8 @@ class ConformerGenerator(object):
         """
         mol = Chem.AddHs(mol)  # add hydrogens
         n_confs = self.max_conformers * self.pool_multiplier
-        AllChem.EmbedMultipleConfs(mol, numConfs=n_confs, pruneRmsThresh=-1.)
+        AllChem.EmbedMultipleConfs(mol, numConfs=n_confs, pruneRmsThresh=-1.,
+                                   numThreads=self.num_threads)
         return mol
 
     def get_molecule_force_field(self, mol, conf_id=None, **kwargs):
@@ -130,7 +151,7 @@ class ConformerGenerator(object):
         elif self.force_field.startswith('mmff'):
             AllChem.MMFFSanitizeMolecule(mol)
             mmff_props = AllChem.MMFFGetMoleculeProperties(
-                mol, mmffVariant=self.force_field)
+                mol, mmffVariant=self.get_mmff_variant())
             ff = AllChem.MMFFGetMoleculeForceField(
                 mol, mmff_props, confId=conf_id, **kwargs)
         else:
@@ -138,18 +159,56 @@ class ConformerGenerator(object):
                              "'{}'.".format(self.force_field))
         return ff
 
+    def get_mmff_variant(self):
+        """
+        Get the RDKit name for the MMFF variant given by force_field.
+        """
+        variants = {'mmff94': 'MMFF94', 'mmff94s': 'MMFF94s'}
+        if self.force_field not in variants:
+            raise ValueError("Invalid force_field " +
+                             "'{}'.".format(self.force_field))
+        return variants[self.force_field]
+
     def minimize_conformers(self, mol):
         """
         Minimize molecule conformers.
 
+        All conformers are minimized in a single call, using num_threads
+        threads. Raises ValueError if the force field cannot be set up for
+        the molecule.
+
         Parameters
         ----------
         mol : RDKit Mol
             Molecule.
+
+        Returns
+        -------
+        energies : ndarray
+            Minimized conformer energies.
         """
-        for conf in mol.GetConformers():
-            ff = self.get_molecule_force_field(mol, conf_id=conf.GetId())
-            ff.Minimize()
+        if self.force_field == 'uff':
+            results = AllChem.UFFOptimizeMoleculeConfs(
+                mol, numThreads=self.num_threads)
+        elif self.force_field.startswith('mmff'):
+            AllChem.MMFFSanitizeMolecule(mol)
+            results = AllChem.MMFFOptimizeMoleculeConfs(
+                mol, numThreads=self.num_threads,
+                mmffVariant=self.get_mmff_variant())
+        else:
+            raise ValueError("Invalid force_field " +
+                             "'{}'.".format(self.force_field))
+
+        # results are (not_converged, energy) for each conformer
+        # not_converged is -1 if the force field could not be set up
+        energies = np.zeros(len(results), dtype=float)
+        for i, (not_converged, energy) in enumerate(results):
+            if not_converged == -1:
+                raise ValueError(
+                    "Could not set up force field '{}'.".format(
+                        self.force_field))
+            energies[i] = energy
+        return energies
 
     def get_conformer_energies(self, mol):
         """
@@ -173,7 +232,7 @@ class ConformerGenerator(object):
         energies = np.asarray(energies, dtype=float)
         return energies
 
-    def prune_conformers(self, mol):
+    def prune_conformers(self, mol, energies=None):
         """
         Prune conformers from a molecule using an RMSD threshold, starting
         with the lowest energy conformer.
@@ -182,6 +241,10 @@ class ConformerGenerator(object):
         ----------
         mol : RDKit Mol
             Molecule.
+        energies : array_like, optional
+            Conformer energies, such as those returned by
+            minimize_conformers. If not provided, energies are calculated
+            with get_conformer_energies.
 
         Returns
         -------
@@ -190,12 +253,17 @@ class ConformerGenerator(object):
         """
         if self.rmsd_threshold < 0 or mol.GetNumConformers() <= 1:
             return mol
-        energies = self.get_conformer_energies(mol)
-        rmsd = self.get_conformer_rmsd(mol)
+        if energies is None:
+            energies = self.get_conformer_energies(mol)
+        if self.lazy_pruning:
+            rmsd = None
+            if not self.symmetric_rmsd:
+                coords = self.get_conformer_coords(mol, heavy_atoms=True)
+        else:
+            rmsd = self.get_conformer_rmsd(mol, symmetric=self.symmetric_rmsd)
 
         sort = np.argsort(energies)  # sort by increasing energy
         keep = []  # always keep lowest-energy conformer
-        discard = []
         for i in sort:
 
             # always keep lowest-energy conformer
@@ -205,17 +273,21 @@ class ConformerGenerator(object):
 
             # discard conformers after max_conformers is reached
             if len(keep) >= self.max_conformers:
-                discard.append(i)
-                continue
+                break
 
             # get RMSD to selected conformers
-            this_rmsd = rmsd[i][np.asarray(keep, dtype=int)]
+            if rmsd is not None:
+                this_rmsd = rmsd[i][np.asarray(keep, dtype=int)]
+            elif self.symmetric_rmsd:
+                this_rmsd = self.get_best_rmsd(mol, i, keep)
+            else:
+                this_rmsd = self.get_kabsch_rmsd(
+                    coords[keep + [i]],
+                    pairs=(np.arange(len(keep)), [len(keep)] * len(keep)))
 
             # discard conformers within the RMSD threshold
             if np.all(this_rmsd >= self.rmsd_threshold):
                 keep.append(i)
-            else:
-                discard.append(i)
 
         # create a new molecule to hold the chosen conformers
         # this ensures proper conformer IDs and energy-based ordering
@@ -228,7 +300,7 @@ class ConformerGenerator(object):
         return new
 
     @staticmethod
-    def get_conformer_rmsd(mol):
+    def get_conformer_rmsd(mol, symmetric=True):
         """
         Calculate conformer-conformer RMSD.
 
@@ -236,14 +308,122 @@ class ConformerGenerator(object):
         ----------
         mol : RDKit Mol
             Molecule.
+        symmetric : bool, optional (default True)
+            Whether to use AllChem.GetBestRMS for each conformer pair, which
+            considers symmetry-equivalent atom mappings. If False, RMSD is
+            calculated for heavy atoms only, for all pairs at once with
+            get_kabsch_rmsd.
         """
+        if not symmetric:
+            coords = ConformerGenerator.get_conformer_coords(
+                mol, heavy_atoms=True)
+            return ConformerGenerator.get_kabsch_rmsd(coords)
         rmsd = np.zeros((mol.GetNumConformers(), mol.GetNumConformers()),
                         dtype=float)
-        for i, ref_conf in enumerate(mol.GetConformers()):
-            for j, fit_conf in enumerate(mol.GetConformers()):
-                if i >= j:
-                    continue
-                rmsd[i, j] = AllChem.GetBestRMS(mol, mol, ref_conf.GetId(),
-                                                fit_conf.GetId())
-                rmsd[j, i] = rmsd[i, j]
+        for i in xrange(mol.GetNumConformers()):
+            others = np.arange(i + 1, mol.GetNumConformers())
+            rmsd[i, others] = ConformerGenerator.get_best_rmsd(mol, i, others)
+            rmsd[others, i] = rmsd[i, others]
+        return rmsd
+
+    @staticmethod
+    def get_best_rmsd(mol, index, others):
+        """
+        Calculate symmetry-aware RMSD (AllChem.GetBestRMS) between one
+        conformer and a set of other conformers.
+
+        Each pair is aligned with the lower conformer index as the
+        reference, so values match those in get_conformer_rmsd.
+
+        Parameters
+        ----------
+        mol : RDKit Mol
+            Molecule.
+        index : int
+            Conformer index (not ID).
+        others : array_like
+            Indices (not IDs) of conformers to compare to.
+        """
+        conf_ids = [conf.GetId() for conf in mol.GetConformers()]
+        rmsd = np.zeros(len(others), dtype=float)
+        for k, other in enumerate(others):
+            i, j = min(index, other), max(index, other)
+            rmsd[k] = AllChem.GetBestRMS(mol, mol, conf_ids[i], conf_ids[j])
+        return rmsd
+
+    @staticmethod
+    def get_conformer_coords(mol, heavy_atoms=False):
+        """
+        Get atom coordinates for all conformers of a molecule.
+
+        Parameters
+        ----------
+        mol : RDKit Mol
+            Molecule.
+        heavy_atoms : bool, optional (default False)
+            Whether to only include heavy atoms.
+
+        Returns
+        -------
+        An array with shape (n_confs, n_atoms, 3).
+        """
+        atoms = [atom.GetIdx() for atom in mol.GetAtoms()
+                 if not heavy_atoms or atom.GetAtomicNum() > 1]
+        coords = np.zeros((mol.GetNumConformers(), len(atoms), 3),
+                          dtype=float)
+        for i, conf in enumerate(mol.GetConformers()):
+            for j, atom in enumerate(atoms):
+                coords[i, j] = list(conf.GetAtomPosition(atom))
+        return coords
+
+    @staticmethod
+    def get_kabsch_rmsd(coords, pairs=None, batch_size=10000):
+        """
+        Calculate RMSD between all pairs of coordinate sets after optimal
+        superposition.
+
+        Superposition uses the Kabsch algorithm: the optimal rotation for
+        each pair is obtained from the singular value decomposition of the
+        3x3 covariance matrix, so the RMSD can be calculated from the
+        singular values without rotating any coordinates. All pairs are
+        handled together with batched array operations.
+
+        Parameters
+        ----------
+        coords : array_like
+            Coordinates with shape (n_confs, n_atoms, 3).
+        pairs : tuple, optional
+            Arrays (i, j) of conformer indices. If provided, RMSD is only
+            calculated for these pairs and returned as a 1D array. Otherwise,
+            the full RMSD matrix is returned.
+        batch_size : int, optional (default 10000)
+            Maximum number of pairs to handle at once.
+        """
+        coords = np.array(coords, dtype=float)
+        n_confs, n_atoms = coords.shape[:2]
+        coords -= np.mean(coords, axis=1)[:, np.newaxis]
+        sq = np.sum(coords ** 2, axis=(1, 2))
+        if pairs is None:
+            i, j = np.triu_indices(n_confs, k=1)
+        else:
+            i, j = [np.asarray(idx, dtype=int) for idx in pairs]
+
+        values = np.zeros(len(i), dtype=float)
+        for start in xrange(0, len(i), batch_size):
+            stop = start + batch_size
+            this_i, this_j = i[start:stop], j[start:stop]
+
+            # covariance matrix for each pair
+            cov = np.einsum('pak,pal->pkl', coords[this_i], coords[this_j])
+            u, s, vt = np.linalg.svd(cov)
+
+            # correct for reflections
+            s[:, -1] *= np.sign(np.linalg.det(u) * np.linalg.det(vt))
+            msd = (sq[this_i] + sq[this_j] - 2 * np.sum(s, axis=1)) / n_atoms
+            values[start:stop] = np.sqrt(np.maximum(msd, 0))
+        if pairs is not None:
+            return values
+        rmsd = np.zeros((n_confs, n_confs), dtype=float)
+        rmsd[i, j] = values
+        rmsd[j, i] = values
         return rmsd
@@ -5,6 +5,7 @@ import numpy as np
 import unittest
 
 from rdkit import Chem
+from rdkit.Chem import AllChem
 
 from vs_utils.utils.rdkit_utils import conformers
 
@@ -63,12 +64,41 @@ class TestConformerGenerator(unittest.TestCase):
         mol = self.engine.embed_molecule(self.mol)
         assert mol.GetNumConformers() > 0
         start = self.engine.get_conformer_energies(mol)
-        self.engine.minimize_conformers(mol)
+        energies = self.engine.minimize_conformers(mol)
         finish = self.engine.get_conformer_energies(mol)
 
         # check that all minimized energies are lower
         assert np.all(start > finish), (start, finish)
 
+        # check that returned energies match minimized conformers
+        assert np.allclose(energies, finish)
+
+    def test_minimize_conformers_failure(self):
+        """
+        Test that force field setup failures raise an error instead of
+        returning placeholder energies.
+        """
+        mol = Chem.MolFromSmiles('OB(O)c1ccccc1')  # no MMFF boron types
+        engine = conformers.ConformerGenerator(force_field='mmff94')
+        mol = engine.embed_molecule(mol)
+        assert mol.GetNumConformers() > 0
+        with self.assertRaises(ValueError):
+            engine.minimize_conformers(mol)
+
+    def test_num_threads(self):
+        """
+        Generate conformers with multiple threads.
+        """
+        for force_field in ['uff', 'mmff94']:
+            engine = conformers.ConformerGenerator(
+                max_conformers=3, force_field=force_field, num_threads=2)
+            mol = engine.embed_molecule(self.mol)
+            assert mol.GetNumConformers() > 0
+            energies = engine.minimize_conformers(mol)
+            assert np.allclose(energies, engine.get_conformer_energies(mol))
+            mol = engine.prune_conformers(mol, energies)
+            assert 0 < mol.GetNumConformers() <= engine.max_conformers
+
     def test_get_conformer_energies(self):
         """
         Test ConformerGenerator.get_conformer_energies.
@@ -112,6 +142,37 @@ class TestConformerGenerator(unittest.TestCase):
         sort = np.argsort(pruned_energies)
         assert np.array_equal(sort, np.arange(len(pruned_energies))), sort
 
+    def test_prune_conformers_symmetric(self):
+        """
+        Test that default pruning of a symmetric molecule selects the same
+        conformers as pruning with the full AllChem.GetBestRMS matrix.
+        """
+        mol = Chem.MolFromSmiles('CC(C)Cc1ccc(cc1)C(C)C(=O)O')  # ibuprofen
+        engine = conformers.ConformerGenerator(max_conformers=5)
+        mol = engine.embed_molecule(mol)
+        energies = engine.minimize_conformers(mol)
+
+        # reference pruning (GetBestRMS aligns conformers in place)
+        ref = Chem.Mol(mol)
+        conf_ids = [conf.GetId() for conf in ref.GetConformers()]
+        rmsd = np.zeros((len(conf_ids), len(conf_ids)), dtype=float)
+        for i in xrange(len(conf_ids)):
+            for j in xrange(i + 1, len(conf_ids)):
+                rmsd[i, j] = AllChem.GetBestRMS(ref, ref, conf_ids[i],
+                                                conf_ids[j])
+                rmsd[j, i] = rmsd[i, j]
+        keep = []
+        for i in np.argsort(energies):
+            if len(keep) >= engine.max_conformers:
+                break
+            if np.all(rmsd[i, keep] >= engine.rmsd_threshold):
+                keep.append(i)
+
+        pruned = engine.prune_conformers(mol, energies)
+        assert pruned.GetNumConformers() == len(keep)
+        assert np.allclose(engine.get_conformer_energies(pruned),
+                           energies[keep])
+
     def test_get_conformer_rmsd(self):
         """
         Test ConformerGenerator.get_conformer_rmsd.
@@ -130,3 +191,76 @@ class TestConformerGenerator(unittest.TestCase):
 
         # check for non-zero off-diagonal values
         assert np.all(rmsd[np.triu_indices_from(rmsd, k=1)] > 0), rmsd
+
+    def test_get_conformer_rmsd_kabsch(self):
+        """
+        Compare heavy-atom Kabsch RMSD to RDKit alignment.
+        """
+        engine = conformers.ConformerGenerator(max_conformers=5)
+        mol = engine.embed_molecule(self.mol)
+        assert mol.GetNumConformers() > 1
+        rmsd = engine.get_conformer_rmsd(mol, symmetric=False)
+
+        # compare to RDKit RMSD without symmetry (this modifies conformers)
+        ref = Chem.RemoveHs(mol)
+        conf_ids = [conf.GetId() for conf in ref.GetConformers()]
+        for i in xrange(len(conf_ids)):
+            for j in xrange(i + 1, len(conf_ids)):
+                value = AllChem.GetConformerRMS(ref, conf_ids[i], conf_ids[j])
+                assert np.allclose(rmsd[i, j], value), (rmsd[i, j], value)
+
+    def test_get_conformer_rmsd_hydrogens(self):
+        """
+        Test that conformers differing only by a methyl rotation have zero
+        Kabsch RMSD.
+        """
+        engine = conformers.ConformerGenerator(max_conformers=1)
+        mol = engine.embed_molecule(self.mol)
+        ref_conf = Chem.Conformer(mol.GetConformer(0))
+        conf = Chem.Conformer(mol.GetConformer(0))
+
+        # permute hydrogen positions on a methyl carbon
+        methyl = [atom for atom in mol.GetAtoms()
+                  if atom.GetAtomicNum() == 6 and
+                  atom.GetTotalNumHs(includeNeighbors=True) == 3]
+        assert len(methyl)
+        hydrogens = [n.GetIdx() for n in methyl[0].GetNeighbors()
+                     if n.GetAtomicNum() == 1]
+        positions = [conf.GetAtomPosition(i) for i in hydrogens]
+        for i, position in zip(hydrogens, positions[1:] + positions[:1]):
+            conf.SetAtomPosition(i, position)
+        mol.RemoveAllConformers()
+        mol.AddConformer(ref_conf, assignId=True)
+        mol.AddConformer(conf, assignId=True)
+        rmsd = engine.get_conformer_rmsd(mol, symmetric=False)
+        assert np.allclose(rmsd, 0)
+
+    def test_lazy_pruning(self):
+        """
+        Test that lazy pruning selects the same conformers as pruning with
+        the full RMSD matrix.
+        """
+        for symmetric in [False, True]:
+            engine = conformers.ConformerGenerator(
+                max_conformers=5, symmetric_rmsd=symmetric)
+            mol = engine.embed_molecule(self.mol)
+            energies = engine.minimize_conformers(mol)
+            pruned = []
+            for lazy in [False, True]:
+                engine.lazy_pruning = lazy
+                pruned.append(engine.prune_conformers(Chem.Mol(mol),
+                                                      energies))
+            assert pruned[0].GetNumConformers() > 1
+            assert pruned[0].GetNumConformers() == pruned[1].GetNumConformers()
+            assert np.allclose(engine.get_conformer_energies(pruned[0]),
+                               engine.get_conformer_energies(pruned[1]))
+
+            # GetBestRMS aligns conformers, so compare them after
+            # superposition
+            coords = np.concatenate(
+                [engine.get_conformer_coords(m) for m in pruned])
+            n_confs = pruned[0].GetNumConformers()
+            rmsd = engine.get_kabsch_rmsd(
+                coords, pairs=(np.arange(n_confs),
+                               np.arange(n_confs) + n_confs))
+            assert np.allclose(rmsd, 0, atol=1e-4), rmsd
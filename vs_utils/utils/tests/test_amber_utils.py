@@ -3,6 +3,8 @@ Tests for amber_utils.
 """
 from cStringIO import StringIO
 import numpy as np
+import os
+import tempfile
 import unittest
 
 from rdkit import Chem
@@ -41,6 +43,73 @@ class TestAntechamber(TestAmberUtils):
         assert radii.size == 21  # 12 atoms
         assert np.count_nonzero(radii > 0)  # no zero radii
 
+    def test_antechamber_cache(self):
+        """
+        Test Antechamber with a charge cache.
+        """
+        _, filename = tempfile.mkstemp(suffix='.db')
+        try:
+            antechamber = amber_utils.Antechamber(cache=filename)
+            charges, radii = antechamber.get_charges_and_radii(self.mol)
+            assert antechamber.cache.misses == 1
+            cached_charges, cached_radii = antechamber.get_charges_and_radii(
+                self.mol)
+            assert antechamber.cache.hits == 1
+            assert np.array_equal(charges, cached_charges)
+            assert np.array_equal(radii, cached_radii)
+        finally:
+            os.remove(filename)
+
+
+class TestChargeCache(TestAmberUtils):
+    """
+    Test ChargeCache.
+    """
+    def setUp(self):
+        """
+        Set up tests.
+        """
+        super(TestChargeCache, self).setUp()
+        _, self.filename = tempfile.mkstemp(suffix='.db')
+        self.cache = amber_utils.ChargeCache(self.filename)
+        self.charges = np.linspace(-1, 1, self.mol.GetNumAtoms())
+        self.radii = np.linspace(1, 2, self.mol.GetNumAtoms())
+
+    def tearDown(self):
+        """
+        Clean up tests.
+        """
+        os.remove(self.filename)
+
+    def test_get_and_put(self):
+        """
+        Test ChargeCache.get and ChargeCache.put.
+        """
+        assert self.cache.get(self.mol, 'bcc', 0) is None
+        self.cache.put(self.mol, 'bcc', 0, self.charges, self.radii)
+        charges, radii = self.cache.get(self.mol, 'bcc', 0)
+        assert np.array_equal(charges, self.charges)
+        assert np.array_equal(radii, self.radii)
+        assert self.cache.hits == 1
+        assert self.cache.misses == 1
+
+        # different charge types and net charges are separate entries
+        assert self.cache.get(self.mol, 'gas', 0) is None
+        assert self.cache.get(self.mol, 'bcc', 1) is None
+
+        # entries are visible to other cache instances
+        other = amber_utils.ChargeCache(self.filename)
+        assert other.get(self.mol, 'bcc', 0) is not None
+
+    def test_atom_order(self):
+        """
+        Test that molecules with different atom orders are separate entries.
+        """
+        self.cache.put(self.mol, 'bcc', 0, self.charges, self.radii)
+        order = range(self.mol.GetNumAtoms())[::-1]
+        mol = Chem.RenumberAtoms(self.mol, order)
+        assert self.cache.get(mol, 'bcc', 0) is None
+
 
 class TestPBSA(TestAmberUtils):
     """
@@ -86,6 +155,22 @@ END
         # and not be all zeros
         assert np.count_nonzero(grid)
 
+    def test_pbsa_esp_grids(self):
+        """
+        Test PBSA.get_esp_grids with concurrent calculations.
+        """
+        engine = conformers.ConformerGenerator(max_conformers=3)
+        mol = engine.generate_conformers(self.mol)
+        pbsa = amber_utils.PBSA(n_workers=2)
+        results = pbsa.get_esp_grids(mol, self.charges, self.radii)
+        assert len(results) == mol.GetNumConformers()
+
+        # compare to serial calculations
+        for conf, (grid, _) in zip(mol.GetConformers(), results):
+            ref, _ = pbsa.get_esp_grid(mol, self.charges, self.radii,
+                                       conf_id=conf.GetId())
+            assert np.allclose(grid, ref)
+
     def test_pbsa_esp_grid_from_pqr(self):
         """
         Test PBSA.get_esp_grid_from_pqr.
@@ -105,3 +190,39 @@ END
 
         # and not be all zeros
         assert np.count_nonzero(grid)
+
+
+class TestParseEspGrid(unittest.TestCase):
+    """
+    Test PBSA.parse_esp_grid.
+    """
+    def test_parse_esp_grid(self):
+        """
+        Test PBSA.parse_esp_grid.
+        """
+        phi = np.arange(24, dtype=float) / 7.
+        lines = ['# phi grid', '   0.500  -0.750  -1.000  -1.250',
+                 '   2   3   4']
+        for i in xrange(0, phi.size, 6):
+            lines.append(' '.join('{:12.4E}'.format(value)
+                                  for value in phi[i:i + 6]))
+        pbsa = amber_utils.PBSA()
+        grid, center = pbsa.parse_esp_grid(StringIO('\n'.join(lines)))
+        assert grid.dtype == np.float32
+        assert grid.shape == (2, 3, 4)
+        assert np.allclose(grid, np.reshape(phi, (2, 3, 4), order='F'),
+                           atol=1e-4)
+        assert np.allclose(center, (0., 0., 0.))
+
+    def test_parse_truncated_esp_grid(self):
+        """
+        Test PBSA.parse_esp_grid with a truncated grid.
+        """
+        lines = ['   0.500  -0.750  -1.000  -1.250', '   2   3   4',
+                 '1.0 2.0 3.0']
+        pbsa = amber_utils.PBSA()
+        try:
+            pbsa.parse_esp_grid(StringIO('\n'.join(lines)))
+            raise AssertionError
+        except ValueError:
+            pass
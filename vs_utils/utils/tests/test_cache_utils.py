@@ -0,0 +1,138 @@
+"""
+Tests for cache_utils.
+"""
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from rdkit import Chem
+
+from vs_utils.features.basic import MolecularWeight, SimpleDescriptors
+from vs_utils.features.coulomb_matrices import CoulombMatrix
+from vs_utils.utils.cache_utils import FeatureCache
+from vs_utils.utils.rdkit_utils import conformers
+
+
+class TestFeatureCache(unittest.TestCase):
+    """
+    Tests for FeatureCache.
+    """
+    def setUp(self):
+        """
+        Set up tests.
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, 'cache.db')
+        self.cache = FeatureCache(self.filename)
+        smiles = ['CC(=O)OC1=CC=CC=C1C(=O)O', 'CC(C)CC1=CC=C(C=C1)C(C)C(=O)O']
+        self.mols = [Chem.MolFromSmiles(s) for s in smiles]
+
+    def tearDown(self):
+        """
+        Clean up tests.
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def test_featurize(self):
+        """
+        Test that only molecules missing from the cache are featurized.
+        """
+        engine = MolecularWeight()
+        ref = engine(self.mols)
+        rval = self.cache.featurize(engine, self.mols[:1])
+        assert np.allclose(rval, ref[:1])
+        assert self.cache.hits == 0 and self.cache.misses == 1
+        rval = self.cache.featurize(engine, self.mols)
+        assert np.allclose(rval, ref)
+        assert self.cache.hits == 1 and self.cache.misses == 2
+
+        # the cache is persistent
+        cache = FeatureCache(self.filename)
+        rval = cache.featurize(engine, self.mols)
+        assert np.allclose(rval, ref)
+        assert cache.hits == 2 and cache.misses == 0
+
+    def test_featurizer_kwargs(self):
+        """
+        Test that featurizer arguments are part of the cache key.
+        """
+        engine = MolecularWeight()
+        mol = self.mols[0]
+        assert (self.cache.get_key(mol, engine, {'foo': 1}) !=
+                self.cache.get_key(mol, engine, {'foo': 2}))
+        assert (self.cache.get_key(mol, engine, {'foo': 1}) ==
+                self.cache.get_key(Chem.Mol(mol), engine, {'foo': 1}))
+
+    def test_execution_args(self):
+        """
+        Test that execution-only arguments are not part of the cache key.
+        """
+        engine = SimpleDescriptors(descriptors=['ExactMolWt'])
+        mol = self.mols[0]
+        kwargs = {'descriptors': 'ExactMolWt'}
+        key = self.cache.get_key(mol, engine, kwargs)
+        assert self.cache.get_key(
+            mol, engine, dict(kwargs, timing=True)) == key
+        assert self.cache.get_key(
+            mol, engine, dict(kwargs, dtype='float32')) != key
+
+    def test_nondeterministic(self):
+        """
+        Test that randomized features without a seed are not cached.
+        """
+        generator = conformers.ConformerGenerator(max_conformers=1)
+        mols = [generator.generate_conformers(mol) for mol in self.mols]
+        engine = CoulombMatrix(max_atoms=50)
+        assert not engine.is_deterministic()
+        self.cache.featurize(engine, mols)
+        assert self.cache.hits == self.cache.misses == 0
+        keys = [self.cache.get_key(mol, engine) for mol in mols]
+        assert not len(self.cache.get(keys))
+
+        # seeded features are cached
+        engine = CoulombMatrix(max_atoms=50, seed=0)
+        assert engine.is_deterministic()
+        ref = self.cache.featurize(engine, mols)
+        rval = self.cache.featurize(engine, mols)
+        assert self.cache.hits == len(mols)
+        assert np.allclose(rval.filled(0), ref.filled(0))
+
+    def test_conformers(self):
+        """
+        Test cached conformer features.
+        """
+        generator = conformers.ConformerGenerator(max_conformers=3)
+        mols = [generator.generate_conformers(mol) for mol in self.mols]
+        engine = CoulombMatrix(max_atoms=50, randomize=False)
+        ref = engine(mols)
+        self.cache.featurize(engine, mols)
+        rval = self.cache.featurize(engine, mols)
+        assert self.cache.hits == len(mols)
+        assert rval.shape == ref.shape
+        assert np.array_equal(np.ma.getmaskarray(rval),
+                              np.ma.getmaskarray(ref))
+        assert np.allclose(rval.filled(0), ref.filled(0))
+
+        # conformer coordinates are part of the key
+        mol = Chem.Mol(mols[0])
+        key = self.cache.get_key(mol, engine)
+        conf = mol.GetConformer(0)
+        position = conf.GetAtomPosition(0)
+        position.x += 1.
+        conf.SetAtomPosition(0, position)
+        assert self.cache.get_key(mol, engine) != key
+
+    def test_eviction(self):
+        """
+        Test least recently used eviction.
+        """
+        value = np.zeros(100)
+        self.cache.put(['a', 'b'], [value, value])
+        self.cache.get(['a'])  # mark 'a' as recently used
+        size, = self.cache._connect().execute(
+            'SELECT size FROM features WHERE key=?', ('a',)).fetchone()
+        self.cache.max_size = 2 * size
+        self.cache.put(['c'], [value])
+        assert sorted(self.cache.get(['a', 'b', 'c'])) == ['a', 'c']
@@ -4,6 +4,7 @@ Tests for HDF5 utilities.
 import h5py
 import numpy as np
 import os
+from scipy import sparse as sp
 import tempfile
 import unittest
 
@@ -31,3 +32,58 @@ class TestH5Utils(unittest.TestCase):
 
         # cleanup
         os.remove(filename)
+
+    def test_chunked_writer(self):
+        """Test ChunkedH5Writer."""
+        _, filename = tempfile.mkstemp()
+
+        # write two batches
+        a = np.random.random((4, 3))
+        b = np.ma.masked_all((4, 2, 5))
+        b[:, 0] = 1
+        c = np.ma.masked_all((3, 3, 5))
+        c[:, :3] = 2
+        with h5_utils.ChunkedH5Writer(filename) as writer:
+            writer.append({'a': a[:2], 'b': b[:2], 'names': ['x', None]})
+            writer.append({'a': a[2:], 'b': c, 'names': ['y', 'z', 'w']})
+
+        # make sure we can read it
+        with h5py.File(filename) as f:
+            assert np.array_equal(a, f['a'])
+            assert f['b'].shape == (5, 3, 5)
+            assert f['b_mask'].shape == (5, 3, 5)
+            assert np.array_equal(f['names'][:], ['x', '', 'y', 'z', 'w'])
+
+            # check masked padding for the first batch
+            assert np.all(f['b'][:2, 0] == 1)
+            assert np.all(f['b_mask'][:2, 1:])
+            assert not np.any(f['b_mask'][:2, 0])
+
+            # check the second batch
+            assert np.all(f['b'][2:] == 2)
+            assert not np.any(f['b_mask'][2:])
+
+        # cleanup
+        os.remove(filename)
+
+    def test_chunked_writer_sparse(self):
+        """Test ChunkedH5Writer with sparse matrices."""
+        _, filename = tempfile.mkstemp()
+
+        # write two batches
+        a = sp.rand(5, 10, density=0.3, format='csr')
+        with h5_utils.ChunkedH5Writer(filename) as writer:
+            writer.append({'a': a[:2]})
+            writer.append({'a': a[2:]})
+
+        # make sure we can read it
+        with h5py.File(filename) as f:
+            group = f['a']
+            assert tuple(group.attrs['shape']) == a.shape
+            b = sp.csr_matrix(
+                (group['data'][:], group['indices'][:], group['indptr'][:]),
+                shape=tuple(group.attrs['shape']))
+            assert np.array_equal(a.toarray(), b.toarray())
+
+        # cleanup
+        os.remove(filename)
@@ -111,6 +111,30 @@ class TestIonizer(unittest.TestCase):
         except ob_utils.IonizerError:
             pass
 
+    def test_ionize_batch(self):
+        """
+        Test Ionizer.ionize_batch.
+        """
+        flat_mol = Chem.Mol(self.mol)
+        flat_mol.RemoveAllConformers()
+        error_mol = Chem.MolFromSmiles(
+            'CC1=C(C(C(=C(O1)N)C#N)C2=CC3=C(C=C2)OCO3)C(=O)OCC=C')
+        self.mol.SetProp('_Name', 'ibuprofen')
+        mols = [flat_mol, error_mol, self.mol]
+        ionized_mols = self.ionizer.ionize_batch(mols)
+        assert len(ionized_mols) == len(mols)
+        assert ionized_mols[1] is None
+
+        # compare to single-molecule ionization
+        for i in [0, 2]:
+            ref = self.ionizer(mols[i])
+            assert Chem.MolToSmiles(
+                ionized_mols[i], isomericSmiles=True) == Chem.MolToSmiles(
+                    ref, isomericSmiles=True)
+            assert (ionized_mols[i].GetNumConformers() ==
+                    ref.GetNumConformers())
+        assert ionized_mols[2].GetProp('_Name') == 'ibuprofen'
+
 
 class TestMolImage(unittest.TestCase):
     """